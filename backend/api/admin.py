@@ -1,2 +1,63 @@
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import RequestProfile
+from .profiling import delete_profiles
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    """Profiles captured with ?profile=1, see api.profiling"""
+    list_display = ['created_at', 'method', 'endpoint', 'user', 'dataset_id', 'rows', 'status_code', 'duration',
+                    'download']
+    list_filter = ['endpoint', 'method']
+    search_fields = ['path', 'user__username']
+    date_hierarchy = 'created_at'
+    fields = ['id', 'created_at', 'user', 'method', 'path', 'endpoint', 'dataset_id', 'rows', 'status_code',
+              'duration', 'download', 'summary_text']
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<uuid:profile_id>/download/', self.admin_site.admin_view(self.download_view),
+                 name='api_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, profile_id):
+        if not self.has_view_permission(request):
+            raise Http404
+        try:
+            profile = RequestProfile.objects.get(id=profile_id)
+        except RequestProfile.DoesNotExist:
+            raise Http404
+        file_path = Path(settings.PROFILE_DIR) / profile.file
+        if not file_path.exists():
+            raise Http404
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=profile.file,
+                            content_type='application/octet-stream')
+
+    @admin.display(description='Profile')
+    def download(self, profile):
+        url = reverse('admin:api_requestprofile_download', args=[profile.id])
+        return format_html('<a href="{}">{}</a>', url, profile.file)
+
+    @admin.display(description='Hottest calls')
+    def summary_text(self, profile):
+        return format_html('<pre style="font-size: 11px">{}</pre>', profile.summary)
+
+    def delete_model(self, request, obj):
+        delete_profiles(RequestProfile.objects.filter(id=obj.id))
 
+    def delete_queryset(self, request, queryset):
+        delete_profiles(queryset)
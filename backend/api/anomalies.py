@@ -0,0 +1,274 @@
+"""
+Per-type anomaly flags.
+
+A value is flagged when it is anomalous among the values of the same
+parameter and Type: more than ``Z_THRESHOLD`` sample standard deviations
+from the Type's mean, or outside its Tukey fences (``IQR_FACTOR``
+interquartile ranges beyond the quartiles). The per-type mean, std and
+quartiles come from ``api.stats.grouped_statistics`` and every row is then
+compared with its Type's bounds by indexing them with the type codes, so
+one parameter is one sort plus a few array operations over the
+memory-mapped column. Only the flagged values are stored, as
+``DatasetAnomaly`` rows.
+
+An append flags only its new rows, against bounds taken from the merged
+statistics: mean and std merge exactly and the quartiles are read from
+the merged sketches. The new rows also move the bounds of the old ones,
+so the whole payload is flagged again afterwards by a job on
+``settings.ANOMALY_WORKERS`` processes (0 runs it inline after commit),
+outside the append's transaction.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .concurrency import ProcessPool
+from .ingest import NUMERIC_COLUMNS
+from .rows import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, RowQueryError, decode_cursor, encode_cursor
+from .stats import ALL_TYPES, grouped_statistics, sketch_quantile
+from .storage import FORMAT_COLUMNAR, convert_to_columnar, open_columnar
+
+Z_THRESHOLD = 3.0
+IQR_FACTOR = 1.5
+
+RULE_ZSCORE = 'zscore'
+RULE_IQR = 'iqr'
+RULES = {
+    RULE_ZSCORE: 'zscore_flag',
+    RULE_IQR: 'iqr_flag',
+}
+
+ANOMALY_FIELDS = [
+    'row', 'equipment_name', 'equipment_type', 'parameter', 'value', 'zscore', 'zscore_flag', 'iqr_flag',
+]
+
+
+pool = ProcessPool('ANOMALY_WORKERS')
+
+
+def flag_values(type_codes, values, groups, bounds=None):
+    """
+    Compare each value with the statistics of its group, computed from
+    ``values`` unless ``bounds`` (arrays of mean, std, p25 and p75 by
+    group) are given. Returns the z-scores and the z-score and IQR flags
+    as arrays aligned with ``values``; rows without a group or a value are
+    never flagged.
+    """
+    stats = bounds if bounds is not None else grouped_statistics(type_codes, values, groups, percentiles=(25, 75))
+    grouped = type_codes >= 0
+    codes = np.where(grouped, type_codes, 0)
+    spread = stats['p75'] - stats['p25']
+    low = (stats['p25'] - IQR_FACTOR * spread)[codes]
+    high = (stats['p75'] + IQR_FACTOR * spread)[codes]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        zscore = (values - stats['mean'][codes]) / stats['std'][codes]
+        zscore_flag = grouped & (np.abs(zscore) > Z_THRESHOLD)
+        iqr_flag = grouped & ((values < low) | (values > high))
+    zscore[~grouped | ~np.isfinite(zscore)] = np.nan
+    return zscore, zscore_flag, iqr_flag
+
+
+def _as_float(value):
+    return None if np.isnan(value) else float(value)
+
+
+def statistic_bounds(statistics, type_labels):
+    """
+    ``{parameter: bounds}`` for ``flag_values`` from statistic rows with
+    sketches, indexed like ``type_labels``. The quartiles come from the
+    sketches, within ``api.stats.SKETCH_ACCURACY``.
+    """
+    codes = {str(label): code for code, label in enumerate(type_labels)}
+    bounds = {
+        parameter: {field: np.full(len(type_labels), np.nan) for field in ('mean', 'std', 'p25', 'p75')}
+        for parameter in NUMERIC_COLUMNS
+    }
+    for row in statistics:
+        code = codes.get(row['equipment_type'])
+        if row['equipment_type'] == ALL_TYPES or code is None or not row['count']:
+            continue
+        stats = bounds[row['parameter']]
+        stats['mean'][code] = np.nan if row['mean'] is None else row['mean']
+        stats['std'][code] = np.nan if row['std'] is None else row['std']
+        for q in (25, 75):
+            value = sketch_quantile(row['sketch'], q / 100)
+            stats[f'p{q}'][code] = min(max(value, row['minimum']), row['maximum'])
+    return bounds
+
+
+def detect_anomalies(payload, start=0, stop=None, bounds=None):
+    """
+    Anomaly rows of a columnar payload, by row then parameter. With
+    ``bounds`` (see ``statistic_bounds``) only the rows from ``start`` to
+    ``stop`` are flagged, against those bounds rather than their own.
+    """
+    stop = payload.rows if stop is None else stop
+    if stop <= start:
+        return []
+    type_codes = np.asarray(payload.raw('Type')[start:stop], dtype=np.int64)
+    groups = len(payload.categories('Type'))
+
+    flagged = []
+    for parameter in NUMERIC_COLUMNS:
+        values = np.asarray(payload.raw(parameter)[start:stop], dtype=np.float64)
+        zscore, zscore_flag, iqr_flag = flag_values(
+            type_codes, values, groups, None if bounds is None else bounds[parameter]
+        )
+        positions = np.flatnonzero(zscore_flag | iqr_flag)
+        if len(positions):
+            flagged.append((parameter, positions, values, zscore, zscore_flag, iqr_flag))
+    if not flagged:
+        return []
+
+    # Names and types are decoded for the flagged rows only
+    rows = np.unique(np.concatenate([positions for _, positions, *_ in flagged]))
+    columns = [name for name in ('Equipment Name', 'Type') if name in payload.columns]
+    labels = payload.take(columns, rows + start)
+    names = dict(zip(rows.tolist(), labels['Equipment Name'].tolist())) if 'Equipment Name' in labels else {}
+    types = dict(zip(rows.tolist(), labels['Type'].tolist()))
+
+    anomalies = []
+    for parameter, positions, values, zscore, zscore_flag, iqr_flag in flagged:
+        for position in positions.tolist():
+            name = names.get(position)
+            anomalies.append({
+                'row': start + position,
+                'equipment_name': name if isinstance(name, str) else '',
+                'equipment_type': str(types[position]),
+                'parameter': parameter,
+                'value': float(values[position]),
+                'zscore': _as_float(zscore[position]),
+                'zscore_flag': bool(zscore_flag[position]),
+                'iqr_flag': bool(iqr_flag[position]),
+            })
+    anomalies.sort(key=lambda anomaly: (anomaly['row'], NUMERIC_COLUMNS.index(anomaly['parameter'])))
+    return anomalies
+
+
+def refresh_anomalies(dataset, payload=None):
+    """Replace the dataset's anomaly rows with ones detected over its whole payload"""
+    anomalies = detect_anomalies(payload or open_columnar(dataset))
+    dataset.anomalies.all().delete()
+    dataset.save_anomalies(anomalies)
+    dataset.anomaly_count = len(anomalies)
+    # Every dataset sharing the analytics has the same flags
+    type(dataset).objects.filter(analytics_id=dataset.analytics_id).update(anomaly_count=dataset.anomaly_count)
+    return anomalies
+
+
+def reflag_anomalies(analytics_id):
+    """Flag the whole payload of appended-to analytics again. Runs inside a pool process."""
+    from .models import EquipmentDataset
+
+    with transaction.atomic():
+        dataset = EquipmentDataset.objects.select_for_update().defer('csv_data').filter(
+            analytics_id=analytics_id
+        ).first()
+        if dataset is None:
+            # Pruned since
+            return
+        payload = open_columnar(dataset)
+        if payload.rows != dataset.total_count:
+            # Another append is being saved, it queues its own job on commit
+            return
+        refresh_anomalies(dataset, payload)
+
+
+def submit_reflag(analytics_id):
+    if pool.workers <= 0:
+        reflag_anomalies(analytics_id)
+        return
+    pool.submit(reflag_anomalies, analytics_id)
+
+
+def reflag_later(dataset):
+    """Queue ``reflag_anomalies`` for the dataset's analytics once the current transaction commits"""
+    analytics_id = dataset.analytics_id
+    transaction.on_commit(lambda: submit_reflag(analytics_id))
+
+
+def stored_anomaly_count(dataset):
+    """
+    The dataset's number of flagged values, detecting and saving them first
+    for datasets uploaded before anomalies were recorded.
+    """
+    if dataset.anomaly_count is None:
+        if dataset.storage_format != FORMAT_COLUMNAR:
+            convert_to_columnar(dataset)
+        with transaction.atomic():
+            refresh_anomalies(dataset)
+    return dataset.anomaly_count
+
+
+def flagged_cells(dataset, stop=None):
+    """``{row: [parameter, ...]}`` of the flagged values, optionally of the rows before ``stop``"""
+    stored_anomaly_count(dataset)
+    anomalies = dataset.anomalies.all()
+    if stop is not None:
+        anomalies = anomalies.filter(row__lt=stop)
+    cells = {}
+    for row, parameter in anomalies.order_by().values_list('row', 'parameter').iterator():
+        cells.setdefault(row, []).append(parameter)
+    return cells
+
+
+def parse_anomaly_query(params):
+    """
+    Validate ``parameter`` and ``type`` (comma separated), ``rule``,
+    ``limit`` and ``after``. Returns (filters, limit, cursor).
+    """
+    filters = Q()
+    if params.get('parameter'):
+        parameters = [name.strip() for name in params['parameter'].split(',') if name.strip()]
+        unknown = [name for name in parameters if name not in NUMERIC_COLUMNS]
+        if unknown:
+            raise RowQueryError(f"Unknown parameter(s): {', '.join(unknown)}")
+        filters &= Q(parameter__in=parameters)
+    if params.get('type'):
+        filters &= Q(equipment_type__in=[name.strip() for name in params['type'].split(',') if name.strip()])
+    if params.get('rule'):
+        if params['rule'] not in RULES:
+            raise RowQueryError(f"rule must be one of {', '.join(RULES)}")
+        filters &= Q(**{RULES[params['rule']]: True})
+
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise RowQueryError('limit must be an integer')
+    if not 0 <= limit <= MAX_PAGE_SIZE:
+        raise RowQueryError(f'limit must be between 0 and {MAX_PAGE_SIZE}')
+
+    cursor = decode_cursor(params['after'], positions=('row', 'id')) if params.get('after') else None
+    return filters, limit, cursor
+
+
+def query_anomalies(dataset, filters, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """Counts of the matching flags per parameter and rule, plus one page of them"""
+    stored_anomaly_count(dataset)
+    matching = dataset.anomalies.filter(filters)
+
+    by_parameter = {
+        row['parameter']: {'count': row['count'], RULE_ZSCORE: row[RULE_ZSCORE], RULE_IQR: row[RULE_IQR]}
+        for row in matching.order_by().values('parameter').annotate(
+            count=Count('id'),
+            **{rule: Count('id', filter=Q(**{field: True})) for rule, field in RULES.items()},
+        )
+    }
+
+    page = matching.order_by('row', 'id')
+    if cursor is not None:
+        page = page.filter(Q(row__gt=cursor.get('row', -1)) | Q(row=cursor.get('row', -1), id__gt=cursor.get('id', 0)))
+    anomalies = list(page.values('id', *ANOMALY_FIELDS)[:limit]) if limit else []
+
+    next_cursor = None
+    if limit and len(anomalies) == limit:
+        next_cursor = encode_cursor({'row': anomalies[-1]['row'], 'id': anomalies[-1]['id']})
+    for anomaly in anomalies:
+        del anomaly['id']
+    return {
+        'rules': {RULE_ZSCORE: {'threshold': Z_THRESHOLD}, RULE_IQR: {'factor': IQR_FACTOR}},
+        'count': sum(counts['count'] for counts in by_parameter.values()),
+        'by_parameter': by_parameter,
+        'anomalies': anomalies,
+        'next': next_cursor,
+    }
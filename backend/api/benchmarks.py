@@ -0,0 +1,683 @@
+"""
+Benchmarks for the dataset pipeline.
+
+Run them with ``python manage.py benchmark``. Each suite takes a row count
+and returns a flat dict of measurements; timings are the best of
+``REPEAT`` runs, in seconds, and ``*_peak_mib`` values the peak Python heap
+(numpy buffers included) of one more run. The ``endpoints`` suite drives the
+upload, history and report views through the Django test client; the
+``phases`` suite times the parse, aggregate and render steps behind them on
+their own, the ``load`` suite polls history while large reports render
+(see ``bench_load``) and the ``wire`` suite compares the response formats
+and encodings of ``api.renderers`` and ``api.compression``. Results can be
+saved as JSON and compared with a baseline, see ``compare_results``.
+"""
+import asyncio
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .anomalies import detect_anomalies
+from .ingest import ENGINE_C, ENGINE_PYARROW, default_engine, ingest_csv, iter_chunks, pa_csv
+from .compare import compare_datasets
+from .compression import ENCODING_BROTLI, ENCODING_GZIP, brotli, compress
+from .datasets import create_dataset
+from .exports import export_cache
+from .history import history_cache
+from .models import EquipmentDataset
+from .records import parse_record_query, query_records, save_records
+from .renderers import (
+    ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, msgpack, read_table, tabular_renderers,
+)
+from .reports import build_report, render_report, report_cache
+from .rows import MAX_PAGE_SIZE
+from .schema import NUMERIC_COLUMNS, RejectionReport
+from .stats import frame_statistics, payload_statistics
+from .storage import ColumnarPayload, PayloadWriter
+
+REPEAT = 3
+
+# Rows listed in the reports of the endpoints and phases suites; listing
+# every row of a 10M row dataset would take hours
+REPORT_ROWS = 1_000
+
+# Rows generated per chunk by write_synthetic_csv
+GENERATE_CHUNK_ROWS = 500_000
+
+# Load suite: reports rendered at once, rows listed in each, the pause
+# between history polls and the polls of the idle server
+LOAD_REPORTS = 4
+LOAD_REPORT_ROWS = 5_000
+LOAD_POLL_INTERVAL = 0.05
+LOAD_IDLE_POLLS = 20
+
+# Timings below this are too noisy to flag as regressions
+MIN_COMPARED_SECONDS = 0.01
+
+EQUIPMENT_TYPES = ['Pump', 'Compressor', 'Valve', 'HeatExchanger', 'Reactor', 'Condenser']
+
+
+def synthetic_frame(rows, seed=0, first=1):
+    """Equipment data shaped like sample_equipment_data.csv, numbered from ``first``."""
+    rng = np.random.default_rng(seed)
+    types = np.array(EQUIPMENT_TYPES)[rng.integers(0, len(EQUIPMENT_TYPES), rows)]
+    return pd.DataFrame({
+        'Equipment Name': [f'{equip_type}-{index}' for index, equip_type in enumerate(types, start=first)],
+        'Type': types,
+        'Flowrate': rng.normal(120, 30, rows).round(1),
+        'Pressure': rng.normal(6.5, 1.5, rows).round(1),
+        'Temperature': rng.normal(115, 12, rows).round(1),
+    })
+
+
+def write_synthetic_csv(output, rows, seed=0):
+    """
+    Write ``rows`` of synthetic equipment data as CSV to the binary file
+    ``output``, ``GENERATE_CHUNK_ROWS`` at a time so any size fits in memory.
+    """
+    for start in range(0, rows, GENERATE_CHUNK_ROWS):
+        frame = synthetic_frame(
+            min(GENERATE_CHUNK_ROWS, rows - start), seed=[seed, start // GENERATE_CHUNK_ROWS], first=start + 1
+        )
+        output.write(frame.to_csv(index=False, header=not start).encode())
+    if not rows:
+        output.write(synthetic_frame(0).to_csv(index=False).encode())
+
+
+def timed(func, repeat=REPEAT, setup=None):
+    """Best time of ``repeat`` calls; ``setup`` runs untimed before each."""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(func, setup=None):
+    """Peak Python heap allocation of one call, in MiB."""
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_storage(rows):
+    """CSV text round trip versus the memory-mapped columnar payload."""
+    df = synthetic_frame(rows)
+    text = df.to_csv(index=False)
+
+    with tempfile.TemporaryDirectory() as store, override_settings(DATASET_STORAGE_DIR=store):
+        with PayloadWriter() as writer:
+            writer.write(df)
+            key = writer.commit()
+        return {
+            'csv_full_s': timed(lambda: pd.read_csv(StringIO(text))),
+            'csv_type_only_s': timed(lambda: pd.read_csv(StringIO(text), usecols=['Type'])),
+            'columnar_full_s': timed(lambda: ColumnarPayload(key).to_frame()),
+            'columnar_type_only_s': timed(lambda: ColumnarPayload(key).column('Type')),
+            'columnar_numeric_only_s': timed(
+                lambda: ColumnarPayload(key).to_frame(['Flowrate', 'Pressure', 'Temperature'])
+            ),
+        }
+
+
+def _render(df, detail_rows=None):
+    summary = {
+        'total_count': len(df),
+        'avg_flowrate': df['Flowrate'].mean(),
+        'avg_pressure': df['Pressure'].mean(),
+        'avg_temperature': df['Temperature'].mean(),
+    }
+    chunks = (df.iloc[start:start + 10_000] for start in range(0, len(df), 10_000))
+    if detail_rows is not None:
+        chunks = (df.head(detail_rows),)
+    render_report(
+        BytesIO(), filename='bench.csv', upload_date=datetime.now(), summary=summary,
+        type_distribution=df['Type'].value_counts().to_dict(), detail_chunks=chunks, detail_rows=detail_rows,
+        statistics=frame_statistics(df),
+    )
+
+
+def bench_report(rows):
+    """PDF build time and peak memory: every row, top 1,000 rows, summary only."""
+    df = synthetic_frame(rows)
+    return {
+        'all_rows_s': timed(lambda: _render(df), repeat=1),
+        'all_rows_peak_mib': peak_memory(lambda: _render(df)),
+        'top_1000_s': timed(lambda: _render(df, 1_000)),
+        'summary_only_s': timed(lambda: _render(df, 0)),
+    }
+
+
+def _pandas_statistics(df):
+    grouped = df.groupby('Type')[['Flowrate', 'Pressure', 'Temperature']]
+    return grouped.agg(['count', 'mean', 'std', 'min', 'max']), grouped.quantile([0.5, 0.95, 0.99])
+
+
+def bench_statistics(rows):
+    """Per-type statistics from the columnar payload versus pandas groupby."""
+    df = synthetic_frame(rows)
+
+    with tempfile.TemporaryDirectory() as store, override_settings(DATASET_STORAGE_DIR=store):
+        with PayloadWriter() as writer:
+            writer.write(df)
+            key = writer.commit()
+        return {
+            'engine_s': timed(lambda: payload_statistics(ColumnarPayload(key))),
+            'pandas_groupby_s': timed(lambda: _pandas_statistics(ColumnarPayload(key).to_frame())),
+        }
+
+
+def _untyped_parse(data):
+    """The parse before the schema: default engine, every column, inferred dtypes"""
+    with pd.read_csv(BytesIO(data), chunksize=settings.CSV_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            for column in NUMERIC_COLUMNS:
+                chunk[column] = pd.to_numeric(chunk[column])
+
+
+def _schema_parse(data, engine):
+    for _ in iter_chunks(BytesIO(data), rejections=RejectionReport(), engine=engine):
+        pass
+
+
+def bench_parse(rows):
+    """
+    Upload parsing: the untyped read_csv call versus the schema pipeline on
+    each available engine, for the equipment columns alone and with 20
+    extra text columns.
+    """
+    df = synthetic_frame(rows)
+    wide = df.assign(**{f'Note {index}': df['Equipment Name'] for index in range(20)})
+    engines = [ENGINE_C] + ([ENGINE_PYARROW] if pa_csv is not None else [])
+
+    results = {}
+    for label, frame in (('', df), ('wide_', wide)):
+        data = frame.to_csv(index=False).encode()
+        results[f'{label}untyped_s'] = timed(lambda: _untyped_parse(data))
+        for engine in engines:
+            results[f'{label}{engine}_s'] = timed(lambda: _schema_parse(data, engine))
+    fastest = min(results[f'{engine}_s'] for engine in engines)
+    results['rows_per_s'] = int(rows / fastest)
+    results['speedup'] = results['untyped_s'] / fastest
+    return results
+
+
+@contextmanager
+def isolated_database():
+    """Run against a throwaway test database instead of the configured one."""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def bench_records(rows):
+    """Bulk insert throughput into EquipmentRecord and a filtered SQL aggregate."""
+    df = synthetic_frame(rows)
+    chunks = [df.iloc[start:start + 50_000] for start in range(0, rows, 50_000)]
+
+    with isolated_database():
+        user, _ = User.objects.get_or_create(username='benchmark')
+        dataset = EquipmentDataset.objects.create(
+            user=user, filename='bench.csv', total_count=rows, avg_flowrate=0, avg_pressure=0, avg_temperature=0,
+        )
+
+        def insert():
+            dataset.records.delete()
+            with transaction.atomic():
+                save_records(dataset, chunks)
+
+        insert_s = timed(insert, repeat=1)
+        filters, limit, cursor = parse_record_query({'type': 'Pump', 'flowrate_min': '150', 'limit': '100'})
+        return {
+            'insert_s': insert_s,
+            'insert_rows_per_s': int(rows / insert_s),
+            'filtered_query_s': timed(lambda: query_records(dataset, filters, limit, cursor)),
+        }
+
+
+def _maintained(df, seed=1):
+    """A later upload of ``df``: 5% of rows removed, 5% added, 10% of readings changed, 1% retyped"""
+    rng = np.random.default_rng(seed)
+    rows = len(df)
+    after = df.iloc[rng.permutation(rows)[:rows - rows // 20]].reset_index(drop=True)
+    changed = rng.random(len(after)) < 0.1
+    after.loc[changed, 'Flowrate'] = (after.loc[changed, 'Flowrate'] * rng.normal(1, 0.05, changed.sum())).round(1)
+    retyped = rng.random(len(after)) < 0.01
+    after.loc[retyped, 'Type'] = np.array(EQUIPMENT_TYPES)[rng.integers(0, len(EQUIPMENT_TYPES), retyped.sum())]
+    added = synthetic_frame(rows // 20, seed=seed + 1)
+    added['Equipment Name'] = [f'New-{index}' for index in range(len(added))]
+    return pd.concat([after, added], ignore_index=True)
+
+
+def bench_compare(rows):
+    """Comparison of an upload with a later upload of the same plant, both ``rows`` long."""
+    before = synthetic_frame(rows)
+    after = _maintained(before)
+
+    with tempfile.TemporaryDirectory() as store, override_settings(DATASET_STORAGE_DIR=store), isolated_database():
+        user, _ = User.objects.get_or_create(username='benchmark')
+        datasets = []
+        for frame in (before, after):
+            with PayloadWriter() as writer:
+                writer.write(frame)
+                key = writer.commit()
+            dataset = EquipmentDataset.objects.create(
+                user=user, filename='bench.csv', total_count=len(frame), avg_flowrate=0, avg_pressure=0,
+                avg_temperature=0, payload_key=key,
+            )
+            dataset.save_statistics(payload_statistics(ColumnarPayload(key)))
+            datasets.append(dataset)
+        return {
+            'compare_s': timed(lambda: compare_datasets(*datasets)),
+            'compare_peak_mib': peak_memory(lambda: compare_datasets(*datasets)),
+        }
+
+
+def bench_anomalies(rows):
+    """Per-type anomaly detection over the columnar payload, against the statistics pass it adds to an upload."""
+    df = synthetic_frame(rows)
+
+    with tempfile.TemporaryDirectory() as store, override_settings(DATASET_STORAGE_DIR=store):
+        with PayloadWriter() as writer:
+            writer.write(df)
+            key = writer.commit()
+        return {
+            'detect_s': timed(lambda: detect_anomalies(ColumnarPayload(key))),
+            'statistics_s': timed(lambda: payload_statistics(ColumnarPayload(key))),
+            'flagged': len(detect_anomalies(ColumnarPayload(key))),
+            'detect_peak_mib': peak_memory(lambda: detect_anomalies(ColumnarPayload(key))),
+        }
+
+
+@contextmanager
+def isolated_environment():
+    """
+    A throwaway database, payload store, report, export and history caches,
+    and a test client authenticated as a fresh user.
+    """
+    with ExitStack() as stack:
+        workdir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        stack.enter_context(override_settings(
+            DATASET_STORAGE_DIR=workdir / 'store',
+            REPORT_CACHE_DIR=workdir / 'report_cache',
+            EXPORT_CACHE_DIR=workdir / 'export_cache',
+            CACHES={**settings.CACHES, 'history': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ))
+        stack.enter_context(isolated_database())
+        user, _ = User.objects.get_or_create(username='benchmark')
+        token, _ = Token.objects.get_or_create(user=user)
+        yield workdir, user, Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+
+def _synthetic_file(workdir, rows, seed=0):
+    path = workdir / f'equipment-{rows}-{seed}.csv'
+    with open(path, 'wb') as output:
+        write_synthetic_csv(output, rows, seed)
+    return path
+
+
+def _expect(response, status_code):
+    if response.status_code != status_code:
+        # WSGI and ASGI requests name the path differently
+        path = response.request.get('PATH_INFO') or response.request.get('path')
+        raise AssertionError(f'{path} returned {response.status_code}: {response.content[:200]}')
+    if response.streaming and not response.is_async:
+        # Read streamed bodies (reports, exports) as a client would
+        response.getvalue()
+    return response
+
+
+def bench_endpoints(rows):
+    """
+    UploadCSVView, HistoryView, GeneratePDFView and DatasetExportView end
+    to end through the test client: a fresh upload, a re-upload of the same
+    file (deduplicated), history with a cold and a warm cache, a report of
+    the first ``REPORT_ROWS`` rows rendered and then served from the report
+    cache, and a CSV export generated and then served from the export cache.
+    """
+    with isolated_environment() as (workdir, user, client):
+        path = _synthetic_file(workdir, rows)
+        uploaded = {}
+
+        def clear():
+            EquipmentDataset.objects.filter(user=user).delete()
+
+        def upload():
+            with open(path, 'rb') as upload_file:
+                response = _expect(client.post(reverse('upload-csv'), {'file': upload_file}), 201)
+            uploaded['id'] = response.json()['id']
+
+        upload_s = timed(upload, repeat=1, setup=clear)
+        results = {
+            'upload_s': upload_s,
+            'upload_rows_per_s': int(rows / upload_s),
+            'upload_peak_mib': peak_memory(upload, setup=clear),
+            'upload_duplicate_s': timed(upload, repeat=1),
+        }
+
+        def history():
+            _expect(client.get(reverse('history')), 200)
+
+        results['history_s'] = timed(history, setup=lambda: history_cache.invalidate(user.id))
+        results['history_cached_s'] = timed(history)
+
+        report_url = f"{reverse('generate-pdf', args=[uploaded['id']])}?rows={REPORT_ROWS}"
+
+        def report():
+            _expect(client.get(report_url), 200)
+
+        results['report_s'] = timed(report, setup=lambda: report_cache.invalidate(uploaded['id']))
+        results['report_peak_mib'] = peak_memory(report, setup=lambda: report_cache.invalidate(uploaded['id']))
+        results['report_cached_s'] = timed(report)
+
+        export_url = reverse('dataset-export', args=[uploaded['id'], 'csv'])
+
+        def export():
+            _expect(client.get(export_url), 200)
+
+        results['export_s'] = timed(export, setup=lambda: export_cache.invalidate(uploaded['id']))
+        results['export_peak_mib'] = peak_memory(export, setup=lambda: export_cache.invalidate(uploaded['id']))
+        results['export_cached_s'] = timed(export)
+        return results
+
+
+def _drain(chunks):
+    for _ in chunks:
+        pass
+
+
+def bench_phases(rows):
+    """
+    The steps behind the endpoints on their own: parsing the CSV, ingesting
+    it into a payload (parse, running aggregates and write), the statistics
+    and anomaly passes over the payload, and building the report.
+    """
+    with isolated_environment() as (workdir, user, _):
+        path = _synthetic_file(workdir, rows)
+
+        def parse():
+            with open(path, 'rb') as upload_file:
+                _drain(iter_chunks(upload_file, rejections=RejectionReport()))
+
+        def ingest():
+            with open(path, 'rb') as upload_file, PayloadWriter() as writer:
+                ingested['result'] = ingest_csv(upload_file, writer)
+                ingested['key'] = writer.commit()
+
+        ingested = {}
+        results = {
+            'parse_s': timed(parse),
+            'parse_peak_mib': peak_memory(parse),
+            'ingest_s': timed(ingest, repeat=1),
+            'ingest_peak_mib': peak_memory(ingest),
+        }
+        with open(path, 'rb') as upload_file:
+            results['engine'] = default_engine(upload_file)
+
+        def aggregate():
+            payload = ColumnarPayload(ingested['key'])
+            payload_statistics(payload)
+            detect_anomalies(payload)
+
+        results['aggregate_s'] = timed(aggregate)
+        results['aggregate_peak_mib'] = peak_memory(aggregate)
+
+        dataset = create_dataset(user, path.name, ingested['key'], ingested['result'])
+        results['render_s'] = timed(lambda: build_report(dataset, BytesIO(), REPORT_ROWS))
+        results['render_peak_mib'] = peak_memory(lambda: build_report(dataset, BytesIO(), REPORT_ROWS))
+        return results
+
+
+async def _timed_get(client, url, headers):
+    start = time.perf_counter()
+    # A context per request, as the ASGI handler gives them
+    async with ThreadSensitiveContext():
+        response = _expect(await client.get(url, headers=headers), 200)
+        if response.streaming:
+            async for _ in response.streaming_content:
+                pass
+    return time.perf_counter() - start
+
+
+async def _async_history_under_load(client, headers, history_url, report_urls):
+    """History latencies while the reports render concurrently, and the time until they all finished"""
+    start = time.perf_counter()
+    rendering = [asyncio.create_task(_timed_get(client, url, headers)) for url in report_urls]
+    latencies = []
+    while not all(task.done() for task in rendering):
+        latencies.append(await _timed_get(client, history_url, headers))
+        await asyncio.sleep(LOAD_POLL_INTERVAL)
+    await asyncio.gather(*rendering)
+    return latencies, time.perf_counter() - start
+
+
+def _worker_history_under_load(client, history_url, report_urls):
+    """
+    The same with the sync views on one thread, as in a sync (WSGI) worker:
+    a history request queued behind the reports waits for them.
+    """
+    with ThreadPoolExecutor(max_workers=1) as worker:
+        start = time.perf_counter()
+        rendering = [worker.submit(lambda url=url: _expect(client.get(url), 200)) for url in report_urls]
+        latencies = []
+        while not all(future.done() for future in rendering):
+            polled = time.perf_counter()
+            worker.submit(lambda: _expect(client.get(history_url), 200)).result()
+            latencies.append(time.perf_counter() - polled)
+            time.sleep(LOAD_POLL_INTERVAL)
+        for future in rendering:
+            future.result()
+        return latencies, time.perf_counter() - start
+
+
+def _latency_results(prefix, latencies):
+    latencies = np.asarray(latencies)
+    return {
+        f'{prefix}_polls': len(latencies),
+        f'{prefix}_p50_s': float(np.percentile(latencies, 50)),
+        f'{prefix}_p95_s': float(np.percentile(latencies, 95)),
+        f'{prefix}_max_s': float(latencies.max()),
+    }
+
+
+def bench_load(rows):
+    """
+    History latency while ``LOAD_REPORTS`` reports of up to
+    ``LOAD_REPORT_ROWS`` rows render at once. The async views
+    (``api.concurrency``) are driven through the ASGI handler (the async
+    test client), idle and under load; for comparison the sync views are
+    loaded the same way on a single sync worker thread.
+    """
+    with isolated_environment() as (workdir, user, client):
+        path = _synthetic_file(workdir, rows)
+        with open(path, 'rb') as upload_file:
+            dataset_id = _expect(client.post(reverse('upload-csv'), {'file': upload_file}), 201).json()['id']
+        headers = {'Authorization': f'Token {Token.objects.get(user=user).key}'}
+        detail_rows = min(rows, LOAD_REPORT_ROWS)
+
+        def report_urls(name):
+            # Distinct row counts, so every report is a cache miss
+            report_cache.invalidate(dataset_id)
+            return [
+                f"{reverse(name, args=[dataset_id])}?rows={detail_rows - index}" for index in range(LOAD_REPORTS)
+            ]
+
+        async def run():
+            async_client = AsyncClient()
+            history_url = reverse('async-history')
+            idle = [await _timed_get(async_client, history_url, headers) for _ in range(LOAD_IDLE_POLLS)]
+            loaded, loaded_s = await _async_history_under_load(
+                async_client, headers, history_url, report_urls('async-generate-pdf')
+            )
+            return idle, loaded, loaded_s
+
+        idle, loaded, loaded_s = asyncio.run(run())
+        blocked, blocked_s = _worker_history_under_load(client, reverse('history'), report_urls('generate-pdf'))
+        return {
+            'reports': LOAD_REPORTS,
+            'report_rows': detail_rows,
+            **_latency_results('idle_history', idle),
+            'async_reports_s': loaded_s,
+            **_latency_results('async_history', loaded),
+            'worker_reports_s': blocked_s,
+            **_latency_results('worker_history', blocked),
+        }
+
+
+WIRE_FORMATS = {
+    'json': 'application/json',
+    'columnar': COLUMNAR_MEDIA_TYPE,
+    'msgpack': MSGPACK_MEDIA_TYPE,
+    'arrow': ARROW_MEDIA_TYPE,
+}
+
+
+def _wire_formats():
+    offered = {renderer.media_type for renderer in tabular_renderers()}
+    return {name: media_type for name, media_type in WIRE_FORMATS.items() if media_type in offered}
+
+
+def _wire_results(client, prefix, url, field):
+    """Size of a tabular response per format and encoding, server time and client decode time"""
+    results = {}
+    for name, media_type in _wire_formats().items():
+        response = _expect(client.get(url, HTTP_ACCEPT=media_type, HTTP_ACCEPT_ENCODING='identity'), 200)
+        body, content_type = response.content, response['Content-Type']
+        results[f'{prefix}_{name}_bytes'] = len(body)
+        results[f'{prefix}_{name}_gzip_bytes'] = len(compress(body, ENCODING_GZIP))
+        if brotli is not None:
+            results[f'{prefix}_{name}_br_bytes'] = len(compress(body, ENCODING_BROTLI))
+        results[f'{prefix}_{name}_request_s'] = timed(
+            lambda: client.get(url, HTTP_ACCEPT=media_type, HTTP_ACCEPT_ENCODING='identity')
+        )
+        results[f'{prefix}_{name}_decode_s'] = timed(lambda: read_table(content_type, body, field))
+    return results
+
+
+def _read_all_rows(client, url, media_type):
+    """Page through all rows as a client would, into one DataFrame"""
+    frames, cursor = [], None
+    while True:
+        params = {'limit': MAX_PAGE_SIZE, **({'after': cursor} if cursor else {})}
+        response = _expect(client.get(url, params, HTTP_ACCEPT=media_type), 200)
+        frame, rest = read_table(response['Content-Type'], response.content, 'rows')
+        frames.append(frame)
+        cursor = rest['next']
+        if not cursor:
+            return pd.concat(frames, ignore_index=True)
+
+
+def bench_wire(rows):
+    """
+    The tabular responses in each format of ``api.renderers``: a page of
+    ``MAX_PAGE_SIZE`` rows and of records, their size as sent and
+    compressed, the time to serve them and the time to decode them into a
+    DataFrame (``read_table``), and the time to page through all rows.
+    """
+    with isolated_environment() as (workdir, user, client):
+        path = _synthetic_file(workdir, rows)
+        with open(path, 'rb') as upload_file:
+            dataset_id = _expect(client.post(reverse('upload-csv'), {'file': upload_file}), 201).json()['id']
+        rows_url = reverse('dataset-rows', args=[dataset_id])
+        records_url = reverse('dataset-records', args=[dataset_id])
+        results = {
+            **_wire_results(client, 'rows', f'{rows_url}?limit={MAX_PAGE_SIZE}', 'rows'),
+            **_wire_results(client, 'records', f'{records_url}?limit={MAX_PAGE_SIZE}', 'records'),
+        }
+        for name, media_type in _wire_formats().items():
+            results[f'all_rows_{name}_s'] = timed(lambda: _read_all_rows(client, rows_url, media_type), repeat=1)
+        return results
+
+
+SUITES = {
+    'storage': bench_storage,
+    'report': bench_report,
+    'records': bench_records,
+    'stats': bench_statistics,
+    'parse': bench_parse,
+    'compare': bench_compare,
+    'anomalies': bench_anomalies,
+    'endpoints': bench_endpoints,
+    'phases': bench_phases,
+    'load': bench_load,
+    'wire': bench_wire,
+}
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata():
+    """Where and on what a set of results was measured"""
+    return {
+        'created': timezone.now().isoformat(),
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa_csv is not None,
+        'msgpack': msgpack is not None,
+        'brotli': brotli is not None,
+        'database': connection.vendor,
+    }
+
+
+def compare_results(baseline, current, tolerance):
+    """
+    Timings (``*_s``) and peak memory (``*_peak_mib``) in ``current`` that
+    are more than ``tolerance`` (a fraction) above ``baseline``, as
+    ``(suite, rows, metric, before, after)``. Both are ``results`` dicts
+    of the saved JSON: ``{suite: {rows: {metric: value}}}``.
+    """
+    regressions = []
+    for suite, by_rows in current.items():
+        for rows, metrics in by_rows.items():
+            before = baseline.get(suite, {}).get(rows, {})
+            for metric, value in metrics.items():
+                if metric not in before or not (metric.endswith('_s') or metric.endswith('_peak_mib')):
+                    continue
+                if metric.endswith('_s') and before[metric] < MIN_COMPARED_SECONDS:
+                    continue
+                if value > before[metric] * (1 + tolerance):
+                    regressions.append((suite, rows, metric, before[metric], value))
+    return regressions
@@ -0,0 +1,220 @@
+"""
+Bulk uploads.
+
+A bulk request carries several CSV files and/or ZIP archives of CSVs. Each
+CSV is parsed, aggregated and written to the payload store on a pool of
+``settings.INGEST_WORKERS`` processes while the web process saves finished
+files ``settings.BULK_COMMIT_BATCH`` datasets per transaction, in upload
+order. Files identical to a stored dataset, or to an earlier file of the
+same request, are not parsed: they share the stored payload (see
+``api.datasets.share_dataset``). Retention pruning runs once after the
+whole request.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import ExitStack
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import transaction
+
+from .concurrency import ProcessPool
+from .datasets import create_dataset, find_duplicate, prune_datasets, share_dataset, upload_summary
+from .storage import delete_payload
+
+pool = ProcessPool('INGEST_WORKERS')
+
+
+class BulkUploadError(ValueError):
+    pass
+
+
+def ingest_file(path, member=None):
+    """Parse one CSV file, or one member of a ZIP archive, into a new payload"""
+    from .ingest import ingest_csv
+    from .storage import PayloadWriter
+
+    with ExitStack() as stack:
+        if member is None:
+            stream = stack.enter_context(open(path, 'rb'))
+        else:
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            stream = stack.enter_context(archive.open(member))
+        writer = stack.enter_context(PayloadWriter())
+        result = ingest_csv(stream, writer)
+        return writer.commit(), result
+
+
+def submit(path, member=None):
+    if pool.workers <= 0:
+        future = Future()
+        try:
+            future.set_result(ingest_file(path, member))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return pool.submit(ingest_file, path, member)
+
+
+def _is_csv_member(info):
+    name = info.filename
+    return (
+        not info.is_dir()
+        and name.lower().endswith('.csv')
+        and not name.startswith('__MACOSX/')
+        and not os.path.basename(name).startswith('.')
+    )
+
+
+def _member_digest(archive, member):
+    digest = hashlib.sha256()
+    with archive.open(member) as stream:
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collect_inputs(files, workdir, digests=None):
+    """
+    One manifest entry per CSV to ingest, in upload order: ``filename``,
+    ``path``, ``member`` (the ZIP member name, None for plain files) and
+    ``content_hash`` (the SHA-256 of the CSV, None when unknown).
+    ``digests`` are the hashes of ``files`` taken while they were received.
+    Archives that cannot be read get an entry with ``error`` set instead.
+    """
+    entries = []
+    for index, upload in enumerate(files):
+        if hasattr(upload, 'temporary_file_path'):
+            path = upload.temporary_file_path()
+        else:
+            path = os.path.join(workdir, str(index))
+            with open(path, 'wb') as copy:
+                for chunk in upload.chunks():
+                    copy.write(chunk)
+
+        if not upload.name.lower().endswith('.zip'):
+            digest = digests[index] if digests and index < len(digests) else None
+            entries.append({'filename': upload.name, 'path': path, 'member': None, 'content_hash': digest})
+            continue
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = [
+                    (info.filename, _member_digest(archive, info.filename))
+                    for info in archive.infolist() if _is_csv_member(info)
+                ]
+        except zipfile.BadZipFile as e:
+            entries.append({'filename': upload.name, 'error': str(e)})
+            continue
+        if not members:
+            entries.append({'filename': upload.name, 'error': 'Archive contains no CSV files'})
+        entries.extend(
+            {'filename': f'{upload.name}/{member}', 'path': path, 'member': member, 'content_hash': digest}
+            for member, digest in members
+        )
+
+    if len(entries) > settings.BULK_UPLOAD_MAX_FILES:
+        raise BulkUploadError(f'At most {settings.BULK_UPLOAD_MAX_FILES} CSV files per bulk upload')
+    return entries
+
+
+def _save(user, entry, future):
+    try:
+        # A dead worker fails its file with BrokenProcessPool, the next submit starts a fresh pool
+        payload_key, result = future.result()
+    except Exception as e:
+        return {'filename': entry['filename'], 'status': 'failed', 'error': str(e)}
+
+    try:
+        # Nested in the batch transaction, so a failure only rolls back this file
+        dataset = create_dataset(user, entry['filename'], payload_key, result)
+    except Exception as e:
+        delete_payload(payload_key)
+        return {'filename': entry['filename'], 'status': 'failed', 'error': str(e)}
+    return {
+        'filename': entry['filename'],
+        'status': 'created',
+        'deduplicated': False,
+        **upload_summary(dataset, result.aggregates.type_distribution),
+    }
+
+
+def _share(user, entry, locks):
+    try:
+        source = find_duplicate(user, entry['content_hash'])
+        dataset = share_dataset(user, entry['filename'], source, locks) if source is not None else None
+    except Exception as e:
+        return {'filename': entry['filename'], 'status': 'failed', 'error': str(e)}
+    if dataset is None:
+        # The identical dataset failed, was pruned or is being appended to
+        return _save(user, entry, submit(entry['path'], entry['member']))
+    return {
+        'filename': entry['filename'],
+        'status': 'created',
+        'deduplicated': True,
+        **upload_summary(dataset, dict(dataset.type_counts.values_list('equipment_type', 'count'))),
+    }
+
+
+def _discard(future):
+    if not future.cancelled() and future.exception() is None:
+        delete_payload(future.result()[0])
+
+
+def bulk_ingest(user, files, digests=None):
+    """
+    Ingest every CSV in ``files`` and return the per-file manifest.
+    ``digests`` are the SHA-256 hashes of ``files`` if already known.
+    """
+    workdir = tempfile.mkdtemp(prefix='bulk-upload-')
+    futures = []
+    try:
+        entries = collect_inputs(files, workdir, digests)
+        seen = set()
+        for entry in entries:
+            digest = entry.get('content_hash')
+            if 'error' in entry:
+                futures.append(None)
+            elif digest and (digest in seen or find_duplicate(user, digest) is not None):
+                # Shares the identical dataset when its turn comes, nothing to parse
+                entry['duplicate'] = True
+                futures.append(None)
+            else:
+                futures.append(submit(entry['path'], entry['member']))
+            if digest:
+                seen.add(digest)
+
+        manifest = []
+        batch_size = max(1, settings.BULK_COMMIT_BATCH)
+        for start in range(0, len(entries), batch_size):
+            # Payloads gaining a reference stay locked until the batch commits
+            locks = {}
+            try:
+                with transaction.atomic():
+                    for index in range(start, min(start + batch_size, len(entries))):
+                        entry, future = entries[index], futures[index]
+                        if 'error' in entry:
+                            manifest.append({'filename': entry['filename'], 'status': 'failed', 'error': entry['error']})
+                            continue
+                        futures[index] = None
+                        if entry.get('duplicate'):
+                            manifest.append(_share(user, entry, locks))
+                        else:
+                            manifest.append(_save(user, entry, future))
+            finally:
+                for lock in locks.values():
+                    lock.release()
+    finally:
+        # Only reached with futures left when the request failed part way
+        for future in futures:
+            if future is not None and not future.cancel():
+                future.add_done_callback(_discard)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    pruned = set(prune_datasets(user))
+    for entry in manifest:
+        if entry.get('id') in pruned:
+            entry['status'] = 'pruned'
+    return manifest
@@ -0,0 +1,174 @@
+"""
+Comparison of two datasets, e.g. one plant before and after maintenance.
+
+Rows are matched on ``Equipment Name`` with a hash join over the two name
+columns (``pandas.Index.get_indexer``); every delta is then a numpy
+operation over the matched row positions, read straight from the
+memory-mapped payloads. Per-type shifts come from the stored statistics.
+Rows without a name cannot be matched and are only counted, and when a name
+repeats within a dataset its first row is used.
+"""
+import numpy as np
+import pandas as pd
+
+from .ingest import NUMERIC_COLUMNS
+from .stats import PERCENTILES, nest_statistics, stored_statistics
+from .storage import FORMAT_COLUMNAR, convert_to_columnar, open_columnar
+
+DEFAULT_LIST_LIMIT = 50
+MAX_LIST_LIMIT = 1000
+
+SHIFT_FIELDS = ['count', 'mean', 'std'] + [f'p{q}' for q in PERCENTILES]
+
+
+class _Side:
+    """The columns of one dataset needed for the join"""
+
+    def __init__(self, dataset):
+        if dataset.storage_format != FORMAT_COLUMNAR:
+            convert_to_columnar(dataset)
+        self.dataset = dataset
+        self.payload = open_columnar(dataset)
+        if 'Equipment Name' in self.payload.columns:
+            names = self.payload.column('Equipment Name')
+        else:
+            names = pd.Series([np.nan] * self.payload.rows, dtype=object)
+        named = (names.notna() & (names != '')).to_numpy()
+        first = named & ~names.duplicated(keep='first').to_numpy()
+        self.unnamed = int((~named).sum())
+        self.duplicates = int(named.sum() - first.sum())
+        # Row position of each distinct name, and the names as a hash index
+        self.positions = np.flatnonzero(first)
+        self.index = pd.Index(names.to_numpy()[self.positions])
+
+    def types(self, positions):
+        labels = np.array(self.payload.categories('Type') + [None], dtype=object)
+        return labels[np.asarray(self.payload.raw('Type'))[positions]]
+
+    def summary(self):
+        return {
+            'id': self.dataset.id,
+            'filename': self.dataset.filename,
+            'upload_date': self.dataset.upload_date.isoformat(),
+            'total_count': self.payload.rows,
+        }
+
+
+def _value(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def _change(name, before, after):
+    return {'name': name, 'a': _value(before), 'b': _value(after), 'delta': _value(after - before)}
+
+
+def _parameter_deltas(names, before, after, limit):
+    """Deltas of one parameter over the matched rows (b - a), largest changes first"""
+    delta = after - before
+    compared = ~np.isnan(delta)
+    result = {
+        'compared': int(compared.sum()),
+        'changed': int((compared & (delta != 0)).sum()),
+        'mean_delta': None,
+        'mean_abs_delta': None,
+        'largest_changes': [],
+    }
+    if not result['compared']:
+        return result
+    delta_compared = delta[compared]
+    result['mean_delta'] = float(delta_compared.mean())
+    result['mean_abs_delta'] = float(np.abs(delta_compared).mean())
+
+    magnitude = np.where(compared & (delta != 0), np.abs(delta), -1.0)
+    count = min(limit, result['changed'])
+    if count:
+        top = np.argpartition(-magnitude, count - 1)[:count]
+        top = top[np.argsort(-magnitude[top], kind='stable')]
+        result['largest_changes'] = [
+            _change(names[position], before[position], after[position]) for position in top.tolist()
+        ]
+    return result
+
+
+def _shift(before, after):
+    """Per field ``{'a', 'b', 'delta'}`` between two stored statistics (either may be missing)"""
+    shift = {}
+    for field in SHIFT_FIELDS:
+        a = before.get(field) if before else None
+        b = after.get(field) if after else None
+        if field == 'count':
+            a, b = a or 0, b or 0
+        shift[field] = {'a': a, 'b': b, 'delta': b - a if a is not None and b is not None else None}
+    return shift
+
+
+def _statistic_shifts(dataset_a, dataset_b):
+    before = nest_statistics(stored_statistics(dataset_a))
+    after = nest_statistics(stored_statistics(dataset_b))
+    types = list(before['by_type']) + [name for name in after['by_type'] if name not in before['by_type']]
+    return {
+        'overall': {
+            parameter: _shift(before['overall'].get(parameter), after['overall'].get(parameter))
+            for parameter in NUMERIC_COLUMNS
+        },
+        'by_type': {
+            equip_type: {
+                parameter: _shift(
+                    before['by_type'].get(equip_type, {}).get(parameter),
+                    after['by_type'].get(equip_type, {}).get(parameter),
+                )
+                for parameter in NUMERIC_COLUMNS
+            }
+            for equip_type in types
+        },
+    }
+
+
+def compare_datasets(dataset_a, dataset_b, limit=DEFAULT_LIST_LIMIT):
+    """
+    Added, removed and retyped equipment, per-parameter deltas of the
+    equipment in both, and per-type statistic shifts, from ``a`` to ``b``.
+    Name lists are cut to ``limit`` entries; the counts are always complete.
+    """
+    a, b = _Side(dataset_a), _Side(dataset_b)
+
+    in_a = a.index.get_indexer(b.index)
+    in_b = b.index.get_indexer(a.index)
+    matched_b = np.flatnonzero(in_a >= 0)
+    matched_a = in_a[matched_b]
+    added = np.flatnonzero(in_a < 0)
+    removed = np.flatnonzero(in_b < 0)
+
+    names = b.index.to_numpy()[matched_b]
+    rows_a, rows_b = a.positions[matched_a], b.positions[matched_b]
+
+    types_a, types_b = a.types(rows_a), b.types(rows_b)
+    retyped = np.flatnonzero(types_a != types_b)
+
+    parameters = {}
+    for parameter in NUMERIC_COLUMNS:
+        before = np.asarray(a.payload.raw(parameter))[rows_a]
+        after = np.asarray(b.payload.raw(parameter))[rows_b]
+        parameters[parameter] = _parameter_deltas(names, before, after, limit)
+
+    return {
+        'a': a.summary(),
+        'b': b.summary(),
+        'equipment': {
+            'matched': len(matched_b),
+            'added': len(added),
+            'removed': len(removed),
+            'type_changed': len(retyped),
+            'unnamed': {'a': a.unnamed, 'b': b.unnamed},
+            'duplicate_names': {'a': a.duplicates, 'b': b.duplicates},
+        },
+        'added': b.index[added[:limit]].tolist(),
+        'removed': a.index[removed[:limit]].tolist(),
+        'type_changes': [
+            {'name': names[position], 'a': types_a[position], 'b': types_b[position]}
+            for position in retyped[:limit].tolist()
+        ],
+        'parameters': parameters,
+        **_statistic_shifts(dataset_a, dataset_b),
+    }
@@ -0,0 +1,110 @@
+"""
+Response compression negotiated with Accept-Encoding: brotli when the
+optional brotli package is installed and the client accepts it, gzip
+otherwise.
+
+API payloads (JSON, the formats of ``api.renderers``, text) of at least
+``settings.COMPRESSION_MIN_BYTES`` are compressed. Streamed downloads
+(reports and exports, ``api.streaming``) are sent as they are, so that
+byte ranges keep addressing the file. As with Django's GZipMiddleware, a
+compressed response's strong ETag becomes weak; If-None-Match compares
+weakly, so revalidation still gets a 304.
+"""
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+from .renderers import ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE
+from .timing import PHASE_COMPRESS, span
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING_BROTLI = 'br'
+ENCODING_GZIP = 'gzip'
+
+# Fast levels: these are compressed on every request, not once
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE,
+                      ARROW_MEDIA_TYPE}
+
+
+def compressible(content_type):
+    media_type = content_type.split(';')[0].strip().lower()
+    return media_type in COMPRESSIBLE_TYPES or media_type.startswith('text/')
+
+
+def encoding_qualities(header):
+    """``{coding: q}`` of an Accept-Encoding header, ``*`` included"""
+    qualities = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities
+
+
+def negotiate_encoding(header):
+    """
+    The coding the client gives the highest quality, or None to send the
+    body as it is. Our preference (brotli, then gzip) only breaks ties, so
+    ``gzip;q=1, br;q=0.1`` gets gzip. A coding listed by name takes its own
+    quality, so ``gzip;q=0, *`` refuses gzip; ``*`` covers only the
+    codings not listed. An ``identity`` ranked above every coding we have
+    leaves the body uncompressed.
+    """
+    qualities = encoding_qualities(header)
+    best, best_quality = None, 0
+    for coding in ([ENCODING_BROTLI] if brotli is not None else []) + [ENCODING_GZIP]:
+        quality = qualities.get(coding, qualities.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    if qualities.get('identity', 0) > best_quality:
+        return None
+    return best
+
+
+def compress(content, coding):
+    if coding == ENCODING_BROTLI:
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return compress_string(content)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress API payloads, see the module docstring"""
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not compressible(response.get('Content-Type', '')):
+            return response
+        patch_vary_headers(response, ['Accept-Encoding'])
+        if len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+        coding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        with span(PHASE_COMPRESS):
+            compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,161 @@
+"""
+Support for the async views (served under ASGI, see ``backend.asgi``).
+
+The async views read and write the database through the async ORM, or
+through ``sync_to_async`` where a helper needs a transaction, and keep
+the CPU-heavy work off the event loop:
+
+- ``offload`` runs CSV parsing, statistics and saving an upload on a pool
+  of ``settings.ASYNC_CPU_WORKERS`` threads. pandas, numpy and SQLite
+  release the GIL for most of it. Offloaded calls keep the request's
+  Server-Timing spans but get their own database connection, closed when
+  the call returns: Django connections cannot be shared between threads.
+- ``offload_render`` runs PDF layout on ``settings.ASYNC_RENDER_WORKERS``
+  processes. ReportLab is pure Python and holds the GIL, so in a thread
+  a few large reports would starve the event loop and every other request
+  with it. The function must not query the database or read settings:
+  the processes load the settings module, not the web process's settings,
+  so whatever it needs is passed as arguments.
+
+Both pools are bounded: however many uploads and reports are in flight,
+the rest wait their turn and requests such as history polls keep being
+served.
+"""
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def init_worker():
+    """Initializer of the process pools: sets Django up in the spawned process"""
+    # Runs before the app registry is ready: no model imports at module level
+    import django
+    django.setup()
+
+
+class ProcessPool:
+    """
+    A pool of ``settings.<workers_setting>`` spawned processes, started on
+    first use. A pool broken by a dead worker (e.g. OOM-killed) is replaced
+    on the next submit; the futures it held fail with ``BrokenProcessPool``.
+    Shared by the report jobs, bulk ingestion and report layout.
+    """
+
+    def __init__(self, workers_setting):
+        self.workers_setting = workers_setting
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return getattr(settings, self.workers_setting)
+
+    def get(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker,
+                )
+            return self._executor
+
+    def _reset(self, broken):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args):
+        executor = self.get()
+        try:
+            return executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._reset(executor)
+            return self.get().submit(func, *args)
+
+
+render_pool = ProcessPool('ASYNC_RENDER_WORKERS')
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.ASYNC_CPU_WORKERS, thread_name_prefix='api-cpu')
+        return _executor
+
+
+def _run_offloaded(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+async def offload_render(func, *args):
+    """Run ``func`` in a render process and await its result; 0 workers runs it on the CPU pool"""
+    if render_pool.workers <= 0:
+        return await offload(func, *args)
+    return await asyncio.wrap_future(render_pool.submit(func, *args))
+
+
+async def offload(func, *args, **kwargs):
+    """Run ``func`` on the CPU pool and await its result"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), context.run, _run_offloaded, func, args, kwargs
+    )
+
+
+class AsyncAPIView(APIView):
+    """
+    Base of the async views: an APIView whose handlers are coroutines.
+    Authentication runs through ``sync_to_async``, the authenticators query
+    the database synchronously; permissions, content negotiation, exception
+    handling and the mixins' ``initial`` and ``finalize_response`` hooks
+    then run on the event loop as they do for the other views. A profiled
+    request (see ``api.profiling``) covers the work done on the event
+    loop, not the offloaded calls.
+    """
+    permission_classes = [IsAuthenticated]
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.perform_authentication)(request)
+            self.initial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            # options() is APIView's own, synchronous
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        stopped = getattr(self, 'stopped_profile', None)
+        if stopped is not None:
+            # Saved outside the event loop
+            self.response = await sync_to_async(self.record_profile)(request, self.response, *stopped)
+        return self.response
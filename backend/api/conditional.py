@@ -0,0 +1,52 @@
+"""
+Conditional GET support.
+
+Views build a strong ETag and a Last-Modified time from metadata they can
+read cheaply (ids, timestamps, content hashes) and call ``not_modified``
+before doing any real work, so a client revalidating an unchanged resource
+gets a 304 without payloads being read or reports rendered.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from .storage import content_hash
+
+
+def make_etag(*parts):
+    """Quoted strong ETag hashed from ``parts``"""
+    return quote_etag(hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+def dataset_etag(dataset, *parts):
+    """ETag of a response derived from ``dataset``'s content and the given parts"""
+    return make_etag(dataset.id, dataset.upload_date.isoformat(), content_hash(dataset), *parts)
+
+
+def query_fingerprint(request):
+    """
+    Query parameters in a stable order, and the format negotiated from the
+    Accept header, for ETags of parameterized responses
+    """
+    fingerprint = '&'.join(f'{key}={value}' for key, values in sorted(request.GET.lists()) for value in values)
+    renderer = getattr(request, 'accepted_renderer', None)
+    return f'{fingerprint};{renderer.format}' if renderer is not None else fingerprint
+
+
+def set_validators(response, etag, last_modified=None):
+    """Attach the validators; clients may keep the response but must revalidate it"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 (or 412) response if the request's preconditions settle it, otherwise None"""
+    timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is not None and response.status_code == 304:
+        set_validators(response, etag, last_modified)
+    return response
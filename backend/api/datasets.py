@@ -0,0 +1,328 @@
+"""
+Saving ingested uploads, appending to stored datasets and enforcing
+per-user retention.
+
+An upload whose SHA-256 matches one of the user's stored datasets is not
+parsed again: the new dataset references the same payload and the same
+``DatasetAnalytics`` (type counts, statistics, anomaly flags and records),
+so a re-upload writes no rows but the dataset's own and its rollup.
+``payload_key`` and ``analytics`` are therefore references, counted by the
+datasets that hold them; an append to a shared dataset first copies both,
+and pruning deletes a payload's files and analytics rows only with their
+last reference.
+
+Every saved or appended dataset also flags its anomalies
+(``api.anomalies``) and refreshes its trend rollup (``api.trends``), which
+outlives the dataset when it is pruned.
+
+Shared by the single-file, bulk and append upload views.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .anomalies import detect_anomalies, reflag_later, statistic_bounds, stored_anomaly_count
+from .exports import export_cache
+from .history import history_cache
+from .ingest import ingest_csv
+from .models import (
+    DatasetAnalytics, DatasetAnomaly, DatasetStatistic, DatasetTypeCount, EquipmentDataset, EquipmentRecord,
+)
+from .records import load_records, save_records
+from .reports import report_cache
+from .stats import (
+    ALL_TYPES, merge_statistics, mergeable_statistics, payload_statistics, stored_statistics, stored_type_distribution,
+)
+from .storage import (
+    FORMAT_COLUMNAR, ColumnarPayload, PayloadAppender, PayloadLock, PayloadLocked, PayloadWriter, content_hash,
+    convert_to_columnar, copy_payload, delete_payload, open_columnar,
+)
+from .timing import PHASE_AGGREGATE, PHASE_INSERT, span
+from .trends import save_rollup
+
+# Datasets kept per user, older ones are pruned after each upload request
+RETAINED_DATASETS = 5
+
+
+def create_dataset(user, filename, payload_key, result):
+    """Save an ingested upload with its type counts, statistics and records"""
+    aggregates = result.aggregates
+    payload = ColumnarPayload(payload_key)
+    with span(PHASE_AGGREGATE):
+        statistics = payload_statistics(payload)
+        anomalies = detect_anomalies(payload)
+    with span(PHASE_INSERT), transaction.atomic():
+        dataset = EquipmentDataset.objects.create(
+            user=user,
+            filename=filename,
+            total_count=aggregates.total_count,
+            avg_flowrate=aggregates.mean('Flowrate'),
+            avg_pressure=aggregates.mean('Pressure'),
+            avg_temperature=aggregates.mean('Temperature'),
+            payload_key=payload_key,
+            content_hash=result.content_hash,
+            rejected_rows=result.rejections.count,
+            rejections=result.rejections.rows,
+            anomaly_count=len(anomalies)
+        )
+        dataset.save_type_distribution(aggregates.type_distribution)
+        dataset.save_statistics(statistics)
+        dataset.save_anomalies(anomalies)
+        save_rollup(dataset, statistics, aggregates.type_distribution)
+        load_records(dataset)
+        history_cache.invalidate(user.id)
+    return dataset
+
+
+def ingest_upload(file_obj):
+    """Stream an uploaded CSV into a new payload. Returns (payload key, ``IngestResult``)."""
+    with PayloadWriter() as writer:
+        result = ingest_csv(file_obj, writer)
+        return writer.commit(), result
+
+
+def _duplicates(user, digest):
+    return EquipmentDataset.objects.defer('csv_data').filter(
+        user=user, content_hash=digest, storage_format=FORMAT_COLUMNAR
+    ).exclude(payload_key='').order_by('-upload_date')
+
+
+def find_duplicate(user, digest):
+    """The user's most recent dataset uploaded from a file with this SHA-256, if any"""
+    if not digest:
+        return None
+    return _duplicates(user, digest).first()
+
+
+async def afind_duplicate(user, digest):
+    """``find_duplicate`` through the async ORM"""
+    if not digest:
+        return None
+    return await _duplicates(user, digest).afirst()
+
+
+def share_dataset(user, filename, source, locks=None):
+    """
+    Save an upload identical to ``source`` as a new dataset sharing its
+    payload and analytics. Only the dataset and its rollup are written.
+
+    The payload stays locked until the new reference is committed so that
+    an append to ``source`` sees it and copies the payload first. Callers
+    saving several datasets in one transaction pass a ``locks`` dict
+    (payload key -> ``PayloadLock``) and release the locks after commit.
+    Returns None when ``source`` is being appended to or no longer exists;
+    the upload then has to be ingested.
+    """
+    key = source.payload_key
+    held = locks if locks is not None else {}
+    if key not in held:
+        try:
+            held[key] = PayloadLock(key)
+        except (PayloadLocked, FileNotFoundError):
+            return None
+    try:
+        with transaction.atomic():
+            source = EquipmentDataset.objects.select_for_update().defer('csv_data').filter(
+                id=source.id, payload_key=key, content_hash=source.content_hash
+            ).first()
+            if source is None:
+                return None
+            dataset = EquipmentDataset.objects.create(
+                user=user,
+                filename=filename,
+                total_count=source.total_count,
+                avg_flowrate=source.avg_flowrate,
+                avg_pressure=source.avg_pressure,
+                avg_temperature=source.avg_temperature,
+                payload_key=key,
+                analytics_id=source.analytics_id,
+                content_hash=source.content_hash,
+                rejected_rows=source.rejected_rows,
+                rejections=source.rejections,
+                anomaly_count=source.anomaly_count
+            )
+            save_rollup(dataset, stored_statistics(source), stored_type_distribution(source))
+            history_cache.invalidate(user.id)
+    finally:
+        if locks is None:
+            held[key].release()
+    return dataset
+
+
+def payload_references(key):
+    return EquipmentDataset.objects.filter(payload_key=key).count()
+
+
+def release_payload(key):
+    """Delete a payload's files after commit if no dataset references it any more"""
+    if key and not EquipmentDataset.objects.filter(payload_key=key).exists():
+        transaction.on_commit(lambda: delete_payload(key))
+
+
+def analytics_references(analytics_id):
+    return EquipmentDataset.objects.filter(analytics_id=analytics_id).count()
+
+
+def release_analytics(analytics_id):
+    """Delete analytics and their rows if no dataset references them any more"""
+    if not EquipmentDataset.objects.filter(analytics_id=analytics_id).exists():
+        DatasetAnalytics.objects.filter(id=analytics_id).delete()
+
+
+def _copy_rows(model, source_id, target_id):
+    """Copy one table's rows of ``source_id`` analytics to ``target_id`` in a single INSERT ... SELECT"""
+    meta = model._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    owner = quote(meta.get_field('analytics').column)
+    columns = ', '.join(
+        quote(field.column) for field in meta.concrete_fields if not field.primary_key and field.name != 'analytics'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({owner}, {columns}) SELECT %s, {columns} FROM {table} WHERE {owner} = %s',
+            [target_id, source_id],
+        )
+
+
+def _private_analytics(dataset):
+    """
+    Give ``dataset`` analytics of its own if it shares them, so that an
+    append leaves the other datasets' rows as they are. Call inside the
+    append's transaction.
+    """
+    if analytics_references(dataset.analytics_id) == 1:
+        return
+    shared = dataset.analytics_id
+    dataset.analytics = DatasetAnalytics.objects.create(user_id=dataset.user_id)
+    for model in (DatasetTypeCount, DatasetStatistic, DatasetAnomaly, EquipmentRecord):
+        _copy_rows(model, shared, dataset.analytics_id)
+    dataset.save(update_fields=['analytics'])
+
+
+def _private_appender(dataset):
+    """
+    An appender on a payload only ``dataset`` references. A shared payload
+    is copied first, under its lock, so the other datasets keep their rows.
+    """
+    appender = PayloadAppender(dataset.payload_key)
+    if payload_references(dataset.payload_key) == 1:
+        return appender
+    try:
+        key = copy_payload(dataset.payload_key)
+    finally:
+        appender.release()
+    # Locked before the key is published, nothing can start sharing it
+    private = PayloadAppender(key)
+    try:
+        dataset.payload_key = key
+        dataset.save(update_fields=['payload_key'])
+    except Exception:
+        private.release()
+        delete_payload(key)
+        raise
+    return private
+
+
+def append_to_dataset(dataset, file_obj):
+    """
+    Add the rows of ``file_obj`` to a stored dataset.
+
+    Only the new rows are parsed and read: their running aggregates and
+    statistics are merged into the stored ones, so the cost depends on the
+    size of the delta, not of the dataset. The new rows are flagged against
+    the merged statistics; flagging the old rows again against the moved
+    bounds is left to a job queued on commit. Returns the number of rows
+    added and the ``RejectionReport`` of the file.
+    """
+    if dataset.storage_format != FORMAT_COLUMNAR:
+        convert_to_columnar(dataset)
+    stored_statistics = mergeable_statistics(dataset)
+    stored_anomaly_count(dataset)
+    stored_types = stored_type_distribution(dataset)
+
+    with _private_appender(dataset) as appender:
+        result = ingest_csv(file_obj, appender)
+        appender.commit()
+        payload = open_columnar(dataset)
+        start, stop = appender.base_rows, appender.rows
+
+        with span(PHASE_INSERT), transaction.atomic():
+            _private_analytics(dataset)
+            with span(PHASE_AGGREGATE):
+                statistics = merge_statistics(stored_statistics, payload_statistics(payload, start, stop))
+                anomalies = detect_anomalies(
+                    payload, start, stop, bounds=statistic_bounds(statistics, payload.categories('Type'))
+                )
+            overall = {row['parameter']: row for row in statistics if row['equipment_type'] == ALL_TYPES}
+
+            type_distribution = dict(stored_types)
+            for equip_type, count in result.aggregates.type_counts.items():
+                type_distribution[str(equip_type)] = type_distribution.get(str(equip_type), 0) + count
+            type_distribution = dict(sorted(type_distribution.items(), key=lambda item: item[1], reverse=True))
+
+            dataset.total_count += result.aggregates.total_count
+            for parameter in ('Flowrate', 'Pressure', 'Temperature'):
+                mean = overall[parameter]['mean']
+                setattr(dataset, f'avg_{parameter.lower()}', float('nan') if mean is None else mean)
+            dataset.content_hash = hashlib.sha256(
+                f'{content_hash(dataset)}:{result.content_hash}'.encode('ascii')
+            ).hexdigest()
+            dataset.rejected_rows += result.rejections.count
+            dataset.anomaly_count += len(anomalies)
+            dataset.rejections = (
+                dataset.rejections + [dict(row, file=file_obj.name) for row in result.rejections.rows]
+            )[:settings.REJECTION_REPORT_ROWS]
+            dataset.save(update_fields=[
+                'total_count', 'avg_flowrate', 'avg_pressure', 'avg_temperature', 'content_hash',
+                'rejected_rows', 'rejections', 'anomaly_count', 'updated_at',
+            ])
+
+            dataset.type_counts.all().delete()
+            dataset.save_type_distribution(type_distribution)
+            dataset.statistics.all().delete()
+            dataset.save_statistics(statistics)
+            save_rollup(dataset, statistics, type_distribution)
+            dataset.save_anomalies(anomalies)
+            reflag_later(dataset)
+            save_records(dataset, (
+                payload.to_frame(None, chunk, min(chunk + settings.CSV_CHUNK_ROWS, stop))
+                for chunk in range(start, stop, settings.CSV_CHUNK_ROWS)
+            ), start=start)
+            history_cache.invalidate(dataset.user_id)
+
+    report_cache.invalidate(dataset.id)
+    export_cache.invalidate(dataset.id)
+    return stop - start, result.rejections
+
+
+def upload_summary(dataset, type_distribution):
+    return {
+        'id': dataset.id,
+        'total_count': dataset.total_count,
+        'averages': {
+            'flowrate': round(dataset.avg_flowrate, 2),
+            'pressure': round(dataset.avg_pressure, 2),
+            'temperature': round(dataset.avg_temperature, 2)
+        },
+        'type_distribution': type_distribution,
+        'rejected_rows': dataset.rejected_rows,
+        'anomalies': dataset.anomaly_count,
+    }
+
+
+def prune_datasets(user, keep=RETAINED_DATASETS):
+    """Delete all but the user's ``keep`` most recent datasets, returns the pruned ids"""
+    pruned = []
+    for old in EquipmentDataset.objects.filter(user=user).defer('csv_data').order_by('-upload_date')[keep:]:
+        pruned.append(old.id)
+        report_cache.invalidate(old.id)
+        export_cache.invalidate(old.id)
+        with transaction.atomic():
+            old.delete()
+            release_payload(old.payload_key)
+            release_analytics(old.analytics_id)
+    if pruned:
+        history_cache.invalidate(user.id)
+    return pruned
@@ -0,0 +1,94 @@
+"""
+Dataset exports as CSV or NDJSON, and the on-disk export cache.
+
+An export is generated chunk by chunk from the stored payload, so it is
+never held in memory whole. The first download streams straight from the
+generator while teeing the bytes into the cache; later downloads are
+served from the cached file, with byte ranges (see ``api.streaming``).
+"""
+import hashlib
+import os
+
+import pandas as pd
+
+from .schema import SCHEMA
+from .storage import content_hash, iter_payload
+from .streaming import FileCache, partial_path
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+
+EXPORT_FORMATS = {
+    FORMAT_CSV: 'text/csv; charset=utf-8',
+    FORMAT_NDJSON: 'application/x-ndjson',
+}
+
+EXPORT_COLUMNS = list(SCHEMA)
+
+# Bump whenever export_chunks changes its output, so cached exports written
+# the old way are no longer served.
+EXPORT_FORMAT_VERSION = '1'
+
+
+def export_digest(dataset, export_format):
+    """Digest of everything an export depends on: the content and the format"""
+    key = '|'.join([content_hash(dataset), export_format, EXPORT_FORMAT_VERSION])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def export_chunks(dataset, export_format):
+    """Yield the dataset encoded as ``export_format``, one payload chunk at a time"""
+    header = True
+    for chunk in iter_payload(dataset, columns=EXPORT_COLUMNS):
+        chunk = chunk.reindex(columns=EXPORT_COLUMNS)
+        if export_format == FORMAT_CSV:
+            yield chunk.to_csv(index=False, header=header).encode()
+        else:
+            text = chunk.to_json(orient='records', lines=True, double_precision=15)
+            yield (text if text.endswith('\n') else text + '\n').encode()
+        header = False
+    if header and export_format == FORMAT_CSV:
+        # No rows: still a valid CSV file
+        yield pd.DataFrame(columns=EXPORT_COLUMNS).to_csv(index=False).encode()
+
+
+class ExportCache(FileCache):
+    """Exports on disk, named ``<dataset id>-<export digest>.<format>``"""
+    directory_setting = 'EXPORT_CACHE_DIR'
+    max_bytes_setting = 'EXPORT_CACHE_MAX_BYTES'
+
+    def path_for(self, dataset, export_format):
+        return self.directory / f'{dataset.id}-{export_digest(dataset, export_format)}.{export_format}'
+
+    def get(self, dataset, export_format):
+        return self.lookup(self.path_for(dataset, export_format))
+
+    def stream(self, dataset, export_format):
+        """
+        Yield the export while writing it into the cache. The file only
+        becomes visible once the last chunk is written; a download that is
+        abandoned halfway leaves nothing behind.
+        """
+        path = self.path_for(dataset, export_format)
+        tmp_path = partial_path(path)
+        try:
+            with open(tmp_path, 'wb') as output:
+                for block in export_chunks(dataset, export_format):
+                    output.write(block)
+                    yield block
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self.evict(keep=path)
+
+    def put(self, dataset, export_format):
+        """Write the export for ``dataset`` into the cache and return its path"""
+        for _ in self.stream(dataset, export_format):
+            pass
+        return self.path_for(dataset, export_format)
+
+    def get_or_build(self, dataset, export_format):
+        return self.get(dataset, export_format) or self.put(dataset, export_format)
+
+
+export_cache = ExportCache()
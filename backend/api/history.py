@@ -0,0 +1,177 @@
+"""
+Per-user cache of /api/history/ responses.
+
+Responses are kept in the ``history`` cache (see ``settings.CACHES``) under
+a per-user version token. Anything that changes a user's datasets (upload,
+append, prune) replaces the token once its transaction commits, so a
+response built from the database while the change was in flight is stored
+under the old token and never served. Entries also expire after the
+cache's TIMEOUT and are culled past MAX_ENTRIES.
+"""
+import threading
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import transaction
+
+from .conditional import make_etag
+from .models import EquipmentDataset
+from .stats import stored_type_distribution
+
+HISTORY_LENGTH = 5
+
+
+def _history_rows(user):
+    # The five most recent datasets joined to their (possibly shared) type
+    # counts, the payloads are never loaded
+    recent_ids = EquipmentDataset.objects.filter(user=user).order_by('-upload_date').values('id')[:HISTORY_LENGTH]
+    recent = EquipmentDataset.objects.filter(id__in=recent_ids).order_by('-upload_date', 'analytics__type_counts__id')
+    return recent.values(
+        'id', 'filename', 'upload_date', 'updated_at', 'content_hash', 'total_count',
+        'avg_flowrate', 'avg_pressure', 'avg_temperature', 'analytics__type_counts__equipment_type',
+        'analytics__type_counts__count'
+    )
+
+
+def _history_entry(user, rows):
+    history = {}
+    validators = []
+    for row in rows:
+        entry = history.get(row['id'])
+        if entry is None:
+            validators.append((row['id'], row['upload_date'].isoformat(), row['content_hash'], row['updated_at']))
+            entry = history[row['id']] = {
+                'id': row['id'],
+                'filename': row['filename'],
+                'upload_date': row['upload_date'].isoformat(),
+                'summary': {
+                    'total_count': row['total_count'],
+                    'avg_flowrate': round(row['avg_flowrate'], 2),
+                    'avg_pressure': round(row['avg_pressure'], 2),
+                    'avg_temperature': round(row['avg_temperature'], 2),
+                    'type_distribution': {}
+                }
+            }
+        equip_type = row['analytics__type_counts__equipment_type']
+        if equip_type is not None:
+            entry['summary']['type_distribution'][equip_type] = row['analytics__type_counts__count']
+    return {
+        'history': list(history.values()),
+        'etag': make_etag(user.id, *(part for validator in validators for part in validator)),
+        'last_modified': max((validator[3] for validator in validators), default=None),
+    }
+
+
+def _fill_type_distributions(history):
+    # Datasets uploaded before type counts were recorded have no rows to
+    # join; their counts are computed from the payload and saved once
+    for entry in history['history']:
+        summary = entry['summary']
+        if summary['type_distribution'] or not summary['total_count']:
+            continue
+        dataset = EquipmentDataset.objects.filter(id=entry['id']).first()
+        if dataset is not None:
+            summary['type_distribution'] = stored_type_distribution(dataset)
+    return history
+
+
+def load_history(user):
+    """
+    The user's five most recent datasets with their summaries, in one
+    query, as ``{'history': [...], 'etag': ..., 'last_modified': ...}``.
+    The ETag covers each dataset's id, upload time, content hash and
+    modification time.
+    """
+    return _fill_type_distributions(_history_entry(user, _history_rows(user)))
+
+
+async def aload_history(user):
+    """``load_history`` through the async ORM"""
+    history = _history_entry(user, [row async for row in _history_rows(user)])
+    return await sync_to_async(_fill_type_distributions)(history)
+
+
+class HistoryCache:
+    """Versioned per-user history entries with per-process hit/miss counters"""
+
+    def __init__(self, alias='history'):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version(self, user_id):
+        key = f'history-version:{user_id}'
+        version = self.cache.get(key)
+        if version is None:
+            # add() so two concurrent first requests agree on one token
+            self.cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    async def _aversion(self, user_id):
+        key = f'history-version:{user_id}'
+        version = await self.cache.aget(key)
+        if version is None:
+            await self.cache.aadd(key, uuid.uuid4().hex, timeout=None)
+            version = await self.cache.aget(key)
+        return version
+
+    def _count(self, history):
+        with self._lock:
+            if history is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def get_or_build(self, user):
+        """The user's cached ``load_history`` entry, loaded on a miss"""
+        key = f'history:3:{user.id}:{self._version(user.id)}'
+        history = self.cache.get(key)
+        self._count(history)
+        if history is None:
+            history = load_history(user)
+            self.cache.set(key, history)
+        return history
+
+    async def aget_or_build(self, user):
+        """``get_or_build`` for the async views"""
+        key = f'history:3:{user.id}:{await self._aversion(user.id)}'
+        history = await self.cache.aget(key)
+        self._count(history)
+        if history is None:
+            history = await aload_history(user)
+            await self.cache.aset(key, history)
+        return history
+
+    def invalidate(self, user_id):
+        """Drop the user's entry once the current transaction commits"""
+        def replace_version():
+            self.cache.set(f'history-version:{user_id}', uuid.uuid4().hex, timeout=None)
+            with self._lock:
+                self.invalidations += 1
+        transaction.on_commit(replace_version)
+
+    def stats(self):
+        with self._lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        lookups = hits + misses
+        cache = self.cache
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'invalidations': invalidations,
+            'backend': f'{type(cache).__module__}.{type(cache).__name__}',
+            'timeout_seconds': cache.default_timeout,
+            'max_entries': cache._max_entries,
+        }
+
+
+history_cache = HistoryCache()
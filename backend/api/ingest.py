@@ -0,0 +1,294 @@
+"""
+Streaming CSV ingestion.
+
+The upload is read ``settings.CSV_CHUNK_ROWS`` rows at a time. Each chunk
+updates the running count, sums and type counts and is appended to the
+stored payload before the next one is read, so peak memory depends on the
+chunk size rather than on the size of the file.
+
+Only the columns of ``api.schema.SCHEMA`` are parsed, with explicit types.
+The pyarrow CSV reader is used when pyarrow is installed (it is optional)
+and the pandas C parser otherwise. Rows with invalid values, and with
+pyarrow also malformed lines, go to the upload's rejection report rather
+than failing it.
+"""
+import csv
+import hashlib
+import io
+
+import pandas as pd
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .schema import NUMERIC_COLUMNS, SCHEMA, RejectionReport, missing_columns, validate_chunk
+from .timing import PHASE_AGGREGATE, PHASE_STORE, span, timed_chunks
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pc = pa_csv = None
+
+ENGINE_PYARROW = 'pyarrow'
+ENGINE_C = 'c'
+
+# pyarrow reads by bytes: about CSV_CHUNK_ROWS rows of a typical equipment CSV
+ARROW_BYTES_PER_ROW = 64
+
+
+class RunningAggregates:
+    """Count, column means and type distribution accumulated per chunk."""
+
+    def __init__(self):
+        self.total_count = 0
+        self.sums = dict.fromkeys(NUMERIC_COLUMNS, 0.0)
+        self.counts = dict.fromkeys(NUMERIC_COLUMNS, 0)
+        self.type_counts = {}
+
+    def update(self, chunk):
+        self.total_count += len(chunk)
+        for column in NUMERIC_COLUMNS:
+            values = chunk[column]
+            self.sums[column] += float(values.sum())
+            self.counts[column] += int(values.count())
+        for equip_type, count in chunk['Type'].value_counts().items():
+            if not count:
+                # Categories of rows rejected from this chunk
+                continue
+            self.type_counts[equip_type] = self.type_counts.get(equip_type, 0) + int(count)
+
+    def mean(self, column):
+        if not self.counts[column]:
+            return float('nan')
+        return self.sums[column] / self.counts[column]
+
+    @property
+    def type_distribution(self):
+        return dict(sorted(self.type_counts.items(), key=lambda item: item[1], reverse=True))
+
+
+class HashingReader:
+    """File wrapper that hashes the bytes as the parser reads them."""
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self._digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._digest.update(data if isinstance(data, bytes) else data.encode('utf-8'))
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    @property
+    def closed(self):
+        return False
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+
+class _ReplayReader:
+    """Byte stream that returns ``head`` before the rest of ``file_obj``."""
+
+    def __init__(self, head, file_obj):
+        self._head = head
+        self._file = file_obj
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._file.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._file.read(), b''
+        else:
+            data, self._head = self._head[:size], self._head[size:]
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    @property
+    def closed(self):
+        return False
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Upload handler that hashes each file as its chunks arrive and passes
+    them on unchanged to the handlers that store it. The digests are kept
+    per form field, in upload order.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._digest = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests.setdefault(self.field_name, []).append(self._digest.hexdigest())
+        return None
+
+    def digest(self, field_name, index=0):
+        digests = self.digests.get(field_name, [])
+        return digests[index] if index < len(digests) else None
+
+
+def hash_uploads(request):
+    """Hash the request's files while they are received; call before reading ``request.FILES``"""
+    handler = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, handler)
+    return handler
+
+
+class IngestResult:
+    def __init__(self, aggregates, content_hash, rejections):
+        self.aggregates = aggregates
+        self.content_hash = content_hash
+        self.rejections = rejections
+
+
+def default_engine(file_obj):
+    if pa_csv is not None and not isinstance(file_obj, io.TextIOBase):
+        return ENGINE_PYARROW
+    return ENGINE_C
+
+
+def _read_header(file_obj):
+    """Read past the header line. Returns (bytes read, column names)."""
+    head = b''
+    while b'\n' not in head:
+        block = file_obj.read(1 << 16)
+        if not block:
+            break
+        head += block
+    if not head.strip():
+        raise ValueError('CSV file is empty')
+    line = head.split(b'\n', 1)[0].decode('utf-8-sig').rstrip('\r')
+    return head, next(csv.reader([line]))
+
+
+def _arrow_chunks(file_obj, chunksize, rejections):
+    head, names = _read_header(file_obj)
+    missing = missing_columns(names)
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+    columns = [name for name in SCHEMA if name in names]
+
+    def divert(row):
+        rejections.add(
+            f'Expected {row.expected_columns} fields, found {row.actual_columns}',
+            line=row.number, text=row.text[:200],
+        )
+        return 'skip'
+
+    reader = pa_csv.open_csv(
+        _ReplayReader(head, file_obj),
+        read_options=pa_csv.ReadOptions(block_size=chunksize * ARROW_BYTES_PER_ROW),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=divert if rejections is not None else None),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            # Numbers arrive as text and are cast per batch, so that a bad
+            # value rejects its row instead of stopping the reader
+            column_types={
+                name: pa.dictionary(pa.int32(), pa.string()) if SCHEMA[name] == 'category' else pa.string()
+                for name in columns
+            },
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        chunk = {}
+        for name in columns:
+            values = batch.column(name)
+            if name in NUMERIC_COLUMNS:
+                try:
+                    chunk[name] = pc.cast(values, pa.float64()).to_numpy(zero_copy_only=False)
+                    continue
+                except pa.ArrowInvalid:
+                    # Converted, and the bad rows found, by validate_chunk
+                    pass
+            chunk[name] = values.to_pandas()
+        yield pd.DataFrame(chunk)
+
+
+def _pandas_chunks(file_obj, chunksize, rejections):
+    # Numbers are left to the C parser's own float conversion. Lines with
+    # extra fields are read up to the schema columns, not rejected.
+    dtype = {name: kind for name, kind in SCHEMA.items() if name not in NUMERIC_COLUMNS}
+    with pd.read_csv(file_obj, chunksize=chunksize, usecols=lambda name: name in SCHEMA, dtype=dtype) as reader:
+        for chunk in reader:
+            missing = missing_columns(chunk.columns)
+            if missing:
+                raise ValueError(f"Missing required columns: {', '.join(missing)}")
+            yield chunk
+
+
+def iter_chunks(file_obj, chunksize=None, rejections=None, engine=None):
+    """
+    Yield DataFrame chunks of the schema columns of a CSV.
+
+    With a ``RejectionReport``, rows with invalid values (and, with pyarrow,
+    malformed lines) are left out and recorded in it; without one they
+    raise ValueError.
+    ``engine`` is ``ENGINE_PYARROW`` or ``ENGINE_C``, the fastest available
+    one by default.
+    """
+    chunksize = chunksize or settings.CSV_CHUNK_ROWS
+    engine = engine or default_engine(file_obj)
+    parse = _arrow_chunks if engine == ENGINE_PYARROW else _pandas_chunks
+    first_row = 0
+    for chunk in parse(file_obj, chunksize, rejections):
+        rows = len(chunk)
+        if rejections is not None:
+            chunk = validate_chunk(chunk, first_row, rejections)
+        else:
+            for column in NUMERIC_COLUMNS:
+                chunk[column] = pd.to_numeric(chunk[column])
+        first_row += rows
+        yield chunk
+
+
+def ingest_csv(file_obj, writer, chunksize=None, engine=None):
+    """
+    Stream ``file_obj`` into ``writer`` while aggregating it.
+
+    Each chunk is dropped as soon as it has been written. Rejected rows are
+    reported in the result's ``rejections``.
+    """
+    aggregates = RunningAggregates()
+    rejections = RejectionReport()
+    reader = HashingReader(file_obj)
+
+    for chunk in timed_chunks(iter_chunks(reader, chunksize, rejections, engine)):
+        if not len(chunk):
+            continue
+        with span(PHASE_AGGREGATE):
+            aggregates.update(chunk)
+        with span(PHASE_STORE):
+            writer.write(chunk)
+
+    if not aggregates.total_count:
+        if rejections.count:
+            raise ValueError(f'CSV file contains no valid rows ({rejections.count} rejected)')
+        raise ValueError('CSV file contains no rows')
+    # The parser may stop before EOF (e.g. trailing blank lines), finish the hash
+    while reader.read(1 << 20):
+        pass
+    return IngestResult(aggregates, reader.hexdigest(), rejections)
@@ -0,0 +1,126 @@
+"""
+Background report rendering.
+
+Jobs are rows in ``ReportJob`` and run on a local process pool of
+``settings.REPORT_WORKERS`` processes; no broker is involved. A worker
+claims a job by flipping it from queued to running in a single UPDATE, so
+submitting the same job twice (e.g. from two web processes recovering after
+a restart) renders it once. With ``REPORT_WORKERS = 0`` jobs run inline,
+which is handy for tests and debugging.
+
+A job outlives the process that queued it. Jobs left queued or running by
+a stopped server or a dead worker are queued again by ``manage.py recover_report_jobs`` (run
+it at startup) and, failing that, by the first status or download request
+that finds them stale (``REPORT_JOB_STALE_SECONDS``).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .concurrency import ProcessPool
+
+pool = ProcessPool('REPORT_WORKERS')
+
+
+def render_report_job(job_id):
+    """Render one queued job. Runs inside a pool process."""
+    from .models import ReportJob
+    from .reports import report_cache
+
+    claimed = ReportJob.objects.filter(id=job_id, status=ReportJob.QUEUED).update(
+        status=ReportJob.RUNNING, started_at=timezone.now()
+    )
+    if not claimed:
+        return
+    try:
+        job = ReportJob.objects.select_related('dataset').get(id=job_id)
+        report_cache.get_or_build(job.dataset, job.detail_rows)
+    except ReportJob.DoesNotExist:
+        # The dataset (and with it the job) was pruned mid-render
+        return
+    except Exception as e:
+        ReportJob.objects.filter(id=job_id).update(
+            status=ReportJob.FAILED, error=str(e), finished_at=timezone.now()
+        )
+    else:
+        ReportJob.objects.filter(id=job_id).update(status=ReportJob.DONE, finished_at=timezone.now())
+
+
+def submit(job_id):
+    if pool.workers <= 0:
+        render_report_job(job_id)
+        return
+    pool.submit(render_report_job, job_id)
+
+
+def enqueue_report(dataset, user, detail_rows=None):
+    """Create a queued job for ``dataset`` and hand it to the pool on commit"""
+    from .models import ReportJob
+
+    job = ReportJob.objects.create(dataset=dataset, user=user, detail_rows=detail_rows)
+    transaction.on_commit(lambda: submit(job.id))
+    return job
+
+
+def lost_jobs():
+    """
+    Jobs presumed lost with the process that held them: queued or running
+    for longer than ``REPORT_JOB_STALE_SECONDS``.
+    """
+    from .models import ReportJob
+
+    stale_before = timezone.now() - timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS)
+    return (
+        Q(status=ReportJob.QUEUED, queued_at__lt=stale_before)
+        | Q(status=ReportJob.RUNNING, started_at__lt=stale_before)
+    )
+
+
+def requeue(job, condition):
+    """
+    Queue ``job`` again and submit it on commit if it still matches
+    ``condition``. The row is locked and the status rechecked in the UPDATE,
+    so concurrent requests queue it once. Returns the job as it now stands.
+    """
+    from .models import ReportJob
+
+    with transaction.atomic():
+        ReportJob.objects.select_for_update().filter(id=job.id).first()
+        requeued = ReportJob.objects.filter(condition, id=job.id).update(
+            status=ReportJob.QUEUED, queued_at=timezone.now(), started_at=None, finished_at=None, error=''
+        )
+        if requeued:
+            transaction.on_commit(lambda: submit(job.id))
+    job.refresh_from_db()
+    return job
+
+
+def resume_if_lost(job):
+    """``job``, queued again first if it is unfinished and presumed lost (see ``lost_jobs``)"""
+    from .models import ReportJob
+
+    if job.status not in (ReportJob.QUEUED, ReportJob.RUNNING):
+        return job
+    return requeue(job, lost_jobs())
+
+
+def recover_jobs():
+    """
+    Resubmit jobs left behind by a stopped server process.
+
+    Queued jobs are resubmitted as they are; running jobs that have not
+    finished within ``REPORT_JOB_STALE_SECONDS`` are assumed lost with the
+    worker that held them and are queued again. Returns the number of jobs
+    submitted.
+    """
+    from .models import ReportJob
+
+    stale = ReportJob.objects.filter(lost_jobs(), status=ReportJob.RUNNING)
+    stale.update(status=ReportJob.QUEUED, queued_at=timezone.now(), started_at=None)
+    queued = list(ReportJob.objects.filter(status=ReportJob.QUEUED).values_list('id', flat=True))
+    for job_id in queued:
+        submit(job_id)
+    return len(queued)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from api.models import EquipmentDataset, EquipmentRecord
+from api.records import load_records
+
+
+class Command(BaseCommand):
+    help = 'Store equipment records for datasets uploaded before rows were normalized'
+
+    def handle(self, *args, **options):
+        pending = EquipmentDataset.objects.filter(
+            ~Exists(EquipmentRecord.objects.filter(analytics=OuterRef('analytics')))
+        ).order_by('id')
+        filled = 0
+        for dataset_id in pending.values_list('id', flat=True):
+            dataset = EquipmentDataset.objects.get(id=dataset_id)
+            with transaction.atomic():
+                rows = load_records(dataset)
+            self.stdout.write(f'Dataset {dataset.id}: {rows:,} record(s)')
+            filled += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled records for {filled} dataset(s)'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.models import EquipmentDataset
+from api.stats import stored_statistics, stored_type_distribution
+from api.trends import save_rollup
+
+
+class Command(BaseCommand):
+    help = 'Create trend rollups for datasets uploaded before they were recorded'
+
+    def handle(self, *args, **options):
+        pending = EquipmentDataset.objects.filter(rollup__isnull=True).order_by('id')
+        filled = 0
+        for dataset_id in pending.values_list('id', flat=True):
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id)
+            save_rollup(dataset, stored_statistics(dataset), stored_type_distribution(dataset))
+            filled += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled rollups for {filled} dataset(s)'))
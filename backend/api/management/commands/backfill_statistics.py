@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.models import EquipmentDataset
+from api.stats import stored_statistics
+
+
+class Command(BaseCommand):
+    help = 'Compute per-type statistics for datasets uploaded before they were recorded'
+
+    def handle(self, *args, **options):
+        pending = EquipmentDataset.objects.filter(analytics__statistics__isnull=True).order_by('id')
+        filled = 0
+        for dataset_id in pending.values_list('id', flat=True):
+            stored_statistics(EquipmentDataset.objects.get(id=dataset_id))
+            filled += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled statistics for {filled} dataset(s)'))
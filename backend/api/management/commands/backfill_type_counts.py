@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.history import history_cache
+from api.models import EquipmentDataset
+from api.stats import stored_type_distribution
+
+
+class Command(BaseCommand):
+    help = 'Compute the stored type distribution for datasets uploaded before it was recorded'
+
+    def handle(self, *args, **options):
+        pending = EquipmentDataset.objects.filter(analytics__type_counts__isnull=True).order_by('id')
+        filled = 0
+        for dataset_id in pending.values_list('id', flat=True):
+            dataset = EquipmentDataset.objects.get(id=dataset_id)
+            with transaction.atomic():
+                stored_type_distribution(dataset)
+                history_cache.invalidate(dataset.user_id)
+            filled += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled type counts for {filled} dataset(s)'))
@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import SUITES, compare_results, run_metadata
+
+
+class Command(BaseCommand):
+    help = 'Run dataset pipeline benchmarks against synthetic equipment data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help=f"Suites to run: {', '.join(sorted(SUITES))} (default: all)")
+        parser.add_argument('--rows', nargs='+', type=int, default=[10_000, 100_000],
+                            help='Row counts to benchmark, e.g. 1000 10000 100000 1000000 10000000')
+        parser.add_argument('--output', help='Save the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Fraction a timing or peak memory may exceed the baseline (default: 0.25)')
+
+    def handle(self, *args, **options):
+        suites = options['suites'] or sorted(SUITES)
+        unknown = set(suites) - set(SUITES)
+        if unknown:
+            raise CommandError(f"Unknown suite(s): {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        report = {**run_metadata(), 'results': {}}
+        for suite in suites:
+            for rows in options['rows']:
+                results = SUITES[suite](rows)
+                # JSON object keys are strings, row counts included
+                report['results'].setdefault(suite, {})[str(rows)] = results
+                self.stdout.write(self.style.MIGRATE_HEADING(f'{suite} @ {rows:,} rows'))
+                for name, value in results.items():
+                    value = f'{value:.4f}' if isinstance(value, float) else value
+                    self.stdout.write(f'  {name:<28} {value}')
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f"Results saved to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_results(baseline['results'], report['results'], options['tolerance'])
+            revision = baseline.get('revision') or options['baseline']
+            for suite, rows, metric, before, after in regressions:
+                self.stdout.write(self.style.ERROR(
+                    f'  {suite} @ {int(rows):,} rows: {metric} {before:.4f} -> {after:.4f} '
+                    f'(+{(after / before - 1) * 100:.0f}%)'
+                ))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {revision}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {revision}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import write_synthetic_csv
+
+
+class Command(BaseCommand):
+    help = 'Write a synthetic equipment CSV shaped like sample_equipment_data.csv'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write')
+        parser.add_argument('--rows', type=int, default=100_000, help='Rows to generate (default: 100000)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same file')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 0:
+            raise CommandError('--rows must not be negative')
+        with open(options['path'], 'wb') as output:
+            write_synthetic_csv(output, options['rows'], options['seed'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['rows']:,} rows to {options['path']}"))
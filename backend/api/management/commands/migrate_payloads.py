@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.models import EquipmentDataset
+from api.storage import FORMAT_COLUMNAR, convert_to_columnar
+
+
+class Command(BaseCommand):
+    help = 'Convert datasets stored as inline CSV text or CSV files to the columnar payload format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List datasets that would be converted')
+
+    def handle(self, *args, **options):
+        legacy = EquipmentDataset.objects.exclude(storage_format=FORMAT_COLUMNAR).order_by('id')
+        converted = 0
+        for dataset_id in legacy.values_list('id', flat=True):
+            dataset = EquipmentDataset.objects.get(id=dataset_id)
+            if options['dry_run']:
+                self.stdout.write(f'Would convert dataset {dataset.id} ({dataset.storage_format})')
+                continue
+
+            convert_to_columnar(dataset)
+            converted += 1
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'Converted {converted} dataset(s)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import recover_jobs
+
+
+class Command(BaseCommand):
+    help = 'Render the report jobs a stopped server left queued or running; run it at startup'
+
+    def handle(self, *args, **options):
+        submitted = recover_jobs()
+        self.stdout.write(self.style.SUCCESS(f'Resubmitted {submitted} report job(s)'))
@@ -0,0 +1,154 @@
+"""
+Request metrics in the Prometheus text format.
+
+``ServerTimingMiddleware`` records every request here: counts by endpoint,
+method and status, latency and request/response size histograms, the
+p50/p95/p99 latency of the most recent ``settings.METRICS_WINDOW``
+requests per endpoint, and the time spent in each phase. The figures are
+per process and reset when it restarts; scrape each worker, or sum them.
+"""
+import bisect
+import threading
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+from rest_framework.permissions import BasePermission
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 256 bytes to 1 GiB in steps of 4
+SIZE_BUCKETS = tuple(256 * 4 ** step for step in range(12))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Buckets are upper bounds, inclusive as in Prometheus
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', {**labels, 'le': _number(bound)}, cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _line(name, labels, value):
+    label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+    return f'{name}{{{label_text}}} {_number(value)}' if label_text else f'{name} {_number(value)}'
+
+
+class RequestMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.latency = {}
+            self.recent = {}
+            self.request_sizes = {}
+            self.response_sizes = {}
+            self.phases = {}
+
+    def observe(self, endpoint, method, status, seconds, request_bytes, response_bytes, phases):
+        key = (endpoint, method)
+        with self._lock:
+            counted = (endpoint, method, str(status))
+            self.requests[counted] = self.requests.get(counted, 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.recent.setdefault(key, deque(maxlen=settings.METRICS_WINDOW)).append(seconds)
+            self.request_sizes.setdefault(key, Histogram(SIZE_BUCKETS)).observe(request_bytes)
+            if response_bytes is not None:
+                self.response_sizes.setdefault(key, Histogram(SIZE_BUCKETS)).observe(response_bytes)
+            for phase, (phase_seconds, count) in phases.items():
+                total, spans = self.phases.get((endpoint, phase), (0.0, 0))
+                self.phases[(endpoint, phase)] = (total + phase_seconds, spans + count)
+
+    def _families(self):
+        def labels(key):
+            return {'endpoint': key[0], 'method': key[1]}
+
+        yield 'api_requests_total', 'counter', 'Requests handled, by endpoint, method and status code.', [
+            ('api_requests_total', {'endpoint': endpoint, 'method': method, 'status': status}, count)
+            for (endpoint, method, status), count in sorted(self.requests.items())
+        ]
+        yield 'api_request_duration_seconds', 'histogram', 'Request latency, middleware to middleware.', [
+            sample for key, histogram in sorted(self.latency.items())
+            for sample in histogram.samples('api_request_duration_seconds', labels(key))
+        ]
+        summary = []
+        for key, window in sorted(self.recent.items()):
+            values = np.fromiter(window, dtype=np.float64)
+            for q, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+                summary.append(('api_request_latency_seconds', {**labels(key), 'quantile': _number(q)}, value))
+            summary.append(('api_request_latency_seconds_sum', labels(key), float(values.sum())))
+            summary.append(('api_request_latency_seconds_count', labels(key), len(values)))
+        yield (
+            'api_request_latency_seconds', 'summary',
+            f'Latency quantiles over the last {settings.METRICS_WINDOW} requests per endpoint.', summary,
+        )
+        yield 'api_request_size_bytes', 'histogram', 'Request body size (Content-Length).', [
+            sample for key, histogram in sorted(self.request_sizes.items())
+            for sample in histogram.samples('api_request_size_bytes', labels(key))
+        ]
+        yield 'api_response_size_bytes', 'histogram', 'Response body size, without streams of unknown length.', [
+            sample for key, histogram in sorted(self.response_sizes.items())
+            for sample in histogram.samples('api_response_size_bytes', labels(key))
+        ]
+        yield 'api_phase_seconds_total', 'counter', 'Time spent per request phase (see api.timing).', [
+            ('api_phase_seconds_total', {'endpoint': endpoint, 'phase': phase}, total)
+            for (endpoint, phase), (total, _) in sorted(self.phases.items())
+        ]
+        yield 'api_phase_spans_total', 'counter', 'Timed spans per request phase.', [
+            ('api_phase_spans_total', {'endpoint': endpoint, 'phase': phase}, spans)
+            for (endpoint, phase), (_, spans) in sorted(self.phases.items())
+        ]
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, kind, help_text, samples in self._families():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(_line(*sample) for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+
+class IsAllowedAddressOrAdminUser(BasePermission):
+    """
+    Staff users, and requests from ``settings.METRICS_ALLOWED_ADDRESSES``
+    (empty by default: a deployment opts its scraper's address in)
+    """
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_ADDRESSES:
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
+request_metrics = RequestMetrics()
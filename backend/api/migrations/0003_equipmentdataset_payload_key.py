@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_equipmentdataset_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="payload_key",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="equipmentdataset",
+            name="csv_data",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+def set_legacy_formats(apps, schema_editor):
+    EquipmentDataset = apps.get_model("api", "EquipmentDataset")
+    EquipmentDataset.objects.exclude(payload_key="").update(storage_format="csv")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_equipmentdataset_payload_key"),
+    ]
+
+    operations = [
+        # Rows that predate the columnar store keep their old layout until
+        # `manage.py migrate_payloads` converts them.
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="storage_format",
+            field=models.CharField(
+                choices=[
+                    ("text", "Inline CSV text"),
+                    ("csv", "CSV file"),
+                    ("columnar", "Columnar files"),
+                ],
+                default="text",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(set_legacy_formats, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="equipmentdataset",
+            name="storage_format",
+            field=models.CharField(
+                choices=[
+                    ("text", "Inline CSV text"),
+                    ("csv", "CSV file"),
+                    ("columnar", "Columnar files"),
+                ],
+                default="columnar",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_equipmentdataset_storage_format"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetTypeCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("equipment_type", models.CharField(max_length=255)),
+                ("count", models.IntegerField()),
+            ],
+            options={
+                "ordering": ["id"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="equipmentdataset",
+            index=models.Index(
+                fields=["user", "-upload_date"], name="dataset_user_recent_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="datasettypecount",
+            name="dataset",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="type_counts",
+                to="api.equipmentdataset",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="datasettypecount",
+            constraint=models.UniqueConstraint(
+                fields=("dataset", "equipment_type"), name="unique_dataset_type_count"
+            ),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_datasettypecount"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=64
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_reportjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reportjob",
+            name="detail_rows",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_reportjob_detail_rows"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EquipmentRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("row", models.IntegerField()),
+                (
+                    "equipment_name",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                (
+                    "equipment_type",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                ("flowrate", models.FloatField(null=True)),
+                ("pressure", models.FloatField(null=True)),
+                ("temperature", models.FloatField(null=True)),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="records",
+                        to="api.equipmentdataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["dataset", "row"],
+                "indexes": [
+                    models.Index(
+                        fields=["dataset", "equipment_type"], name="record_type_idx"
+                    ),
+                    models.Index(
+                        fields=["dataset", "flowrate"], name="record_flowrate_idx"
+                    ),
+                    models.Index(
+                        fields=["dataset", "pressure"], name="record_pressure_idx"
+                    ),
+                    models.Index(
+                        fields=["dataset", "temperature"], name="record_temperature_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dataset", "row"), name="unique_record_row"
+                    )
+                ],
+            },
+        ),
+    ]
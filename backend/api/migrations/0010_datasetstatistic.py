@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_equipmentrecord"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetStatistic",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("equipment_type", models.CharField(blank=True, max_length=255)),
+                ("parameter", models.CharField(max_length=32)),
+                ("count", models.IntegerField()),
+                ("mean", models.FloatField(null=True)),
+                ("std", models.FloatField(null=True)),
+                ("minimum", models.FloatField(null=True)),
+                ("maximum", models.FloatField(null=True)),
+                ("p50", models.FloatField(null=True)),
+                ("p95", models.FloatField(null=True)),
+                ("p99", models.FloatField(null=True)),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="statistics",
+                        to="api.equipmentdataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dataset", "equipment_type", "parameter"),
+                        name="unique_dataset_statistic",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_datasetstatistic"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="datasetstatistic",
+            name="percentiles_exact",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="datasetstatistic",
+            name="sketch",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
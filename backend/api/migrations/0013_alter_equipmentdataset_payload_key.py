@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_equipmentdataset_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="equipmentdataset",
+            name="payload_key",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=64),
+        ),
+    ]
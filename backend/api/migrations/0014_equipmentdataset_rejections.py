@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_alter_equipmentdataset_payload_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="rejected_rows",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="rejections",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_equipmentdataset_rejections"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                ("upload_date", models.DateTimeField()),
+                ("total_count", models.IntegerField()),
+                (
+                    "dataset",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="rollup",
+                        to="api.equipmentdataset",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="rollups",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-upload_date"],
+            },
+        ),
+        migrations.CreateModel(
+            name="RollupStatistic",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("equipment_type", models.CharField(blank=True, max_length=255)),
+                ("parameter", models.CharField(max_length=32)),
+                ("rows", models.IntegerField()),
+                ("count", models.IntegerField()),
+                ("mean", models.FloatField(null=True)),
+                ("std", models.FloatField(null=True)),
+                ("minimum", models.FloatField(null=True)),
+                ("maximum", models.FloatField(null=True)),
+                ("p50", models.FloatField(null=True)),
+                ("p95", models.FloatField(null=True)),
+                ("p99", models.FloatField(null=True)),
+                (
+                    "rollup",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="statistics",
+                        to="api.datasetrollup",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="datasetrollup",
+            index=models.Index(
+                fields=["user", "upload_date"], name="rollup_user_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="rollupstatistic",
+            index=models.Index(
+                fields=["parameter", "equipment_type"], name="rollup_stat_param_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="rollupstatistic",
+            constraint=models.UniqueConstraint(
+                fields=("rollup", "equipment_type", "parameter"),
+                name="unique_rollup_statistic",
+            ),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_datasetrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="anomaly_count",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="DatasetAnomaly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("row", models.IntegerField()),
+                (
+                    "equipment_name",
+                    models.CharField(blank=True, default="", max_length=255),
+                ),
+                ("equipment_type", models.CharField(max_length=255)),
+                ("parameter", models.CharField(max_length=32)),
+                ("value", models.FloatField()),
+                ("zscore", models.FloatField(null=True)),
+                ("zscore_flag", models.BooleanField(default=False)),
+                ("iqr_flag", models.BooleanField(default=False)),
+                (
+                    "dataset",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="anomalies",
+                        to="api.equipmentdataset",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["dataset", "row", "parameter"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dataset", "row", "parameter"),
+                        name="unique_dataset_anomaly",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:47
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_requestprofile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="reportjob",
+            name="queued_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
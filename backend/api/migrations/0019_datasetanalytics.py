@@ -0,0 +1,153 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import migrations, models
+
+
+def create_analytics(apps, schema_editor):
+    # Every dataset owns its derived rows so far: give it analytics with its
+    # own id, which the rows' dataset ids then already point at
+    DatasetAnalytics = apps.get_model("api", "DatasetAnalytics")
+    EquipmentDataset = apps.get_model("api", "EquipmentDataset")
+    DatasetAnalytics.objects.bulk_create(
+        [
+            DatasetAnalytics(id=dataset_id, user_id=user_id)
+            for dataset_id, user_id in EquipmentDataset.objects.values_list("id", "user_id").iterator()
+        ],
+        batch_size=1000,
+    )
+    EquipmentDataset.objects.update(analytics_id=models.F("id"))
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [DatasetAnalytics]):
+            cursor.execute(sql)
+
+
+def to_analytics(model_name, related_name, **options):
+    """Point a table of derived rows at the analytics instead of the dataset"""
+    return [
+        migrations.RenameField(model_name=model_name, old_name="dataset", new_name="analytics"),
+        migrations.AlterField(
+            model_name=model_name,
+            name="analytics",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name=related_name,
+                to="api.datasetanalytics",
+                **options,
+            ),
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("api", "0018_reportjob_queued_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetAnalytics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="equipmentdataset",
+            name="analytics",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.RESTRICT,
+                related_name="datasets",
+                to="api.datasetanalytics",
+            ),
+        ),
+        migrations.RunPython(create_analytics, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="equipmentdataset",
+            name="analytics",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.RESTRICT,
+                related_name="datasets",
+                to="api.datasetanalytics",
+            ),
+        ),
+        # Constraints and indexes naming the old field are put back on the new one
+        migrations.RemoveConstraint(model_name="datasettypecount", name="unique_dataset_type_count"),
+        migrations.RemoveConstraint(model_name="datasetstatistic", name="unique_dataset_statistic"),
+        migrations.RemoveConstraint(model_name="datasetanomaly", name="unique_dataset_anomaly"),
+        migrations.RemoveConstraint(model_name="equipmentrecord", name="unique_record_row"),
+        migrations.RemoveIndex(model_name="equipmentrecord", name="record_type_idx"),
+        migrations.RemoveIndex(model_name="equipmentrecord", name="record_flowrate_idx"),
+        migrations.RemoveIndex(model_name="equipmentrecord", name="record_pressure_idx"),
+        migrations.RemoveIndex(model_name="equipmentrecord", name="record_temperature_idx"),
+        *to_analytics("datasettypecount", "type_counts"),
+        *to_analytics("datasetstatistic", "statistics"),
+        *to_analytics("datasetanomaly", "anomalies", db_index=False),
+        *to_analytics("equipmentrecord", "records", db_index=False),
+        migrations.AlterModelOptions(
+            name="datasetanomaly",
+            options={"ordering": ["analytics", "row", "parameter"]},
+        ),
+        migrations.AlterModelOptions(
+            name="equipmentrecord",
+            options={"ordering": ["analytics", "row"]},
+        ),
+        migrations.AddConstraint(
+            model_name="datasettypecount",
+            constraint=models.UniqueConstraint(
+                fields=("analytics", "equipment_type"), name="unique_dataset_type_count"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="datasetstatistic",
+            constraint=models.UniqueConstraint(
+                fields=("analytics", "equipment_type", "parameter"), name="unique_dataset_statistic"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="datasetanomaly",
+            constraint=models.UniqueConstraint(
+                fields=("analytics", "row", "parameter"), name="unique_dataset_anomaly"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="equipmentrecord",
+            constraint=models.UniqueConstraint(fields=("analytics", "row"), name="unique_record_row"),
+        ),
+        migrations.AddIndex(
+            model_name="equipmentrecord",
+            index=models.Index(fields=["analytics", "equipment_type"], name="record_type_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="equipmentrecord",
+            index=models.Index(fields=["analytics", "flowrate"], name="record_flowrate_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="equipmentrecord",
+            index=models.Index(fields=["analytics", "pressure"], name="record_pressure_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="equipmentrecord",
+            index=models.Index(fields=["analytics", "temperature"], name="record_temperature_idx"),
+        ),
+    ]
@@ -1,21 +1,295 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+STORAGE_FORMAT_CHOICES = [
+    ('text', 'Inline CSV text'),
+    ('csv', 'CSV file'),
+    ('columnar', 'Columnar files'),
+]
+
+class DatasetAnalytics(models.Model):
+    """
+    Owner of the rows derived from a payload: type counts, statistics,
+    anomaly flags and records. Datasets uploaded from identical files share
+    one, like they share the payload, see api.datasets
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Analytics {self.id}"
+
 
 class EquipmentDataset(models.Model):
     """Model to store uploaded equipment datasets"""
     user = models.ForeignKey(User, on_delete=models.CASCADE) 
     filename = models.CharField(max_length=255)
-    csv_data = models.TextField()  
+    csv_data = models.TextField(blank=True, default='')  # legacy inline payload
+    payload_key = models.CharField(max_length=64, blank=True, default='', db_index=True)  # entry in DATASET_STORAGE_DIR, shared by identical uploads
+    storage_format = models.CharField(max_length=16, choices=STORAGE_FORMAT_CHOICES, default='columnar')
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # SHA-256 of the upload
     upload_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Last-Modified of the dataset's endpoints
     
    
     total_count = models.IntegerField()
     avg_flowrate = models.FloatField()
     avg_pressure = models.FloatField()
     avg_temperature = models.FloatField()
+    rejected_rows = models.IntegerField(default=0)  # rows left out by schema validation
+    rejections = models.JSONField(default=list, blank=True)  # the first of them with reasons, see api.schema
+    anomaly_count = models.IntegerField(null=True, blank=True)  # flagged values, None until checked, see api.anomalies
+    analytics = models.ForeignKey(DatasetAnalytics, on_delete=models.RESTRICT, related_name='datasets')
     
     def __str__(self):
         return f"{self.filename} - {self.upload_date}"
     
+    def save(self, *args, **kwargs):
+        # A new upload owns new analytics unless it is given shared ones
+        if self.analytics_id is None:
+            self.analytics = DatasetAnalytics.objects.create(user_id=self.user_id)
+        super().save(*args, **kwargs)
+    
+    # The rows of the dataset's analytics, possibly shared with identical uploads
+    
+    @property
+    def type_counts(self):
+        return DatasetTypeCount.objects.filter(analytics_id=self.analytics_id)
+    
+    @property
+    def statistics(self):
+        return DatasetStatistic.objects.filter(analytics_id=self.analytics_id)
+    
+    @property
+    def anomalies(self):
+        return DatasetAnomaly.objects.filter(analytics_id=self.analytics_id)
+    
+    @property
+    def records(self):
+        return EquipmentRecord.objects.filter(analytics_id=self.analytics_id)
+    
+    def save_type_distribution(self, type_distribution):
+        """Store {type: count} as summary rows, keeping the given order"""
+        DatasetTypeCount.objects.bulk_create([
+            DatasetTypeCount(analytics_id=self.analytics_id, equipment_type=str(equip_type), count=count)
+            for equip_type, count in type_distribution.items()
+        ])
+    
+    def save_statistics(self, statistics):
+        """Store the rows produced by api.stats.compute_statistics"""
+        DatasetStatistic.objects.bulk_create(
+            [DatasetStatistic(analytics_id=self.analytics_id, **row) for row in statistics]
+        )
+    
+    def save_anomalies(self, anomalies):
+        """Store the rows produced by api.anomalies.detect_anomalies"""
+        DatasetAnomaly.objects.bulk_create(
+            [DatasetAnomaly(analytics_id=self.analytics_id, **row) for row in anomalies],
+            batch_size=settings.RECORD_BATCH_SIZE,
+        )
+    
     class Meta:
         ordering = ['-upload_date']
+        indexes = [
+            models.Index(fields=['user', '-upload_date'], name='dataset_user_recent_idx'),
+        ]
+
+
+class DatasetTypeCount(models.Model):
+    """Equipment count per Type for a dataset, computed once at upload"""
+    analytics = models.ForeignKey(DatasetAnalytics, on_delete=models.CASCADE, related_name='type_counts')
+    equipment_type = models.CharField(max_length=255)
+    count = models.IntegerField()
+    
+    def __str__(self):
+        return f"{self.equipment_type}: {self.count}"
+    
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['analytics', 'equipment_type'], name='unique_dataset_type_count'),
+        ]
+
+
+class DatasetStatistic(models.Model):
+    """Descriptive statistics of one parameter for one Type, computed once at upload"""
+    analytics = models.ForeignKey(DatasetAnalytics, on_delete=models.CASCADE, related_name='statistics')
+    equipment_type = models.CharField(max_length=255, blank=True)  # '' covers every row
+    parameter = models.CharField(max_length=32)
+    count = models.IntegerField()
+    mean = models.FloatField(null=True)
+    std = models.FloatField(null=True)
+    minimum = models.FloatField(null=True)
+    maximum = models.FloatField(null=True)
+    p50 = models.FloatField(null=True)
+    p95 = models.FloatField(null=True)
+    p99 = models.FloatField(null=True)
+    percentiles_exact = models.BooleanField(default=True)  # False once appends merged them from sketches
+    sketch = models.JSONField(null=True, blank=True)  # mergeable quantile sketch, see api.stats
+    
+    def __str__(self):
+        return f"{self.equipment_type or 'All'} {self.parameter}"
+    
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['analytics', 'equipment_type', 'parameter'], name='unique_dataset_statistic'),
+        ]
+
+
+class DatasetAnomaly(models.Model):
+    """A value that is anomalous within its Type, flagged at upload"""
+    analytics = models.ForeignKey(DatasetAnalytics, on_delete=models.CASCADE, related_name='anomalies', db_index=False)
+    row = models.IntegerField()  # position in the stored payload
+    equipment_name = models.CharField(max_length=255, blank=True, default='')
+    equipment_type = models.CharField(max_length=255)
+    parameter = models.CharField(max_length=32)
+    value = models.FloatField()
+    zscore = models.FloatField(null=True)  # None when the Type's values do not vary
+    zscore_flag = models.BooleanField(default=False)  # beyond api.anomalies.Z_THRESHOLD
+    iqr_flag = models.BooleanField(default=False)  # outside the Type's IQR fences
+    
+    def __str__(self):
+        return f"{self.equipment_name} {self.parameter} = {self.value}"
+    
+    class Meta:
+        ordering = ['analytics', 'row', 'parameter']
+        constraints = [
+            models.UniqueConstraint(fields=['analytics', 'row', 'parameter'], name='unique_dataset_anomaly'),
+        ]
+
+
+class EquipmentRecord(models.Model):
+    """One row of an uploaded dataset, normalized so it can be filtered in SQL"""
+    # Covered by the (analytics, row) constraint, no separate index needed
+    analytics = models.ForeignKey(DatasetAnalytics, on_delete=models.CASCADE, related_name='records', db_index=False)
+    row = models.IntegerField()  # position in the stored payload
+    equipment_name = models.CharField(max_length=255, blank=True, default='')
+    equipment_type = models.CharField(max_length=255, blank=True, default='')
+    flowrate = models.FloatField(null=True)
+    pressure = models.FloatField(null=True)
+    temperature = models.FloatField(null=True)
+    
+    def __str__(self):
+        return f"{self.equipment_name} ({self.equipment_type})"
+    
+    class Meta:
+        ordering = ['analytics', 'row']
+        constraints = [
+            models.UniqueConstraint(fields=['analytics', 'row'], name='unique_record_row'),
+        ]
+        indexes = [
+            models.Index(fields=['analytics', 'equipment_type'], name='record_type_idx'),
+            models.Index(fields=['analytics', 'flowrate'], name='record_flowrate_idx'),
+            models.Index(fields=['analytics', 'pressure'], name='record_pressure_idx'),
+            models.Index(fields=['analytics', 'temperature'], name='record_temperature_idx'),
+        ]
+
+
+class DatasetRollup(models.Model):
+    """Compact summary of a dataset that is kept after the dataset is pruned, for trend queries"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rollups')
+    dataset = models.OneToOneField(
+        EquipmentDataset, on_delete=models.SET_NULL, null=True, blank=True, related_name='rollup'
+    )
+    filename = models.CharField(max_length=255)
+    upload_date = models.DateTimeField()  # the dataset's
+    total_count = models.IntegerField()
+    
+    def __str__(self):
+        return f"Rollup of {self.filename} - {self.upload_date}"
+    
+    class Meta:
+        ordering = ['-upload_date']
+        indexes = [
+            models.Index(fields=['user', 'upload_date'], name='rollup_user_date_idx'),
+        ]
+
+
+class RollupStatistic(models.Model):
+    """One parameter of one Type (or of every row) in a rollup"""
+    rollup = models.ForeignKey(DatasetRollup, on_delete=models.CASCADE, related_name='statistics')
+    equipment_type = models.CharField(max_length=255, blank=True)  # '' covers every row
+    parameter = models.CharField(max_length=32)
+    rows = models.IntegerField()  # rows of the type, with or without a value
+    count = models.IntegerField()  # rows with a value
+    mean = models.FloatField(null=True)
+    std = models.FloatField(null=True)
+    minimum = models.FloatField(null=True)
+    maximum = models.FloatField(null=True)
+    p50 = models.FloatField(null=True)
+    p95 = models.FloatField(null=True)
+    p99 = models.FloatField(null=True)
+    
+    def __str__(self):
+        return f"{self.equipment_type or 'All'} {self.parameter}"
+    
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['rollup', 'equipment_type', 'parameter'], name='unique_rollup_statistic'),
+        ]
+        indexes = [
+            models.Index(fields=['parameter', 'equipment_type'], name='rollup_stat_param_idx'),
+        ]
+
+
+class ReportJob(models.Model):
+    """Background PDF render requested through POST /api/report/<id>/"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    dataset = models.ForeignKey(EquipmentDataset, on_delete=models.CASCADE, related_name='report_jobs')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    detail_rows = models.PositiveIntegerField(null=True, blank=True)  # None lists every row, 0 is summary only
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    queued_at = models.DateTimeField(default=timezone.now)  # last (re)queued, see api.jobs.lost_jobs
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Report job {self.id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class RequestProfile(models.Model):
+    """cProfile capture of one request, taken on a staff user's request (see api.profiling)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    endpoint = models.CharField(max_length=64)  # URL name of the view
+    method = models.CharField(max_length=8)
+    path = models.CharField(max_length=255)
+    # Kept as a plain id, the profile outlives a pruned dataset
+    dataset = models.ForeignKey(
+        EquipmentDataset, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        related_name='+',
+    )
+    rows = models.IntegerField(null=True, blank=True)  # the dataset's row count at capture
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField()  # seconds, as profiled
+    file = models.CharField(max_length=255)  # pstats dump, relative to PROFILE_DIR
+    summary = models.TextField(blank=True, default='')  # hottest calls by cumulative time
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.created_at:%Y-%m-%d %H:%M:%S})"
+    
+    class Meta:
+        ordering = ['-created_at']
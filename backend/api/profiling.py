@@ -0,0 +1,142 @@
+"""
+Opt-in profiling of single requests.
+
+A staff user adds ``?profile=1`` or an ``X-Profile: 1`` header to a request
+to a view using ``ProfiledViewMixin``. The request then runs under cProfile,
+JSON rendering included. The stats are dumped to ``settings.PROFILE_DIR``
+and recorded as a ``RequestProfile`` with the dataset id and row count. The
+response names the profile in ``X-Profile-Id``; profiles are listed and
+downloaded through the admin and can be opened with ``pstats`` or snakeviz.
+Only the newest ``settings.PROFILE_RETAINED`` profiles are kept.
+
+Requests from other users, or without the flag, run unprofiled.
+"""
+import cProfile
+import io
+import pstats
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import EquipmentDataset, RequestProfile
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+SUMMARY_LINES = 40
+
+
+def profile_dir():
+    path = Path(settings.PROFILE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def profile_requested(request):
+    flag = request.query_params.get(PROFILE_PARAM) or request.META.get(PROFILE_HEADER)
+    return flag in ('1', 'true', 'yes') and bool(request.user and request.user.is_staff)
+
+
+def _summary(profiler):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return stream.getvalue()
+
+
+def _dataset(view, response):
+    """The dataset a profiled request was about: the URL's, or the one it created"""
+    dataset_id = view.kwargs.get('dataset_id')
+    if dataset_id is None and isinstance(getattr(response, 'data', None), dict):
+        dataset_id = response.data.get('id')
+    if dataset_id is None:
+        return None, None
+    rows = EquipmentDataset.objects.filter(id=dataset_id).values_list('total_count', flat=True).first()
+    return dataset_id, rows
+
+
+def save_profile(view, request, response, profiler, duration):
+    profile_id = uuid.uuid4()
+    path = profile_dir() / f'{profile_id}.prof'
+    profiler.dump_stats(path)
+    dataset_id, rows = _dataset(view, response)
+    match = request.resolver_match
+    profile = RequestProfile.objects.create(
+        id=profile_id,
+        user=request.user,
+        endpoint=match.url_name if match is not None else '',
+        method=request.method,
+        path=request.get_full_path()[:255],
+        dataset_id=dataset_id,
+        rows=rows,
+        status_code=response.status_code,
+        duration=duration,
+        file=path.name,
+        summary=_summary(profiler),
+    )
+    prune_profiles()
+    return profile
+
+
+def delete_profiles(profiles):
+    """Delete profiles with their files"""
+    for name in profiles.values_list('file', flat=True):
+        (Path(settings.PROFILE_DIR) / name).unlink(missing_ok=True)
+    profiles.delete()
+
+
+def prune_profiles(keep=None):
+    keep = settings.PROFILE_RETAINED if keep is None else keep
+    stale = RequestProfile.objects.order_by('-created_at').values_list('id', flat=True)[keep:]
+    delete_profiles(RequestProfile.objects.filter(id__in=list(stale)))
+
+
+class ProfiledViewMixin:
+    """
+    APIView mixin: profile the handler and the rendering of the response
+    when ``profile_requested``. Goes before APIView (or AsyncAPIView) in
+    the bases.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        self._profiler = None
+        super().initial(request, *args, **kwargs)
+        # Authentication has run, request.user is the token's user
+        if profile_requested(request):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active in this thread
+                return
+            self._profiler = profiler
+            self._profile_started = time.perf_counter()
+
+    def stop_profiling(self, response):
+        """Render the response and stop the profiler. Returns (profiler, duration), None if not profiling."""
+        profiler = getattr(self, '_profiler', None)
+        if profiler is None:
+            return None
+        try:
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        finally:
+            profiler.disable()
+            self._profiler = None
+        return profiler, time.perf_counter() - self._profile_started
+
+    def record_profile(self, request, response, profiler, duration):
+        profile = save_profile(view=self, request=request, response=response, profiler=profiler, duration=duration)
+        response['X-Profile-Id'] = str(profile.id)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        stopped = self.stop_profiling(response)
+        if stopped is None:
+            return response
+        if self.view_is_async:
+            # No queries on the event loop: AsyncAPIView.dispatch records it
+            self.stopped_profile = stopped
+            return response
+        return self.record_profile(request, response, *stopped)
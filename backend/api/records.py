@@ -0,0 +1,129 @@
+"""
+Normalized equipment rows.
+
+Every uploaded row is also stored as an ``EquipmentRecord`` so that
+filtering by type or parameter range and aggregating the result run as SQL
+against indexed columns instead of loading the payload into pandas.
+Records belong to the dataset's analytics, so identical uploads share them.
+"""
+import numpy as np
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Min
+
+from .ingest import NUMERIC_COLUMNS
+from .models import EquipmentRecord
+from .rows import MAX_PAGE_SIZE, DEFAULT_PAGE_SIZE, RowQueryError, decode_cursor, encode_cursor
+from .storage import iter_payload
+
+RECORD_FIELDS = {
+    'Flowrate': 'flowrate',
+    'Pressure': 'pressure',
+    'Temperature': 'temperature',
+}
+
+
+def _text(values):
+    return [str(value) if value == value and value is not None else '' for value in values]
+
+
+def _floats(values):
+    return [None if np.isnan(value) else float(value) for value in values.to_numpy(dtype='float64')]
+
+
+def save_records(dataset, chunks, start=0):
+    """
+    Insert DataFrame chunks as records, ``settings.RECORD_BATCH_SIZE`` rows
+    per INSERT. Call inside a transaction so a failed upload leaves none.
+    """
+    row = start
+    for chunk in chunks:
+        names = _text(chunk['Equipment Name']) if 'Equipment Name' in chunk else [''] * len(chunk)
+        numeric = [_floats(chunk[column]) for column in NUMERIC_COLUMNS]
+        EquipmentRecord.objects.bulk_create(
+            [
+                EquipmentRecord(
+                    analytics_id=dataset.analytics_id, row=position, equipment_name=name, equipment_type=equip_type,
+                    flowrate=flowrate, pressure=pressure, temperature=temperature,
+                )
+                for position, name, equip_type, flowrate, pressure, temperature in zip(
+                    range(row, row + len(chunk)), names, _text(chunk['Type']), *numeric
+                )
+            ],
+            batch_size=settings.RECORD_BATCH_SIZE,
+        )
+        row += len(chunk)
+    return row - start
+
+
+def load_records(dataset):
+    """Fill the record table for a dataset from its stored payload"""
+    return save_records(dataset, iter_payload(dataset))
+
+
+def parse_record_query(params):
+    """
+    Validate ``type`` (comma separated), ``<parameter>_min``/``_max``,
+    ``limit`` and ``after``. Returns (filters, limit, cursor).
+    """
+    filters = {}
+    if params.get('type'):
+        filters['equipment_type__in'] = [name.strip() for name in params['type'].split(',') if name.strip()]
+    for field in RECORD_FIELDS.values():
+        for suffix, lookup in (('min', 'gte'), ('max', 'lte')):
+            value = params.get(f'{field}_{suffix}')
+            if value in (None, ''):
+                continue
+            try:
+                filters[f'{field}__{lookup}'] = float(value)
+            except ValueError:
+                raise RowQueryError(f'{field}_{suffix} must be a number')
+
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise RowQueryError('limit must be an integer')
+    if not 0 <= limit <= MAX_PAGE_SIZE:
+        raise RowQueryError(f'limit must be between 0 and {MAX_PAGE_SIZE}')
+
+    cursor = decode_cursor(params['after']) if params.get('after') else None
+    return filters, limit, cursor
+
+
+def _aggregates():
+    aggregates = {}
+    for field in RECORD_FIELDS.values():
+        aggregates[f'avg_{field}'] = Avg(field)
+        aggregates[f'min_{field}'] = Min(field)
+        aggregates[f'max_{field}'] = Max(field)
+    return aggregates
+
+
+def query_records(dataset, filters, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """Count and aggregate the matching records in SQL, plus one page of them"""
+    matching = dataset.records.filter(**filters)
+
+    totals = matching.aggregate(count=Count('id'), **_aggregates())
+    by_type = list(
+        matching.order_by()
+        .values('equipment_type')
+        .annotate(count=Count('id'), **_aggregates())
+        .order_by('-count', 'equipment_type')
+    )
+
+    page = matching.order_by('row')
+    if cursor is not None:
+        page = page.filter(row__gt=cursor.get('row', -1))
+    records = list(page.values(
+        'row', 'equipment_name', 'equipment_type', *RECORD_FIELDS.values()
+    )[:limit]) if limit else []
+
+    next_cursor = None
+    if limit and len(records) == limit:
+        next_cursor = encode_cursor({'row': records[-1]['row']})
+    return {
+        'count': totals.pop('count'),
+        'aggregates': totals,
+        'by_type': by_type,
+        'records': records,
+        'next': next_cursor,
+    }
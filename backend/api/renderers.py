@@ -0,0 +1,194 @@
+"""
+Compact representations of the data-bearing responses, picked by DRF's
+content negotiation from the Accept header (or ``?format=``).
+
+Views using ``TabularViewMixin`` name the field of their response that
+holds the table (``table_field``): a DataFrame or a list of records.
+Besides the default JSON, one object per record, it can be fetched as
+
+- ``application/vnd.equipment.columnar+json`` (``?format=columnar``): one
+  array per column, the other fields as they are;
+- ``application/msgpack`` (``?format=msgpack``): the same layout in
+  MessagePack, when the optional msgpack package is installed;
+- ``application/vnd.apache.arrow.stream`` (``?format=arrow``): the table
+  as an Arrow IPC stream with the other fields as JSON in the schema
+  metadata (``ARROW_METADATA_KEY``), when pyarrow is installed.
+
+``read_table`` shows how a client loads each of them into pandas without
+building a dict per record. Compression is negotiated separately, see
+``api.compression``.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .timing import PHASE_SERIALIZE, span
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.equipment.columnar+json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+ARROW_METADATA_KEY = b'response'
+
+
+def column_values(series):
+    """A column as a list of Python values, None for missing ones"""
+    if series.hasnans:
+        return series.astype(object).where(series.notna(), None).tolist()
+    return series.tolist()
+
+
+def frame_records(frame):
+    return frame.astype(object).where(frame.notna(), None).to_dict('records')
+
+
+def table_columns(table):
+    """A DataFrame or a list of records as ``{column: values}``"""
+    if isinstance(table, pd.DataFrame):
+        return {str(name): column_values(table[name]) for name in table.columns}
+    names = list(table[0]) if table else []
+    return {name: [record.get(name) for record in table] for name in names}
+
+
+def _table_field(renderer_context):
+    return getattr((renderer_context or {}).get('view'), 'table_field', None)
+
+
+def _split(data, field):
+    """(the table, the other fields); error responses have no table"""
+    if not isinstance(data, dict) or field not in data:
+        return None, data
+    return data[field], {key: value for key, value in data.items() if key != field}
+
+
+def _columnar(data, field):
+    if not isinstance(data, dict) or field not in data:
+        return data
+    return {**data, field: table_columns(data[field])}
+
+
+class RecordsJSONRenderer(JSONRenderer):
+    """The default JSON: the table as one object per record"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span(PHASE_SERIALIZE):
+            field = _table_field(renderer_context)
+            if isinstance(data, dict) and isinstance(data.get(field), pd.DataFrame):
+                data = {**data, field: frame_records(data[field])}
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = COLUMNAR_MEDIA_TYPE
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span(PHASE_SERIALIZE):
+            return super().render(_columnar(data, _table_field(renderer_context)), accepted_media_type,
+                                  renderer_context)
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with span(PHASE_SERIALIZE):
+            return msgpack.packb(_columnar(data, _table_field(renderer_context)), default=_msgpack_default)
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    media_type = ARROW_MEDIA_TYPE
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with span(PHASE_SERIALIZE):
+            table, rest = _split(data, _table_field(renderer_context))
+            if isinstance(table, pd.DataFrame):
+                table = pa.Table.from_pandas(table, preserve_index=False)
+            else:
+                table = pa.Table.from_pylist(table or [])
+            metadata = {**(table.schema.metadata or {}), ARROW_METADATA_KEY: json.dumps(rest, cls=JSONEncoder)}
+            table = table.replace_schema_metadata(metadata)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes()
+
+
+def tabular_renderers():
+    """JSON first, so that clients accepting anything keep getting it"""
+    renderers = [RecordsJSONRenderer]
+    if pa is not None:
+        renderers.append(ArrowStreamRenderer)
+    if msgpack is not None:
+        renderers.append(MessagePackRenderer)
+    return renderers + [ColumnarJSONRenderer, BrowsableAPIRenderer]
+
+
+def read_table(content_type, body, field):
+    """
+    (the table as a DataFrame, the other fields) of a tabular response's
+    body. The desktop client decodes with its own copy,
+    frontend-desktop/table_formats.py; keep the two in sync.
+    """
+    media_type = content_type.split(';')[0].strip()
+    if media_type == ARROW_MEDIA_TYPE:
+        reader = pa.ipc.open_stream(body)
+        frame = reader.read_pandas()
+        return frame, json.loads(reader.schema.metadata[ARROW_METADATA_KEY])
+    if media_type == MSGPACK_MEDIA_TYPE:
+        data = msgpack.unpackb(body)
+    else:
+        data = json.loads(body)
+    table = data.pop(field, [])
+    if media_type in (MSGPACK_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE):
+        return pd.DataFrame(table), data
+    return pd.DataFrame.from_records(table), data
+
+
+class TabularViewMixin:
+    """
+    APIView mixin: the ``table_field`` of the response in any of the
+    formats above. Goes before APIView in the bases. Error responses are
+    always JSON, so clients decode them one way whatever they asked for.
+    """
+    table_field = None
+    renderer_classes = tabular_renderers()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        renderer = getattr(request, 'accepted_renderer', None)
+        if response.status_code >= 400 and getattr(renderer, 'render_style', None) == 'binary':
+            request.accepted_renderer = RecordsJSONRenderer()
+            request.accepted_media_type = RecordsJSONRenderer.media_type
+        response = super().finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -0,0 +1,464 @@
+"""
+PDF report generation and the on-disk report cache.
+"""
+import hashlib
+import itertools
+import os
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .anomalies import IQR_FACTOR, Z_THRESHOLD, flagged_cells, stored_anomaly_count
+from .concurrency import offload, offload_render
+from .stats import ALL_TYPES, stored_statistics, stored_type_distribution
+from .storage import FORMAT_COLUMNAR, content_hash, convert_to_columnar, iter_payload, open_columnar
+from .streaming import FileCache, partial_path
+from .timing import PHASE_PDF, span
+
+# Bump whenever build_report changes what ends up in the PDF, so cached
+# reports rendered with the old layout are no longer served.
+REPORT_TEMPLATE_VERSION = '4'
+
+DETAIL_COLUMNS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+NUMERIC_DETAIL_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+
+DETAIL_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
+])
+
+# Cells of values flagged by api.anomalies
+ANOMALY_BACKGROUND = colors.HexColor('#f8d7da')
+ANOMALY_TEXT = colors.HexColor('#842029')
+
+STATISTICS_COLUMNS = ['Type', 'Count', 'Min', 'Max', 'Mean', 'Std', 'P50', 'P95', 'P99']
+STATISTICS_FIELDS = ['minimum', 'maximum', 'mean', 'std', 'p50', 'p95', 'p99']
+
+STATISTICS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+    ('BACKGROUND', (0, -1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+
+def format_detail_rows(chunk):
+    """Format a DataFrame chunk into table rows, one vectorized pass per column"""
+    columns = []
+    for name in DETAIL_COLUMNS:
+        if name not in chunk.columns:
+            columns.append(np.full(len(chunk), '', dtype='U1'))
+        elif name in NUMERIC_DETAIL_COLUMNS:
+            values = pd.to_numeric(chunk[name], errors='coerce').to_numpy(dtype=float)
+            columns.append(np.where(np.isnan(values), '', np.round(values, 2).astype(str)))
+        else:
+            columns.append(chunk[name].fillna('').astype(str).to_numpy(dtype=str))
+    if not len(chunk):
+        return []
+    return np.column_stack(columns).tolist()
+
+
+def detail_rows_per_page(available_height):
+    """How many detail rows fit under a table header in ``available_height``"""
+    _, header_height = _detail_table([]).wrap(0, 0)
+    _, row_height = _detail_table([['Xy'] * len(DETAIL_COLUMNS)]).wrap(0, 0)
+    row_height -= header_height
+    return max(1, int((available_height - header_height) // row_height))
+
+
+def _highlights(flagged, start, count):
+    """(table row, column) of the flagged cells among detail rows ``start`` to ``start + count``"""
+    if not flagged:
+        return []
+    return [
+        (row - start, DETAIL_COLUMNS.index(parameter))
+        for row in range(start, start + count) if row in flagged
+        for parameter in flagged[row]
+    ]
+
+
+def iter_detail_tables(detail_chunks, first_page_rows, page_rows, flagged=None):
+    """
+    Turn detail rows into a sequence of page-sized tables.
+
+    One Table per page keeps ReportLab's layout cost linear in the row
+    count; a single huge Table is re-split on every page. ``flagged`` maps
+    a row position to the parameters whose cells are highlighted.
+    """
+    capacity = first_page_rows
+    pending = []
+    start = 0
+    first = True
+    for chunk in detail_chunks:
+        pending.extend(format_detail_rows(chunk))
+        while len(pending) >= capacity:
+            rows, pending = pending[:capacity], pending[capacity:]
+            if not first:
+                yield PageBreak()
+            yield _detail_table(rows, _highlights(flagged, start, len(rows)))
+            start += len(rows)
+            first, capacity = False, page_rows
+    if pending:
+        if not first:
+            yield PageBreak()
+        yield _detail_table(pending, _highlights(flagged, start, len(pending)))
+
+
+def statistics_tables(statistics, type_order, heading_style):
+    """One table per parameter: a row per type in ``type_order``, then all types"""
+    flowables = []
+    by_parameter = {}
+    for row in statistics:
+        by_parameter.setdefault(row['parameter'], {})[row['equipment_type']] = row
+    for parameter, rows in by_parameter.items():
+        table_data = [STATISTICS_COLUMNS]
+        labels = [label for label in type_order if label in rows] + [ALL_TYPES]
+        for label in labels:
+            row = rows[label]
+            table_data.append(
+                [label or 'All types', str(row['count'])]
+                + ['' if row[field] is None else f'{row[field]:.2f}' for field in STATISTICS_FIELDS]
+            )
+        table = Table(table_data, colWidths=[1.2*inch] + [0.65*inch] * 8, repeatRows=1)
+        table.setStyle(STATISTICS_TABLE_STYLE)
+        flowables.extend([Paragraph(parameter, heading_style), table])
+    return flowables
+
+
+def _detail_table(rows, highlights=()):
+    table = Table([DETAIL_COLUMNS] + rows, colWidths=[1.5*inch, 1.2*inch, 1*inch, 1*inch, 1*inch], repeatRows=1)
+    table.setStyle(DETAIL_TABLE_STYLE)
+    if highlights:
+        commands = []
+        for row, column in highlights:
+            cell = (column, row + 1)
+            commands.extend([
+                ('BACKGROUND', cell, cell, ANOMALY_BACKGROUND),
+                ('TEXTCOLOR', cell, cell, ANOMALY_TEXT),
+                ('FONTNAME', cell, cell, 'Helvetica-Bold'),
+            ])
+        table.setStyle(TableStyle(commands))
+    return table
+
+
+class _StreamedStory(list):
+    """
+    Story list that pulls flowables from an iterator as the build consumes it.
+
+    ``doc.build`` pops flowables off the front and checks ``len()`` before
+    each one, so topping the list up there keeps only a few detail tables
+    alive at a time instead of the whole dataset.
+    """
+
+    LOOKAHEAD = 4
+
+    def __init__(self, head, tail):
+        super().__init__(head)
+        self._tail = iter(tail)
+
+    def __len__(self):
+        while self._tail is not None and super().__len__() < self.LOOKAHEAD:
+            try:
+                self.append(next(self._tail))
+            except StopIteration:
+                self._tail = None
+        return super().__len__()
+
+
+def parse_detail_rows(value):
+    """Validate a ``rows`` query value: None for every row, 0 for summary only"""
+    if value in (None, ''):
+        return settings.REPORT_DETAIL_ROWS
+    rows = int(value)
+    if rows < 0:
+        raise ValueError('rows must be zero or a positive integer')
+    return rows
+
+
+def report_context(dataset, detail_rows=None):
+    """The values ``render_report`` needs besides the detail rows, read from the database"""
+    type_dist = stored_type_distribution(dataset)
+    anomaly_count = stored_anomaly_count(dataset)
+    return {
+        'filename': dataset.filename,
+        'upload_date': dataset.upload_date,
+        'summary': {
+            'total_count': dataset.total_count,
+            'avg_flowrate': dataset.avg_flowrate,
+            'avg_pressure': dataset.avg_pressure,
+            'avg_temperature': dataset.avg_temperature,
+            'anomaly_count': anomaly_count,
+        },
+        'type_distribution': type_dist,
+        'statistics': stored_statistics(dataset),
+        'flagged': {} if detail_rows == 0 else flagged_cells(dataset, detail_rows),
+    }
+
+
+def detail_chunks(dataset, detail_rows=None):
+    """The rows listed in the Equipment Details section, streamed from the payload"""
+    if detail_rows == 0:
+        return []
+    return iter_payload(dataset, columns=DETAIL_COLUMNS, limit=detail_rows)
+
+
+def build_report(dataset, output, detail_rows=None):
+    """
+    Render the equipment analysis report for ``dataset`` into ``output``.
+
+    ``detail_rows`` limits the Equipment Details section to the first N rows
+    (0 leaves it out); None lists every row. Rows are streamed from the
+    payload, so memory stays flat however many are listed. Values flagged
+    as anomalous within their Type are highlighted.
+    """
+    render_report(
+        output,
+        detail_chunks=detail_chunks(dataset, detail_rows),
+        detail_rows=detail_rows,
+        **report_context(dataset, detail_rows),
+    )
+
+
+def write_report(path, detail_rows, context, chunks):
+    """Render a report from its ``report_context`` and detail row chunks into ``path``, atomically"""
+    path = Path(path)
+    tmp_path = partial_path(path)
+    try:
+        with open(tmp_path, 'wb') as output:
+            render_report(output, detail_chunks=chunks, detail_rows=detail_rows, **context)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return path
+
+
+def write_payload_report(path, payload, detail_rows, context, chunksize):
+    """
+    ``write_report`` with the detail rows read from ``payload``, a
+    ``ColumnarPayload`` opened by the caller, ``chunksize`` rows at a time.
+    Makes no queries and reads no settings, so it can run in a render
+    process (see ``api.concurrency``).
+    """
+    chunks = [] if detail_rows == 0 else payload.chunks(DETAIL_COLUMNS, chunksize, detail_rows)
+    return write_report(path, detail_rows, context, chunks)
+
+
+def report_payload(dataset):
+    """The dataset's columnar payload, converting a legacy one first"""
+    if dataset.storage_format != FORMAT_COLUMNAR:
+        convert_to_columnar(dataset)
+    return open_columnar(dataset)
+
+
+def render_report(output, filename, upload_date, summary, type_distribution, detail_chunks, detail_rows=None,
+                  statistics=None, flagged=None):
+    """Lay out the report from already-loaded values"""
+    # Create PDF document
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    story = []
+
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#007bff'),
+        spaceAfter=30,
+        alignment=1 
+    )
+
+    heading_style = ParagraphStyle(
+        'CustomHeading',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.HexColor('#007bff'),
+        spaceAfter=12,
+        spaceBefore=12
+    )
+
+    #Title
+    story.append(Paragraph("Equipment Analysis Report", title_style))
+    story.append(Spacer(1, 0.3*inch))
+
+    #Report Info
+    report_info = f"<b>Report Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br/>"
+    report_info += f"<b>File:</b> {filename}<br/>"
+    report_info += f"<b>Upload Date:</b> {upload_date.strftime('%Y-%m-%d %H:%M:%S')}"
+    story.append(Paragraph(report_info, styles['Normal']))
+    story.append(Spacer(1, 0.3*inch))
+
+    #Summary Statistics Section
+    story.append(Paragraph("Summary Statistics", heading_style))
+    summary_data = [
+        ['Metric', 'Value'],
+        ['Total Equipment Count', str(summary['total_count'])],
+        ['Average Flowrate', f"{summary['avg_flowrate']:.2f}"],
+        ['Average Pressure', f"{summary['avg_pressure']:.2f}"],
+        ['Average Temperature', f"{summary['avg_temperature']:.2f}"]
+    ]
+    if summary.get('anomaly_count') is not None:
+        summary_data.append(['Anomalous Values', str(summary['anomaly_count'])])
+    summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(summary_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    #Equipment Type Distribution
+    story.append(Paragraph("Equipment Type Distribution", heading_style))
+
+    type_data = [['Equipment Type', 'Count']]
+    for equip_type, count in type_distribution.items():
+        type_data.append([equip_type, str(count)])
+
+    type_table = Table(type_data, colWidths=[3*inch, 2*inch])
+    type_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(type_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    #Statistics by Type
+    if statistics:
+        story.append(PageBreak())
+        story.append(Paragraph("Statistics by Type", heading_style))
+        parameter_style = ParagraphStyle('StatisticsParameter', parent=styles['Heading3'], spaceBefore=6)
+        story.extend(statistics_tables(statistics, list(type_distribution), parameter_style))
+
+    # Equipment Data Table, streamed one page-sized table at a time
+    detail_tables = []
+    if detail_rows != 0:
+        story.append(PageBreak())
+        details_heading = [Paragraph("Equipment Details", heading_style)]
+        if detail_rows is not None and detail_rows < summary['total_count']:
+            details_heading.append(Paragraph(
+                f"Showing the first {detail_rows:,} of {summary['total_count']:,} rows.", styles['Normal']
+            ))
+            details_heading.append(Spacer(1, 0.1*inch))
+        if flagged:
+            details_heading.append(Paragraph(
+                f"Highlighted values are anomalous within their Type: more than {Z_THRESHOLD:g} standard "
+                f"deviations from its mean, or more than {IQR_FACTOR:g} interquartile ranges outside its quartiles.",
+                styles['Normal']
+            ))
+            details_heading.append(Spacer(1, 0.1*inch))
+        story.extend(details_heading)
+
+        # The frame has 6pt of padding on each side
+        page_height = doc.height - 12
+        heading_height = sum(
+            flowable.wrap(doc.width, page_height)[1] + flowable.getSpaceBefore() + flowable.getSpaceAfter()
+            for flowable in details_heading
+        )
+        detail_tables = iter_detail_tables(
+            detail_chunks,
+            detail_rows_per_page(page_height - heading_height),
+            detail_rows_per_page(page_height),
+            flagged,
+        )
+
+    # Footer
+    footer = [
+        Spacer(1, 0.3*inch),
+        Spacer(1, 0.2*inch),
+        Paragraph("<i>This report was automatically generated by the Chemical Equipment Parameter Visualizer system.</i>", styles['Normal']),
+    ]
+
+    # Build PDF
+    with span(PHASE_PDF):
+        doc.build(_StreamedStory(story, itertools.chain(detail_tables, footer)))
+
+
+def report_digest(dataset, detail_rows=None):
+    """Hash of everything the rendered report depends on"""
+    parts = [
+        content_hash(dataset),
+        dataset.filename,
+        dataset.upload_date.isoformat(),
+        REPORT_TEMPLATE_VERSION,
+        'all' if detail_rows is None else str(detail_rows),
+    ]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ReportCache(FileCache):
+    """Rendered PDFs on disk, named ``<dataset id>-<report digest>.pdf``"""
+    directory_setting = 'REPORT_CACHE_DIR'
+    max_bytes_setting = 'REPORT_CACHE_MAX_BYTES'
+
+    def path_for(self, dataset, detail_rows=None):
+        return self.directory / f'{dataset.id}-{report_digest(dataset, detail_rows)}.pdf'
+
+    def get(self, dataset, detail_rows=None):
+        return self.lookup(self.path_for(dataset, detail_rows))
+
+    def put(self, dataset, detail_rows=None):
+        """Render the report for ``dataset`` into the cache and return its path"""
+        path = self.path_for(dataset, detail_rows)
+        write_report(path, detail_rows, report_context(dataset, detail_rows), detail_chunks(dataset, detail_rows))
+        self.evict(keep=path)
+        return path
+
+    def get_or_build(self, dataset, detail_rows=None):
+        return self.get(dataset, detail_rows) or self.put(dataset, detail_rows)
+
+    async def aget_or_build(self, dataset, detail_rows=None):
+        """
+        ``get_or_build`` for the async views: the queries run on the CPU
+        pool and the layout in a render process, see ``api.concurrency``.
+        """
+        path = await offload(self.get, dataset, detail_rows)
+        if path is None:
+            path = self.path_for(dataset, detail_rows)
+            context = await offload(report_context, dataset, detail_rows)
+            payload = await offload(report_payload, dataset)
+            # Spans in a render process are lost, so the layout is timed here
+            with span(PHASE_PDF) if settings.ASYNC_RENDER_WORKERS > 0 else nullcontext():
+                await offload_render(
+                    write_payload_report, path, payload, detail_rows, context, settings.CSV_CHUNK_ROWS
+                )
+            await offload(self.evict, keep=path)
+        return path
+
+
+report_cache = ReportCache()
@@ -0,0 +1,133 @@
+"""
+Keyset pagination over a dataset's stored rows.
+
+Pages are addressed by an opaque cursor holding the last row returned (and
+its sort key when sorted), never by an offset, so each page only touches
+the rows it returns plus, when sorted, a binary search of the column's
+cached sort index and sorted keys.
+"""
+import base64
+import binascii
+import json
+
+import numpy as np
+
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+
+
+class RowQueryError(ValueError):
+    pass
+
+
+def encode_cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+def _is_position(value):
+    # Row positions and ids, within int64 like the arrays and columns they index
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 2 ** 63
+
+
+def _sort_key(value):
+    """A cursor's sort key as a float, None when it is not a number"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        return float(value)
+    except OverflowError:
+        return None
+
+
+def decode_cursor(cursor, positions=('row',)):
+    """The dict held by a cursor; its ``positions`` fields must be non-negative integers"""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, ValueError, UnicodeError):
+        raise RowQueryError('Invalid cursor')
+    if not isinstance(decoded, dict) or not all(_is_position(decoded.get(field)) for field in positions):
+        raise RowQueryError('Invalid cursor')
+    return decoded
+
+
+def parse_row_query(params, available_columns):
+    """Validate ``limit``, ``columns``, ``sort`` and ``after`` query parameters"""
+    try:
+        limit = int(params.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise RowQueryError('limit must be an integer')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise RowQueryError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    columns = available_columns
+    if params.get('columns'):
+        columns = [name.strip() for name in params['columns'].split(',') if name.strip()]
+        unknown = [name for name in columns if name not in available_columns]
+        if unknown:
+            raise RowQueryError(f"Unknown columns: {', '.join(unknown)}")
+
+    sort = params.get('sort') or None
+    descending = False
+    if sort:
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        if sort not in available_columns:
+            raise RowQueryError(f'Unknown sort column: {sort}')
+
+    cursor = decode_cursor(params['after']) if params.get('after') else None
+    if cursor is not None and cursor.get('sort') != sort:
+        raise RowQueryError('Cursor does not match the requested sort')
+    if cursor is not None and sort is not None:
+        cursor['key'] = _sort_key(cursor.get('key'))
+        if cursor['key'] is None:
+            raise RowQueryError('Invalid cursor')
+    return limit, columns, sort, descending, cursor
+
+
+def _page_positions(payload, limit, sort, descending, cursor):
+    """Row positions for the page and the cursor of its last row"""
+    if sort is None:
+        start = cursor['row'] + 1 if cursor else 0
+        positions = np.arange(start, min(start + limit, payload.rows))
+        last_key = None
+    else:
+        order, keys = payload.sort_index(sort)
+        if cursor is None:
+            start, end = 0, len(order)
+        else:
+            key = np.float64(cursor['key'])
+            low = int(np.searchsorted(keys, key, side='left'))
+            high = int(np.searchsorted(keys, key, side='right'))
+            # Within equal keys rows are in ascending position order
+            side = 'left' if descending else 'right'
+            split = low + int(np.searchsorted(order[low:high], cursor['row'], side=side))
+            start, end = (0, split) if descending else (split, len(order))
+        if descending:
+            start = max(start, end - limit)
+            positions = np.asarray(order[start:end])[::-1]
+            last = start
+        else:
+            end = min(start + limit, end)
+            positions = np.asarray(order[start:end])
+            last = end - 1
+        last_key = float(keys[last]) if len(positions) else None
+    return positions, last_key
+
+
+def fetch_rows(payload, limit, columns, sort=None, descending=False, cursor=None):
+    """One page, its rows as a DataFrame (rendered by ``api.renderers``)"""
+    positions, last_key = _page_positions(payload, limit, sort, descending, cursor)
+    frame = payload.take(columns, positions)
+    frame.insert(0, '_row', positions)
+
+    next_cursor = None
+    if len(positions) == limit:
+        last = {'sort': sort, 'row': int(positions[-1])}
+        if sort is not None:
+            last['key'] = last_key
+        next_cursor = encode_cursor(last)
+    return {
+        'columns': list(columns),
+        'rows': frame,
+        'next': next_cursor,
+    }
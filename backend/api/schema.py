@@ -0,0 +1,108 @@
+"""
+The equipment CSV schema.
+
+Only the columns listed in ``SCHEMA`` are read, with the given dtypes;
+anything else in an upload is ignored. Rows whose numeric values cannot be
+parsed, are not finite or fall outside ``VALUE_RANGES`` are left out of the
+dataset and listed in a ``RejectionReport`` instead of failing the upload.
+Empty values are kept as missing.
+"""
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+NUMERIC_COLUMNS = ['Flowrate', 'Pressure', 'Temperature']
+REQUIRED_COLUMNS = ['Type'] + NUMERIC_COLUMNS
+
+# Column -> pandas dtype
+SCHEMA = {
+    'Equipment Name': 'str',
+    'Type': 'category',
+    'Flowrate': 'float64',
+    'Pressure': 'float64',
+    'Temperature': 'float64',
+}
+
+# Allowed (minimum, maximum) per numeric column, None leaves a side open
+VALUE_RANGES = {
+    'Flowrate': (0.0, None),
+    'Pressure': (0.0, None),
+    'Temperature': (-273.15, None),
+}
+
+
+def missing_columns(columns):
+    return [column for column in REQUIRED_COLUMNS if column not in columns]
+
+
+class RejectionReport:
+    """
+    Rows left out of an upload: how many, and the first
+    ``settings.REJECTION_REPORT_ROWS`` with the reason. Malformed lines are
+    identified by ``line`` (in the file), rows with bad values by ``row``
+    (1-based, among the rows the parser read).
+    """
+
+    def __init__(self, limit=None):
+        self.limit = settings.REJECTION_REPORT_ROWS if limit is None else limit
+        self.count = 0
+        self.rows = []
+
+    def add(self, reason, **where):
+        self.count += 1
+        if len(self.rows) < self.limit:
+            self.rows.append({**where, 'reason': reason})
+
+    def as_dict(self):
+        return {'count': self.count, 'rows': self.rows}
+
+
+def _reason(column, value, low, high):
+    if pd.isna(value):
+        return f'{column} is not a number'
+    if not np.isfinite(value):
+        return f'{column} is not finite'
+    bounds = ' and '.join(
+        f'{word} {bound:g}' for word, bound in (('at least', low), ('at most', high)) if bound is not None
+    )
+    return f'{column} must be {bounds}'
+
+
+def validate_chunk(chunk, first_row, report):
+    """
+    Convert the numeric columns of a parsed chunk to float64 and divert rows
+    with unparseable or out of range values to ``report``. ``first_row`` is
+    the 0-based position of the chunk's first row. Returns the kept rows.
+    """
+    rejected = np.zeros(len(chunk), dtype=bool)
+    problems = []
+    for column in NUMERIC_COLUMNS:
+        raw = chunk[column]
+        values = raw if raw.dtype == np.float64 else pd.to_numeric(raw, errors='coerce').astype(np.float64)
+        array = values.to_numpy()
+        bad = np.isnan(array) & raw.notna().to_numpy()
+        bad |= np.isinf(array)
+        low, high = VALUE_RANGES.get(column, (None, None))
+        with np.errstate(invalid='ignore'):
+            if low is not None:
+                bad |= array < low
+            if high is not None:
+                bad |= array > high
+        chunk[column] = values
+        if bad.any():
+            problems.append((column, raw, array, bad, low, high))
+            rejected |= bad
+    if not rejected.any():
+        return chunk
+
+    positions = np.flatnonzero(rejected)
+    listed = positions[:max(report.limit - len(report.rows), 0)]
+    for position in listed:
+        # Report the first failing column of each row
+        column, raw, array, _, low, high = next(problem for problem in problems if problem[3][position])
+        report.add(
+            _reason(column, array[position], low, high),
+            row=first_row + int(position) + 1, column=column, value=str(raw.iloc[position]),
+        )
+    report.count += len(positions) - len(listed)
+    return chunk[~rejected]
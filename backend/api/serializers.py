@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import EquipmentDataset
+from django.urls import reverse
+from .models import EquipmentDataset, ReportJob
 from django.contrib.auth.models import User
 
 class EquipmentDatasetSerializer(serializers.ModelSerializer):
@@ -11,3 +12,19 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']  
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'dataset', 'detail_rows', 'status', 'error', 'created_at', 'started_at', 'finished_at',
+                  'status_url', 'download_url']
+
+    def get_status_url(self, job):
+        return reverse('report-job-status', args=[job.id])
+
+    def get_download_url(self, job):
+        return reverse('report-job-download', args=[job.id])
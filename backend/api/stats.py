@@ -0,0 +1,296 @@
+"""
+Per-type descriptive statistics.
+
+For each parameter the values are grouped by type with one stable radix
+argsort of the small-integer type codes and each type's slice is then
+sorted in place. With every type a contiguous sorted slice, count, mean,
+std, min, max and percentiles all come from segment reductions and index
+arithmetic; nothing loops over rows in Python. Statistics are computed once
+at upload and stored as ``DatasetStatistic`` rows.
+
+Every row also carries a quantile sketch so that appends can merge the
+statistics of the new rows into the stored ones without reading the old
+rows again: count, mean and std merge exactly (Chan et al.), min and max
+trivially, and the percentiles of a merged row are read from the merged
+sketch, within ``SKETCH_ACCURACY`` relative error.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from .ingest import NUMERIC_COLUMNS
+from .storage import FORMAT_COLUMNAR, convert_to_columnar, open_columnar, read_payload
+
+PERCENTILES = (50, 95, 99)
+STAT_FIELDS = ['count', 'mean', 'std', 'minimum', 'maximum'] + [f'p{q}' for q in PERCENTILES]
+
+# equipment_type of the rows covering the whole dataset
+ALL_TYPES = ''
+
+# Relative accuracy of percentiles read from a sketch (DDSketch-style
+# logarithmic buckets: every value in a bucket is within 1% of its estimate)
+SKETCH_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# Bucket keys of float64 magnitudes stay well inside +/- 2**16
+_KEY_OFFSET = 1 << 16
+_KEY_SPAN = 1 << 17
+
+
+def grouped_statistics(group_ids, values, groups, percentiles=PERCENTILES):
+    """
+    Statistics of ``values`` for each group id in ``range(groups)``.
+
+    Rows with a negative group id or a NaN value are left out. Returns a
+    dict of arrays of length ``groups``; std is the sample standard
+    deviation (ddof=1) and percentiles (``p<q>`` for each of
+    ``percentiles``) interpolate linearly, like pandas.
+    """
+    mask = (group_ids >= 0) & ~np.isnan(values)
+    # Narrow codes make numpy's stable argsort a radix sort
+    group_ids = group_ids[mask].astype(np.min_scalar_type(max(groups - 1, 0)))
+    values = values[mask]
+    order = np.argsort(group_ids, kind='stable')
+    group_ids = group_ids[order].astype(np.intp)
+    values = values[order]
+
+    count = np.bincount(group_ids, minlength=groups)
+    start = np.cumsum(count) - count
+    for group in np.flatnonzero(count > 1):
+        values[start[group]:start[group] + count[group]].sort()
+    result = {'count': count}
+    if not len(values):
+        for field in ['mean', 'std', 'minimum', 'maximum'] + [f'p{q}' for q in percentiles]:
+            result[field] = np.full(groups, np.nan)
+        return result
+
+    present = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group_ids, weights=values, minlength=groups) / count
+        squared = np.bincount(group_ids, weights=(values - mean[group_ids]) ** 2, minlength=groups)
+        result['mean'] = mean
+        result['std'] = np.where(count > 1, np.sqrt(squared / np.maximum(count - 1, 1)), np.nan)
+
+    first = np.minimum(start, len(values) - 1)
+    last = np.clip(start + count - 1, 0, len(values) - 1)
+    result['minimum'] = np.where(present, values[first], np.nan)
+    result['maximum'] = np.where(present, values[last], np.nan)
+    for q in percentiles:
+        position = np.maximum(count - 1, 0) * (q / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(count - 1, 0))
+        low_value = values[np.minimum(start + low, len(values) - 1)]
+        high_value = values[np.minimum(start + high, len(values) - 1)]
+        result[f'p{q}'] = np.where(present, low_value + (high_value - low_value) * (position - low), np.nan)
+    return result
+
+
+def grouped_sketches(group_ids, values, groups):
+    """
+    One sketch per group: ``{'pos': {key: count}, 'neg': {key: count},
+    'zero': count}`` where a positive value v lands in key
+    ceil(log_gamma(v)) and a negative one in the key of -v.
+    """
+    mask = (group_ids >= 0) & ~np.isnan(values)
+    group_ids = group_ids[mask].astype(np.int64)
+    values = values[mask]
+    sign = np.sign(values).astype(np.int64)
+    keys = np.zeros(len(values), dtype=np.int64)
+    nonzero = sign != 0
+    keys[nonzero] = np.ceil(np.log(np.abs(values[nonzero])) / _LOG_GAMMA)
+    # One int64 per (group, sign, key) so a single np.unique counts them all
+    packed = (group_ids * 3 + sign + 1) * _KEY_SPAN + keys + _KEY_OFFSET
+    packed, counts = np.unique(packed, return_counts=True)
+
+    sketches = [{'pos': {}, 'neg': {}, 'zero': 0} for _ in range(groups)]
+    for code, count in zip(packed.tolist(), counts.tolist()):
+        group_sign, key = divmod(code, _KEY_SPAN)
+        group, sign = divmod(group_sign, 3)
+        sketch = sketches[group]
+        if sign == 1:
+            sketch['zero'] += count
+        else:
+            sketch['pos' if sign == 2 else 'neg'][str(key - _KEY_OFFSET)] = count
+    return sketches
+
+
+def merge_sketches(first, second):
+    merged = {'pos': dict(first['pos']), 'neg': dict(first['neg']), 'zero': first['zero'] + second['zero']}
+    for side in ('pos', 'neg'):
+        for key, count in second[side].items():
+            merged[side][key] = merged[side].get(key, 0) + count
+    return merged
+
+
+def sketch_quantile(sketch, q):
+    """Value at quantile ``q`` (0-1) of a sketch, None when it is empty"""
+    total = sketch['zero'] + sum(sketch['pos'].values()) + sum(sketch['neg'].values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for key in sorted(sketch['neg'], key=int, reverse=True):
+        seen += sketch['neg'][key]
+        if seen > rank:
+            return -2 * _GAMMA ** int(key) / (_GAMMA + 1)
+    seen += sketch['zero']
+    if seen > rank:
+        return 0.0
+    for key in sorted(sketch['pos'], key=int):
+        seen += sketch['pos'][key]
+        if seen > rank:
+            return 2 * _GAMMA ** int(key) / (_GAMMA + 1)
+    return 2 * _GAMMA ** int(max(sketch['pos'], key=int)) / (_GAMMA + 1)
+
+
+def merge_statistic(stored, delta):
+    """Combine the statistic rows of two disjoint sets of rows"""
+    if not delta['count']:
+        return dict(stored)
+    if not stored['count']:
+        return dict(delta)
+    count = stored['count'] + delta['count']
+    shift = delta['mean'] - stored['mean']
+    squares = sum(
+        (row['std'] ** 2) * (row['count'] - 1) if row['std'] is not None else 0.0 for row in (stored, delta)
+    ) + shift ** 2 * stored['count'] * delta['count'] / count
+    merged = {
+        'equipment_type': stored['equipment_type'],
+        'parameter': stored['parameter'],
+        'count': count,
+        'mean': stored['mean'] + shift * delta['count'] / count,
+        'std': math.sqrt(squares / (count - 1)),
+        'minimum': min(stored['minimum'], delta['minimum']),
+        'maximum': max(stored['maximum'], delta['maximum']),
+        'sketch': merge_sketches(stored['sketch'], delta['sketch']),
+        'percentiles_exact': False,
+    }
+    for q in PERCENTILES:
+        value = sketch_quantile(merged['sketch'], q / 100)
+        merged[f'p{q}'] = min(max(value, merged['minimum']), merged['maximum'])
+    return merged
+
+
+def merge_statistics(stored_rows, delta_rows):
+    """Merge two lists of statistic rows keyed by (equipment_type, parameter)"""
+    merged = {(row['equipment_type'], row['parameter']): row for row in stored_rows}
+    for row in delta_rows:
+        key = (row['equipment_type'], row['parameter'])
+        merged[key] = merge_statistic(merged[key], row) if key in merged else row
+    return list(merged.values())
+
+
+def _as_float(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def compute_statistics(type_codes, type_labels, columns):
+    """
+    Statistic rows for every type plus the whole dataset (``ALL_TYPES``).
+
+    ``type_codes`` index into ``type_labels`` (-1 for a missing type) and
+    ``columns`` maps each parameter to its float values.
+    """
+    type_codes = np.asarray(type_codes, dtype=np.int64)
+    groups = len(type_labels)
+    present = np.bincount(type_codes[type_codes >= 0], minlength=groups) > 0
+    everything = np.zeros(len(type_codes), dtype=np.int64)
+
+    rows = []
+    for parameter, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        by_type = grouped_statistics(type_codes, values, groups)
+        by_type['sketch'] = grouped_sketches(type_codes, values, groups)
+        overall = grouped_statistics(everything, values, 1)
+        overall['sketch'] = grouped_sketches(everything, values, 1)
+        targets = [(ALL_TYPES, overall, 0)] + [
+            (str(type_labels[group]), by_type, group) for group in range(groups) if present[group]
+        ]
+        for equipment_type, stats, group in targets:
+            row = {'equipment_type': equipment_type, 'parameter': parameter, 'count': int(stats['count'][group])}
+            row.update({field: _as_float(stats[field][group]) for field in STAT_FIELDS[1:]})
+            row['sketch'] = stats['sketch'][group]
+            row['percentiles_exact'] = True
+            rows.append(row)
+    return rows
+
+
+def payload_statistics(payload, start=0, stop=None):
+    """Statistics straight from a columnar payload's memory-mapped columns, optionally a row range"""
+    return compute_statistics(
+        payload.raw('Type')[start:stop],
+        payload.categories('Type'),
+        {name: payload.raw(name)[start:stop] for name in NUMERIC_COLUMNS},
+    )
+
+
+def frame_statistics(df):
+    """Statistics of an in-memory DataFrame"""
+    codes, labels = pd.factorize(df['Type'])
+    columns = {name: pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float) for name in NUMERIC_COLUMNS}
+    return compute_statistics(codes, list(labels), columns)
+
+
+def stored_statistics(dataset):
+    """
+    The dataset's statistic rows, computed and saved first for datasets
+    uploaded before statistics were recorded.
+    """
+    rows = list(dataset.statistics.values('equipment_type', 'parameter', 'percentiles_exact', *STAT_FIELDS))
+    if rows:
+        return rows
+    if dataset.storage_format != FORMAT_COLUMNAR:
+        convert_to_columnar(dataset)
+    rows = payload_statistics(open_columnar(dataset))
+    with transaction.atomic():
+        dataset.save_statistics(rows)
+    return rows
+
+
+def stored_type_distribution(dataset):
+    """
+    The dataset's {type: count}, most common first, computed from the
+    payload and saved first for datasets uploaded before type counts were
+    recorded.
+    """
+    type_distribution = dict(dataset.type_counts.values_list('equipment_type', 'count'))
+    if type_distribution or not dataset.total_count:
+        return type_distribution
+    counts = read_payload(dataset, columns=['Type'])['Type'].value_counts()
+    type_distribution = {str(equip_type): int(count) for equip_type, count in counts.items()}
+    with transaction.atomic():
+        dataset.save_type_distribution(type_distribution)
+    return type_distribution
+
+
+def nest_statistics(rows):
+    """{'overall': {parameter: stats}, 'by_type': {type: {parameter: stats}}}"""
+    nested = {'percentiles': list(PERCENTILES), 'overall': {}, 'by_type': {}}
+    for row in rows:
+        stats = {field: row[field] for field in STAT_FIELDS}
+        stats['percentiles_exact'] = row['percentiles_exact']
+        if row['equipment_type'] == ALL_TYPES:
+            nested['overall'][row['parameter']] = stats
+        else:
+            nested['by_type'].setdefault(row['equipment_type'], {})[row['parameter']] = stats
+    return nested
+
+
+def mergeable_statistics(dataset):
+    """
+    Stored rows with their sketches. Rows saved before sketches were kept
+    are recomputed from the payload once.
+    """
+    rows = list(dataset.statistics.values('equipment_type', 'parameter', 'sketch', 'percentiles_exact', *STAT_FIELDS))
+    if rows and all(row['sketch'] is not None for row in rows):
+        return rows
+    if dataset.storage_format != FORMAT_COLUMNAR:
+        convert_to_columnar(dataset)
+    rows = payload_statistics(open_columnar(dataset))
+    with transaction.atomic():
+        dataset.statistics.all().delete()
+        dataset.save_statistics(rows)
+    return rows
@@ -0,0 +1,214 @@
+"""
+File-backed streaming responses with byte ranges, and the LRU file caches
+that hold the files (rendered reports, dataset exports).
+
+``file_response`` streams a file in ``STREAM_BLOCK_SIZE`` blocks, so a
+response holds one block in memory however large the file, and honours a
+single ``Range: bytes=...`` so an interrupted download can be resumed. A
+range with an ``If-Range`` that no longer matches gets the whole file.
+Async views pass ``asynchronous=True``: the ASGI handler would otherwise
+read a synchronous body into memory before sending it.
+"""
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date
+
+from .conditional import set_validators
+
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """
+    ``(start, stop)`` of a ``bytes=first-last`` or ``bytes=-suffix`` range
+    over ``size`` bytes, or None to send the whole file: without a header,
+    for other units, several ranges or a malformed one. Raises
+    ``RangeNotSatisfiable`` for a range starting past the end.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(header)
+            start, stop = max(size - suffix, 0), size
+        else:
+            start = int(first)
+            stop = min(int(last) + 1, size) if last else size
+            if start < 0 or (last and int(last) < start):
+                return None
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, stop
+
+
+def _if_range_matches(request, etag, last_modified):
+    validator = request.META.get('HTTP_IF_RANGE')
+    if validator is None:
+        return True
+    if validator.startswith(('"', 'W/')):
+        return etag is not None and validator == etag
+    return last_modified is not None and validator == http_date(last_modified.timestamp())
+
+
+def _blocks(file_obj, start, stop):
+    with file_obj:
+        file_obj.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = file_obj.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
+async def _ablocks(file_obj, start, stop):
+    read = sync_to_async(file_obj.read, thread_sensitive=False)
+    try:
+        file_obj.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = await read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+    finally:
+        file_obj.close()
+
+
+def file_response(request, path, content_type, filename, etag=None, last_modified=None, asynchronous=False):
+    """Stream the file at ``path`` as an attachment, or the requested range of it"""
+    # Opened now, so the file can be evicted from its cache mid-download
+    file_obj = open(path, 'rb')
+    size = os.fstat(file_obj.fileno()).st_size
+    try:
+        byte_range = None
+        if _if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except RangeNotSatisfiable:
+        file_obj.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, stop = byte_range or (0, size)
+    blocks = _ablocks(file_obj, start, stop) if asynchronous else _blocks(file_obj, start, stop)
+    response = StreamingHttpResponse(blocks, status=206 if byte_range else 200, content_type=content_type)
+    response['Content-Length'] = str(stop - start)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+    if etag is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def partial_path(path):
+    """A temporary name next to ``path``, to be renamed over it once written"""
+    return path.with_name(f'{path.name}.{uuid.uuid4().hex}.part')
+
+
+class FileCache:
+    """
+    Files named ``<dataset id>-<digest>.<extension>`` in the directory of
+    the ``directory_setting`` setting.
+
+    A file's mtime is refreshed on every hit, and the oldest files are
+    evicted once the directory grows past the ``max_bytes_setting``
+    setting. The hit/miss counters are per process.
+    """
+    directory_setting = None
+    max_bytes_setting = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        path = Path(getattr(settings, self.directory_setting))
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, self.max_bytes_setting)
+
+    def lookup(self, path):
+        """``path`` if the file is cached, marking it recently used, else None"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _files(self, pattern='*'):
+        # Files still being written are neither entries nor invalidated
+        return (path for path in self.directory.glob(pattern) if not path.name.endswith('.part'))
+
+    def invalidate(self, dataset_id):
+        for path in self._files(f'{dataset_id}-*'):
+            path.unlink(missing_ok=True)
+
+    def _entries(self):
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, keep=None):
+        """Drop least recently used files until the cache fits its budget"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'entries': len(entries),
+            'size_bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
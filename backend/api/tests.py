@@ -1,3 +1,857 @@
-from django.test import TestCase
+import base64
+import importlib.util
+import os
+import tempfile
+import zipfile
+from contextlib import nullcontext
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from . import urls as api_urls
+from .anomalies import detect_anomalies
+from .compression import brotli, negotiate_encoding
+from .concurrency import ProcessPool
+from .datasets import RETAINED_DATASETS, payload_references, prune_datasets
+from .ingest import ENGINE_C, ENGINE_PYARROW, ingest_csv
+from .jobs import requeue
+from .models import (
+    DatasetAnalytics, DatasetAnomaly, DatasetRollup, DatasetStatistic, DatasetTypeCount, EquipmentDataset,
+    EquipmentRecord, ReportJob, RequestProfile,
+)
+from .renderers import ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, msgpack, pa, read_table
+from .reports import report_cache
+from .rows import encode_cursor
+from .storage import ColumnarPayload, PayloadWriter, columnar_path
+from .views import AsyncHistoryView, HistoryView
+
+SAMPLE_CSV = (Path(settings.BASE_DIR) / 'sample_equipment_data.csv').read_text()
+
+CSV_HEADER = 'Equipment Name,Type,Flowrate,Pressure,Temperature\n'
+
+
+def csv_file(text, name='equipment.csv'):
+    return SimpleUploadedFile(name, text.encode('utf-8'), content_type='text/csv')
+
+
+class StorageMixin:
+    """A throwaway payload store and caches, and a client logged in as ``self.user``"""
+
+    def setUp(self):
+        workdir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(
+            DATASET_STORAGE_DIR=workdir / 'store',
+            REPORT_CACHE_DIR=workdir / 'report_cache',
+            EXPORT_CACHE_DIR=workdir / 'export_cache',
+            PROFILE_DIR=workdir / 'profiles',
+            CACHES={**settings.CACHES, 'history': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            REPORT_WORKERS=0,
+            INGEST_WORKERS=0,
+            ANOMALY_WORKERS=0,
+        ))
+        self.user = User.objects.create_user('alice', password='pw')
+        self.client = self.client_for(self.user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return client
+
+    def committed(self):
+        """Runs the on-commit callbacks of the requests made inside it"""
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def upload(self, text, name='equipment.csv'):
+        with self.committed():
+            response = self.client.post('/api/upload/', {'file': csv_file(text, name)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def legacy_dataset(self, text=SAMPLE_CSV):
+        """A dataset stored inline, as uploads were before payloads, type counts and statistics"""
+        frame = pd.read_csv(StringIO(text))
+        return EquipmentDataset.objects.create(
+            user=self.user,
+            filename='legacy.csv',
+            csv_data=text,
+            storage_format='text',
+            total_count=len(frame),
+            avg_flowrate=frame['Flowrate'].mean(),
+            avg_pressure=frame['Pressure'].mean(),
+            avg_temperature=frame['Temperature'].mean(),
+        )
+
+
+class APIStorageTestCase(StorageMixin, APITestCase):
+    pass
+
+
+class TransactionalStorageTestCase(StorageMixin, APITransactionTestCase):
+    """For the async views, whose offloaded calls use their own database connections"""
+
+    def committed(self):
+        return nullcontext()
+
+
+class AppendTests(APIStorageTestCase):
+
+    def append(self, dataset_id, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                f'/api/datasets/{dataset_id}/append/', {'file': csv_file(text, 'delta.csv')}, format='multipart'
+            )
+
+    def test_append_merges_counts_and_averages(self):
+        dataset_id = self.upload(SAMPLE_CSV)['id']
+        response = self.append(dataset_id, CSV_HEADER + 'Pump-9,Pump,100,5,100\nMixer-1,Mixer,50,2,40\n')
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        frame = pd.concat([
+            pd.read_csv(StringIO(SAMPLE_CSV)),
+            pd.DataFrame({'Type': ['Pump', 'Mixer'], 'Flowrate': [100, 50]}),
+        ])
+        self.assertEqual(body['appended_rows'], 2)
+        self.assertEqual(body['total_count'], 17)
+        self.assertEqual(body['type_distribution'], frame['Type'].value_counts().to_dict())
+        self.assertAlmostEqual(body['averages']['flowrate'], round(frame['Flowrate'].mean(), 2))
+
+    def test_append_to_legacy_dataset_keeps_its_type_counts(self):
+        dataset = self.legacy_dataset()
+        self.assertFalse(dataset.type_counts.exists())
+        response = self.append(dataset.id, CSV_HEADER + 'Pump-9,Pump,100,5,100\n')
+        self.assertEqual(response.status_code, 200, response.content)
+        expected = pd.read_csv(StringIO(SAMPLE_CSV))['Type'].value_counts().to_dict()
+        expected['Pump'] += 1
+        self.assertEqual(response.json()['type_distribution'], expected)
+        self.assertEqual(sum(response.json()['type_distribution'].values()), 16)
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.storage_format, 'columnar')
+        self.assertEqual(dict(dataset.type_counts.values_list('equipment_type', 'count')), expected)
+
+    def flags(self, dataset):
+        return set(dataset.anomalies.values_list('row', 'parameter', 'zscore_flag', 'iqr_flag'))
+
+    def test_append_flags_only_the_new_rows(self):
+        dataset = EquipmentDataset.objects.get(id=self.upload(SAMPLE_CSV)['id'])
+        before = self.flags(dataset)
+        with mock.patch('api.anomalies.submit_reflag') as submit_reflag:
+            response = self.append(dataset.id, CSV_HEADER + 'Pump-9,Pump,100000,5,100\n')
+        self.assertEqual(response.status_code, 200, response.content)
+        submit_reflag.assert_called_once_with(dataset.analytics_id)
+
+        added = self.flags(dataset) - before
+        self.assertIn((15, 'Flowrate', False, True), added)
+        self.assertEqual({row for row, *_ in added}, {15})
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.anomaly_count, len(before) + len(added))
+
+    def test_append_reflags_the_whole_payload_after_commit(self):
+        dataset = EquipmentDataset.objects.get(id=self.upload(SAMPLE_CSV)['id'])
+        self.append(dataset.id, CSV_HEADER + 'Pump-9,Pump,100000,5,100\nPump-10,Pump,7,5,100\n')
+        expected = detect_anomalies(ColumnarPayload(EquipmentDataset.objects.get(id=dataset.id).payload_key))
+        self.assertEqual(
+            self.flags(dataset), {(a['row'], a['parameter'], a['zscore_flag'], a['iqr_flag']) for a in expected}
+        )
+        dataset.refresh_from_db()
+        self.assertEqual(dataset.anomaly_count, len(expected))
+
+    def test_append_rejects_unknown_dataset(self):
+        response = self.append(999, CSV_HEADER + 'Pump-9,Pump,100,5,100\n')
+        self.assertEqual(response.status_code, 404)
+
+
+class ReportAccessTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE_CSV)['id']
+        self.other = self.client_for(User.objects.create_user('bob', password='pw'))
+
+    def test_owner_gets_report(self):
+        response = self.client.get(f'/api/report/{self.dataset_id}/?rows=0')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.getvalue().startswith(b'%PDF'))
+
+    def test_other_user_cannot_read_or_queue_report(self):
+        for path in (f'/api/report/{self.dataset_id}/', f'/api/async/report/{self.dataset_id}/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.other.get(path + '?rows=0').status_code, 404)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(self.other.post(path, {'rows': 0}, format='json').status_code, 404)
+        self.assertFalse(ReportJob.objects.exists())
+
+
+class RowPaginationTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.frame = pd.read_csv(StringIO(SAMPLE_CSV))
+        self.dataset_id = self.upload(SAMPLE_CSV)['id']
+
+    def rows(self, **params):
+        return self.client.get(f'/api/datasets/{self.dataset_id}/rows/', params)
+
+    def all_rows(self, **params):
+        rows, after = [], None
+        while True:
+            response = self.rows(limit=4, **params, **({'after': after} if after else {}))
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            rows.extend(body['rows'])
+            after = body['next']
+            if after is None:
+                return rows
+
+    def test_pages_cover_every_row_once(self):
+        rows = self.all_rows()
+        self.assertEqual([row['_row'] for row in rows], list(range(len(self.frame))))
+        self.assertEqual([row['Equipment Name'] for row in rows], self.frame['Equipment Name'].tolist())
+
+    def test_sorted_pages(self):
+        ascending = self.frame.reset_index().sort_values(['Flowrate', 'index'])['index'].tolist()
+        descending = self.frame.reset_index().sort_values(['Flowrate', 'index'], ascending=False)['index'].tolist()
+        self.assertEqual([row['_row'] for row in self.all_rows(sort='Flowrate')], ascending)
+        self.assertEqual([row['_row'] for row in self.all_rows(sort='-Flowrate')], descending)
+        by_type = [row['Type'] for row in self.all_rows(sort='Type')]
+        self.assertEqual(by_type, sorted(by_type))
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ('not a cursor!', encode_cursor([1]), encode_cursor({'row': 'x', 'sort': None}),
+                       encode_cursor({'row': -1, 'sort': None}), encode_cursor({'row': True, 'sort': None})):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.rows(after=cursor).status_code, 400)
+        for key in (None, 'x', 10 ** 400):
+            with self.subTest(key=key):
+                cursor = encode_cursor({'row': 0, 'sort': 'Flowrate', 'key': key})
+                self.assertEqual(self.rows(sort='Flowrate', after=cursor).status_code, 400)
+        cursor = encode_cursor({'row': 0, 'sort': None})
+        self.assertEqual(self.rows(sort='Flowrate', after=cursor).status_code, 400)
+
+
+def desktop_table_formats():
+    """The desktop client's table decoding module, None when the client is not checked out"""
+    path = Path(settings.BASE_DIR).parent / 'frontend-desktop' / 'table_formats.py'
+    if not path.exists():
+        return None
+    spec = importlib.util.spec_from_file_location('table_formats', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class MetricsAccessTests(APIStorageTestCase):
+
+    def test_staff_only_by_default(self):
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    def test_allowed_addresses_are_opted_in(self):
+        with override_settings(METRICS_ALLOWED_ADDRESSES=['10.0.0.5']):
+            self.assertEqual(APIClient(REMOTE_ADDR='10.0.0.5').get('/api/metrics/').status_code, 200)
+            self.assertEqual(APIClient().get('/api/metrics/').status_code, 401)
+
+
+class NegotiationTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE_CSV)['id']
+
+    def test_desktop_client_decodes_like_the_backend(self):
+        desktop = desktop_table_formats()
+        if desktop is None:
+            self.skipTest('frontend-desktop is not checked out')
+        media_types = ['application/json', COLUMNAR_MEDIA_TYPE]
+        media_types += [MSGPACK_MEDIA_TYPE] if msgpack is not None else []
+        media_types += [ARROW_MEDIA_TYPE] if pa is not None else []
+        for field in ('rows', 'records', 'anomalies'):
+            for media_type in media_types:
+                with self.subTest(field=field, media_type=media_type):
+                    response = self.client.get(f'/api/datasets/{self.dataset_id}/{field}/', HTTP_ACCEPT=media_type)
+                    self.assertEqual(response.status_code, 200)
+                    expected, expected_rest = read_table(response['Content-Type'], response.content, field)
+                    frame, rest = desktop.read_table(response, field)
+                    pd.testing.assert_frame_equal(frame, expected)
+                    self.assertEqual(rest, expected_rest)
+
+    @skipUnless(pa is not None, 'pyarrow is not installed')
+    def test_errors_are_json_in_every_format(self):
+        ok = self.client.get(f'/api/datasets/{self.dataset_id}/rows/', HTTP_ACCEPT=ARROW_MEDIA_TYPE)
+        self.assertEqual(ok['Content-Type'], ARROW_MEDIA_TYPE)
+        frame, _ = read_table(ok['Content-Type'], ok.content, 'rows')
+        self.assertEqual(len(frame), 15)
+        for path in (f'/api/datasets/{self.dataset_id}/rows/?limit=0', '/api/datasets/999/rows/'):
+            with self.subTest(path=path):
+                response = self.client.get(path, HTTP_ACCEPT=ARROW_MEDIA_TYPE)
+                self.assertIn(response.status_code, (400, 404))
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('error', response.json())
+
+    def test_refused_codings_are_not_overridden_by_wildcard(self):
+        self.assertIsNone(negotiate_encoding('gzip;q=0, br;q=0, *'))
+        self.assertIsNone(negotiate_encoding('identity'))
+        self.assertEqual(negotiate_encoding('GZIP'), 'gzip')
+        self.assertIn(negotiate_encoding('*'), ('br', 'gzip'))
+        if brotli is not None:
+            self.assertEqual(negotiate_encoding('br;q=0, *'), 'gzip')
+        else:
+            self.assertIsNone(negotiate_encoding('gzip;q=0, *'))
+
+    def test_highest_quality_coding_wins(self):
+        self.assertEqual(negotiate_encoding('gzip;q=1, br;q=0.1'), 'gzip')
+        self.assertEqual(negotiate_encoding('br;q=0.5, *;q=0.8'), 'gzip')
+        self.assertIsNone(negotiate_encoding('identity, gzip;q=0.5'))
+        self.assertEqual(negotiate_encoding('identity;q=0.5, gzip;q=0.5'), 'gzip')
+        if brotli is not None:
+            self.assertEqual(negotiate_encoding('gzip, br'), 'br')
+            self.assertEqual(negotiate_encoding('gzip;q=0.2, br;q=0.9'), 'br')
+
+
+class IngestRejectionTests(APIStorageTestCase):
+
+    def test_invalid_rows_are_rejected_not_fatal(self):
+        body = self.upload(CSV_HEADER + (
+            'Pump-1,Pump,120,5.2,110\n'
+            'Pump-2,Pump,abc,5.0,100\n'
+            'Valve-1,Valve,60,-1,105\n'
+            'Valve-2,Valve,61,4.0,-300\n'
+            'Valve-3,Valve,62,4.2,\n'
+            'Reactor-1,Reactor,80,7.5,140\n'
+        ))
+        self.assertEqual(body['total_count'], 3)
+        self.assertEqual(body['rejected_rows'], 3)
+        self.assertEqual(body['type_distribution'], {'Valve': 1, 'Pump': 1, 'Reactor': 1})
+        self.assertEqual(
+            [(row['row'], row['column']) for row in body['rejections']],
+            [(2, 'Flowrate'), (3, 'Pressure'), (4, 'Temperature')],
+        )
+        self.assertEqual(body['rejections'][0]['reason'], 'Flowrate is not a number')
+
+        response = self.client.get(f"/api/datasets/{body['id']}/rejections/")
+        self.assertEqual(response.json()['rejected_rows'], 3)
+        self.assertEqual(response.json()['rejections'], body['rejections'])
+
+    def test_engines_agree_across_chunks(self):
+        text = CSV_HEADER + ''.join(
+            f'Pump-{i},Pump,{"bad" if i % 7 == 3 else i},5,100\n' for i in range(40)
+        )
+        engines = [ENGINE_C] + ([ENGINE_PYARROW] if pa is not None else [])
+        for engine in engines:
+            with self.subTest(engine=engine), PayloadWriter() as writer:
+                result = ingest_csv(BytesIO(text.encode('utf-8')), writer, chunksize=8, engine=engine)
+                payload = ColumnarPayload(writer.commit())
+                self.assertEqual(result.rejections.count, 6)
+                self.assertEqual([row['row'] for row in result.rejections.rows], [4, 11, 18, 25, 32, 39])
+                self.assertEqual(payload.rows, 34)
+                self.assertEqual(result.aggregates.total_count, 34)
+
+    def test_rejection_report_is_capped_but_counts_every_row(self):
+        rows = ''.join(f'Pump-{i},Pump,-{i + 1},5,100\n' for i in range(5))
+        with override_settings(REJECTION_REPORT_ROWS=2):
+            body = self.upload(CSV_HEADER + 'Pump-ok,Pump,1,5,100\n' + rows)
+        self.assertEqual(body['rejected_rows'], 5)
+        self.assertEqual(len(body['rejections']), 2)
+
+    def test_missing_columns_fail_the_upload(self):
+        response = self.client.post(
+            '/api/upload/', {'file': csv_file('Equipment Name,Type,Flowrate\nPump-1,Pump,1\n')}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Pressure', response.json()['error'])
+        self.assertFalse(EquipmentDataset.objects.exists())
+
+
+class DeduplicationTests(APIStorageTestCase):
+
+    def test_identical_upload_shares_the_payload(self):
+        first = self.upload(SAMPLE_CSV)
+        second = self.upload(SAMPLE_CSV, name='copy.csv')
+        self.assertFalse(first['deduplicated'])
+        self.assertTrue(second['deduplicated'])
+        self.assertEqual(second['type_distribution'], first['type_distribution'])
+        original, copy = EquipmentDataset.objects.get(id=first['id']), EquipmentDataset.objects.get(id=second['id'])
+        self.assertEqual(copy.payload_key, original.payload_key)
+        self.assertEqual(payload_references(original.payload_key), 2)
+        self.assertEqual(copy.analytics_id, original.analytics_id)
+        self.assertEqual(copy.statistics.count(), original.statistics.count())
+
+    def test_identical_upload_writes_no_analytics_rows(self):
+        self.upload(SAMPLE_CSV)
+        tables = (DatasetTypeCount, DatasetStatistic, DatasetAnomaly, EquipmentRecord)
+        before = [model.objects.count() for model in tables]
+        second = self.upload(SAMPLE_CSV, name='copy.csv')
+        self.assertEqual([model.objects.count() for model in tables], before)
+        response = self.client.get(f"/api/datasets/{second['id']}/records/?type=Pump")
+        self.assertEqual(response.json()['count'], second['type_distribution']['Pump'])
+        history = self.client.get('/api/history/').json()
+        self.assertEqual(history[0]['summary']['type_distribution'], second['type_distribution'])
+
+    def test_append_to_shared_payload_copies_it(self):
+        first = self.upload(SAMPLE_CSV)
+        second = self.upload(SAMPLE_CSV, name='copy.csv')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/datasets/{second['id']}/append/",
+                {'file': csv_file(CSV_HEADER + 'Pump-9,Pump,100,5,100\n')}, format='multipart',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        original, copy = EquipmentDataset.objects.get(id=first['id']), EquipmentDataset.objects.get(id=second['id'])
+        self.assertNotEqual(copy.payload_key, original.payload_key)
+        self.assertEqual(ColumnarPayload(original.payload_key).rows, 15)
+        self.assertEqual(ColumnarPayload(copy.payload_key).rows, 16)
+        self.assertNotEqual(copy.analytics_id, original.analytics_id)
+        self.assertEqual((original.records.count(), copy.records.count()), (15, 16))
+        self.assertEqual(sum(original.type_counts.values_list('count', flat=True)), 15)
+
+    def test_prune_deletes_a_payload_with_its_last_reference(self):
+        first = self.upload(SAMPLE_CSV)
+        self.upload(SAMPLE_CSV, name='copy.csv')
+        self.upload(CSV_HEADER + 'Pump-1,Pump,1,2,3\n', name='other.csv')
+        original = EquipmentDataset.objects.get(id=first['id'])
+        key, analytics_id = original.payload_key, original.analytics_id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(prune_datasets(self.user, keep=2), [first['id']])
+        self.assertTrue(columnar_path(key).exists())
+        self.assertEqual(EquipmentRecord.objects.filter(analytics_id=analytics_id).count(), 15)
+        with self.captureOnCommitCallbacks(execute=True):
+            prune_datasets(self.user, keep=1)
+        self.assertEqual(payload_references(key), 0)
+        self.assertFalse(columnar_path(key).exists())
+        self.assertFalse(DatasetAnalytics.objects.filter(id=analytics_id).exists())
+        self.assertFalse(EquipmentRecord.objects.filter(analytics_id=analytics_id).exists())
+
+    def test_uploads_past_the_retention_limit_are_pruned(self):
+        ids = [self.upload(CSV_HEADER + f'Pump-{i},Pump,{i + 1},2,3\n', name=f'{i}.csv')['id']
+               for i in range(RETAINED_DATASETS + 2)]
+        remaining = set(EquipmentDataset.objects.filter(user=self.user).values_list('id', flat=True))
+        self.assertEqual(remaining, set(ids[2:]))
+
+
+class BulkUploadTests(APIStorageTestCase):
+
+    def bulk(self, *files):
+        with self.committed():
+            return self.client.post('/api/upload/bulk/', {'files': list(files)}, format='multipart')
+
+    def test_archive_members_and_plain_files_get_one_entry_each(self):
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('a.csv', SAMPLE_CSV)
+            zipped.writestr('nested/b.csv', CSV_HEADER + 'Pump-1,Pump,1,2,3\n')
+            zipped.writestr('bad.csv', 'Equipment Name,Type\nPump-1,Pump\n')
+            zipped.writestr('__MACOSX/._a.csv', 'resource fork')
+            zipped.writestr('notes.txt', 'not a csv')
+        response = self.bulk(
+            SimpleUploadedFile('batch.zip', archive.getvalue(), content_type='application/zip'),
+            csv_file(SAMPLE_CSV, 'copy.csv'),
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (3, 1))
+        entries = {entry['filename']: entry for entry in body['files']}
+        self.assertEqual(list(entries), ['batch.zip/a.csv', 'batch.zip/nested/b.csv', 'batch.zip/bad.csv', 'copy.csv'])
+        self.assertEqual(entries['batch.zip/a.csv']['total_count'], 15)
+        self.assertEqual(entries['batch.zip/bad.csv']['status'], 'failed')
+        self.assertTrue(entries['copy.csv']['deduplicated'])
+        self.assertEqual(entries['copy.csv']['type_distribution'], entries['batch.zip/a.csv']['type_distribution'])
+        self.assertEqual(
+            EquipmentDataset.objects.get(id=entries['copy.csv']['id']).payload_key,
+            EquipmentDataset.objects.get(id=entries['batch.zip/a.csv']['id']).payload_key,
+        )
+
+    def test_unreadable_archives_fail_alone(self):
+        response = self.bulk(
+            SimpleUploadedFile('broken.zip', b'not a zip', content_type='application/zip'),
+            csv_file(SAMPLE_CSV),
+        )
+        self.assertEqual(response.status_code, 201)
+        statuses = [(entry['filename'], entry['status']) for entry in response.json()['files']]
+        self.assertEqual(statuses, [('broken.zip', 'failed'), ('equipment.csv', 'created')])
+        self.assertEqual(self.bulk(SimpleUploadedFile('empty.zip', b'not a zip')).status_code, 400)
+
+    @override_settings(BULK_UPLOAD_MAX_FILES=1)
+    def test_too_many_files_are_refused(self):
+        response = self.bulk(csv_file(SAMPLE_CSV), csv_file(SAMPLE_CSV, 'two.csv'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EquipmentDataset.objects.exists())
+
+
+class TrendTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.uploads = {
+            # Monday and Wednesday of one week, then the next Monday
+            '2026-01-05T12:00:00Z': SAMPLE_CSV,
+            '2026-01-07T12:00:00Z': CSV_HEADER + 'Pump-1,Pump,10,2,3\nPump-2,Pump,30,2,3\nValve-1,Valve,5,1,1\n',
+            '2026-01-12T12:00:00Z': CSV_HEADER + 'Pump-1,Pump,50,2,3\n',
+        }
+        for index, (moment, text) in enumerate(self.uploads.items()):
+            dataset_id = self.upload(text, name=f'{index}.csv')['id']
+            DatasetRollup.objects.filter(dataset_id=dataset_id).update(upload_date=moment)
+
+    def trends(self, **params):
+        params = {'parameter': 'Flowrate', 'since': '2026-01-01', 'until': '2026-01-31', **params}
+        response = self.client.get('/api/trends/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def flowrates(self, *moments):
+        return pd.concat([pd.read_csv(StringIO(self.uploads[moment]))['Flowrate'] for moment in moments])
+
+    def test_weekly_points_pool_the_uploads_of_each_week(self):
+        points = self.trends(bucket='week')['overall']['Flowrate']
+        self.assertEqual([point['period'][:10] for point in points], ['2026-01-05', '2026-01-12'])
+        self.assertEqual([point['datasets'] for point in points], [2, 1])
+        expected = self.flowrates('2026-01-05T12:00:00Z', '2026-01-07T12:00:00Z')
+        self.assertEqual(points[0]['count'], len(expected))
+        self.assertAlmostEqual(points[0]['mean'], expected.mean())
+        self.assertAlmostEqual(points[0]['std'], expected.std())
+        self.assertEqual((points[0]['minimum'], points[0]['maximum']), (expected.min(), expected.max()))
+
+    def test_buckets(self):
+        self.assertEqual(len(self.trends(bucket='day')['overall']['Flowrate']), 3)
+        [everything] = self.trends(bucket='all')['overall']['Flowrate']
+        self.assertEqual(everything['count'], len(self.flowrates(*self.uploads)))
+
+        uploads = self.trends(bucket='upload')['overall']['Flowrate']
+        self.assertEqual([point['filename'] for point in uploads], ['0.csv', '1.csv', '2.csv'])
+        self.assertEqual(uploads[1]['p50'], 10)
+
+        pumps = self.trends(bucket='week', type='Pump')['by_type']
+        self.assertEqual(list(pumps), ['Pump'])
+        self.assertEqual(pumps['Pump']['Flowrate'][1]['mean'], 50)
+
+    def test_rollups_outlive_pruned_datasets(self):
+        for index in range(RETAINED_DATASETS):
+            self.upload(CSV_HEADER + f'Pump-1,Pump,{index},2,3\n', name=f'later-{index}.csv')
+        self.assertEqual(self.trends(bucket='all')['overall']['Flowrate'][0]['datasets'], 3)
+
+    def test_invalid_queries_are_rejected(self):
+        for params in ({'parameter': 'Mass'}, {'bucket': 'hour'}, {'days': '0'}, {'since': 'yesterday'},
+                       {'since': '2026-02-01', 'until': '2026-01-01'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/trends/', params).status_code, 400)
+
+
+class CompareTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.a = self.upload(CSV_HEADER + 'P-1,Pump,10,1,100\nP-2,Pump,20,2,100\nV-1,Valve,5,1,50\n', 'a.csv')['id']
+        self.b = self.upload(CSV_HEADER + 'P-1,Pump,12,1,100\nP-2,Valve,20,2,100\nM-1,Mixer,7,1,60\n', 'b.csv')['id']
+
+    def test_equipment_is_matched_on_name(self):
+        response = self.client.get('/api/datasets/compare/', {'a': self.a, 'b': self.b})
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual((body['a']['id'], body['b']['id']), (self.a, self.b))
+        self.assertEqual(
+            {key: body['equipment'][key] for key in ('matched', 'added', 'removed', 'type_changed')},
+            {'matched': 2, 'added': 1, 'removed': 1, 'type_changed': 1},
+        )
+        self.assertEqual((body['added'], body['removed']), (['M-1'], ['V-1']))
+        self.assertEqual(body['type_changes'], [{'name': 'P-2', 'a': 'Pump', 'b': 'Valve'}])
+
+        flowrate = body['parameters']['Flowrate']
+        self.assertEqual((flowrate['compared'], flowrate['changed'], flowrate['mean_delta']), (2, 1, 1.0))
+        self.assertEqual(flowrate['largest_changes'], [{'name': 'P-1', 'a': 10.0, 'b': 12.0, 'delta': 2.0}])
+        self.assertEqual(body['parameters']['Pressure']['changed'], 0)
+
+        self.assertEqual(body['overall']['Flowrate']['mean'], {'a': 35 / 3, 'b': 13.0, 'delta': 13.0 - 35 / 3})
+        self.assertEqual(body['by_type']['Mixer']['Flowrate']['count'], {'a': 0, 'b': 1, 'delta': 1})
+
+    def test_limit_cuts_the_lists_not_the_counts(self):
+        body = self.client.get('/api/datasets/compare/', {'a': self.a, 'b': self.b, 'limit': 0}).json()
+        self.assertEqual((body['added'], body['equipment']['added']), ([], 1))
+        self.assertEqual(body['parameters']['Flowrate']['largest_changes'], [])
+
+    def test_only_the_users_own_datasets(self):
+        other = self.client_for(User.objects.create_user('bob', password='pw'))
+        self.assertEqual(other.get('/api/datasets/compare/', {'a': self.a, 'b': self.b}).status_code, 404)
+        for params in ({'a': self.a}, {'a': self.a, 'b': 'x'}, {'a': self.a, 'b': self.b, 'limit': -1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/datasets/compare/', params).status_code, 400)
+
+
+class ExportTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = f"/api/datasets/{self.upload(SAMPLE_CSV)['id']}/export/csv/"
+
+    def test_interrupted_download_resumes_with_range(self):
+        first = self.client.get(self.path)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.streaming)
+        full = b''.join(first.streaming_content)
+        self.assertEqual(pd.read_csv(BytesIO(full)).shape, (15, 5))
+
+        resumed = self.client.get(self.path, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE=first['ETag'])
+        self.assertEqual(resumed.status_code, 206)
+        self.assertEqual(resumed['Content-Range'], f'bytes 100-{len(full) - 1}/{len(full)}')
+        self.assertEqual(b''.join(resumed.streaming_content), full[100:])
+
+        # A changed file is sent whole
+        stale = self.client.get(self.path, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((stale.status_code, b''.join(stale.streaming_content)), (200, full))
+        self.assertEqual(self.client.get(self.path, HTTP_RANGE=f'bytes={len(full)}-').status_code, 416)
+
+    def test_range_before_the_export_is_cached(self):
+        response = self.client.get(self.path, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), SAMPLE_CSV.encode()[:10])
+
+
+class ConditionalRequestTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE_CSV)['id']
+
+    def assertRevalidates(self, path, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        unchanged = self.client.get(path, HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged['ETag'], etag)
+        return etag
+
+    def test_unchanged_resources_get_304(self):
+        for path in (f'/api/datasets/{self.dataset_id}/rows/', f'/api/datasets/{self.dataset_id}/stats/',
+                     f'/api/datasets/{self.dataset_id}/rejections/', f'/api/report/{self.dataset_id}/?rows=0',
+                     '/api/history/'):
+            with self.subTest(path=path):
+                self.assertRevalidates(path)
+
+    def test_etag_changes_with_the_data(self):
+        etag = self.assertRevalidates('/api/history/')
+        self.upload(CSV_HEADER + 'Pump-1,Pump,1,2,3\n', name='other.csv')
+        response = self.client.get('/api/history/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        path = f'/api/datasets/{self.dataset_id}/rows/'
+        etag = self.assertRevalidates(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/datasets/{self.dataset_id}/append/',
+                             {'file': csv_file(CSV_HEADER + 'Pump-9,Pump,1,2,3\n')}, format='multipart')
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_query_and_format(self):
+        path = f'/api/datasets/{self.dataset_id}/rows/'
+        etags = {
+            self.assertRevalidates(path),
+            self.assertRevalidates(path + '?limit=5'),
+            self.assertRevalidates(path, HTTP_ACCEPT=COLUMNAR_MEDIA_TYPE),
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_compressed_response_revalidates_with_weak_etag(self):
+        path = f'/api/datasets/{self.dataset_id}/rows/'
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        unchanged = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+
+class ReportJobTests(APIStorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dataset_id = self.upload(SAMPLE_CSV)['id']
+        self.other = self.client_for(User.objects.create_user('bob', password='pw'))
+
+    def queue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/report/{self.dataset_id}/', {'rows': 0}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], ReportJob.QUEUED)
+        return response.json()
+
+    def test_job_lifecycle(self):
+        job = self.queue()
+        status_response = self.client.get(job['status_url'])
+        self.assertEqual(status_response.json()['status'], ReportJob.DONE)
+        self.assertIsNotNone(status_response.json()['finished_at'])
+
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(download['Content-Type'], 'application/pdf')
+        self.assertTrue(download.getvalue().startswith(b'%PDF'))
+        self.assertEqual(self.client.get(job['download_url'], HTTP_IF_NONE_MATCH=download['ETag']).status_code, 304)
+
+    def test_evicted_report_is_rendered_again(self):
+        job = self.queue()
+        report_cache.invalidate(self.dataset_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(job['download_url'])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(job['download_url']).status_code, 200)
+
+    def test_unfinished_job_cannot_be_downloaded(self):
+        response = self.client.post(f'/api/report/{self.dataset_id}/', {'rows': 0}, format='json')
+        self.assertEqual(self.client.get(response.json()['download_url']).status_code, 409)
+
+    def stale(self, job_id, status):
+        long_ago = timezone.now() - timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS + 1)
+        ReportJob.objects.filter(id=job_id).update(status=status, queued_at=long_ago, started_at=long_ago)
+
+    def test_lost_jobs_are_resumed_when_polled(self):
+        for status in (ReportJob.QUEUED, ReportJob.RUNNING):
+            with self.subTest(status=status):
+                job = self.queue()
+                self.stale(job['id'], status)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(self.client.get(job['status_url']).json()['status'], ReportJob.QUEUED)
+                self.assertEqual(self.client.get(job['status_url']).json()['status'], ReportJob.DONE)
+
+    def test_recent_unfinished_jobs_are_left_alone(self):
+        response = self.client.post(f'/api/report/{self.dataset_id}/', {'rows': 0}, format='json')
+        job = response.json()
+        ReportJob.objects.filter(id=job['id']).update(status=ReportJob.RUNNING, started_at=timezone.now())
+        with mock.patch('api.jobs.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(job['download_url']).status_code, 409)
+            self.assertEqual(self.client.get(job['status_url']).json()['status'], ReportJob.RUNNING)
+        submit.assert_not_called()
+
+    def test_recover_command_resubmits_left_over_jobs(self):
+        response = self.client.post(f'/api/report/{self.dataset_id}/', {'rows': 0}, format='json')
+        queued = response.json()
+        running = self.queue()
+        self.stale(running['id'], ReportJob.RUNNING)
+        call_command('recover_report_jobs', stdout=StringIO())
+        self.assertEqual(set(ReportJob.objects.values_list('status', flat=True)), {ReportJob.DONE})
+        self.assertTrue(self.client.get(queued['download_url']).getvalue().startswith(b'%PDF'))
+
+    def test_evicted_report_is_queued_once(self):
+        job = ReportJob.objects.get(id=self.queue()['id'])
+        report_cache.invalidate(self.dataset_id)
+        with mock.patch('api.jobs.submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            # Two requests that both found it done before either queued it
+            for _ in range(2):
+                self.assertEqual(requeue(job, Q(status=ReportJob.DONE)).status, ReportJob.QUEUED)
+        submit.assert_called_once_with(job.id)
+
+    def test_jobs_are_private_to_their_user(self):
+        job = self.queue()
+        self.assertEqual(self.other.get(job['status_url']).status_code, 404)
+        self.assertEqual(self.other.get(job['download_url']).status_code, 404)
+        self.assertEqual(self.other.post(f'/api/report/{self.dataset_id}/', {'rows': 0}, format='json').status_code,
+                         404)
+
+
+class AsyncViewTests(TransactionalStorageTestCase):
+
+    @override_settings(ASYNC_RENDER_WORKERS=1)
+    def test_report_is_laid_out_in_a_render_process(self):
+        # The pool outlives a storage directory: payloads are passed to it, not found through settings
+        for attempt in range(2):
+            store = self.enterContext(tempfile.TemporaryDirectory())
+            with self.subTest(attempt=attempt), override_settings(DATASET_STORAGE_DIR=store):
+                dataset_id = self.upload(SAMPLE_CSV)['id']
+                response = self.client.get(f'/api/async/report/{dataset_id}/?rows=5')
+                self.assertEqual(response.status_code, 200)
+                [path] = report_cache.directory.glob(f'{dataset_id}-*.pdf')
+                self.assertEqual(int(response['Content-Length']), path.stat().st_size)
+                self.assertTrue(path.read_bytes().startswith(b'%PDF'))
+
+
+    def test_async_upload_and_history_match_the_sync_views(self):
+        response = self.client.post('/api/async/upload/', {'file': csv_file(SAMPLE_CSV)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual((body['total_count'], body['deduplicated']), (15, False))
+        self.assertEqual(body['type_distribution'], pd.read_csv(StringIO(SAMPLE_CSV))['Type'].value_counts().to_dict())
+
+        copy = self.client.post('/api/async/upload/', {'file': csv_file(SAMPLE_CSV, 'copy.csv')}, format='multipart')
+        self.assertEqual(copy.status_code, 201, copy.content)
+        self.assertTrue(copy.json()['deduplicated'])
+        self.assertEqual(copy.json()['type_distribution'], body['type_distribution'])
+        missing = self.client.post('/api/async/upload/', {}, format='multipart')
+        self.assertEqual(missing.status_code, 400)
+
+        history = self.client.get('/api/async/history/')
+        self.assertEqual(history.status_code, 200)
+        self.assertEqual(history.json(), self.client.get('/api/history/').json())
+        self.assertEqual([entry['id'] for entry in history.json()[:2]], [copy.json()['id'], body['id']])
+        unchanged = self.client.get('/api/async/history/', HTTP_IF_NONE_MATCH=history['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_async_views_authenticate_like_the_drf_views(self):
+        client = APIClient()
+        response = client.get('/api/async/history/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        client.credentials(HTTP_AUTHORIZATION='Token nope')
+        response = client.get('/api/async/history/')
+        self.assertEqual((response.status_code, response.json()), (401, {'detail': 'Invalid token.'}))
+
+        client.credentials()
+        client.login(username='alice', password='pw')
+        self.assertEqual(client.get('/api/async/history/').status_code, 401)
+
+        client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'alice:pw').decode('ascii'))
+        self.assertEqual(client.get('/api/async/history/').status_code, 200)
+
+    def test_async_views_negotiate_like_the_drf_views(self):
+        self.upload(SAMPLE_CSV)
+        for url in ('/api/history/', '/api/async/history/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_ACCEPT='text/csv').status_code, 406)
+                response = self.client.get(url, HTTP_ACCEPT='text/html')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    def test_async_views_can_be_profiled(self):
+        dataset_id = self.upload(SAMPLE_CSV)['id']
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(f'/api/async/report/{dataset_id}/?rows=5&profile=1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual((profile.endpoint, profile.dataset_id, profile.rows), ('async-generate-pdf', dataset_id, 15))
+        self.assertTrue((Path(settings.PROFILE_DIR) / profile.file).exists())
+
+
+class AsyncServingModeTests(SimpleTestCase):
+
+    def test_async_views_take_over_the_plain_urls(self):
+        self.addCleanup(importlib.reload, api_urls)
+        for async_views, expected in ((False, HistoryView), (True, AsyncHistoryView)):
+            with override_settings(ASYNC_VIEWS=async_views):
+                urls = importlib.reload(api_urls)
+            views = {pattern.name: pattern.callback.view_class for pattern in urls.urlpatterns}
+            self.assertIs(views['history'], expected)
+            self.assertIs(views['async-history'], AsyncHistoryView)
+
+
+class ProcessPoolTests(SimpleTestCase):
+
+    @override_settings(REPORT_WORKERS=1)
+    def test_broken_pool_is_replaced(self):
+        pool = ProcessPool('REPORT_WORKERS')
+        self.addCleanup(lambda: pool.get().shutdown())
+        with self.assertRaises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result(timeout=60)
+        self.assertEqual(pool.submit(abs, -3).result(timeout=60), 3)
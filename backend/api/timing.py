@@ -0,0 +1,173 @@
+"""
+Per-request phase timing.
+
+``ServerTimingMiddleware`` gives each request a ``RequestTimings`` (held in
+a context variable) and code on the request path marks its phases with
+``span('parse')`` and the like. Every SQL query is timed as ``db`` (each
+connection gets the timer when it is opened, see ``ApiConfig.ready``). Phases
+may overlap (``db`` runs inside ``insert``), so they need not add up to the
+total. The middleware reports the phases and the total in a
+``Server-Timing`` header and records them in ``api.metrics``. Outside a
+request (management commands, report workers) ``span`` does nothing.
+
+The middleware works under WSGI and ASGI alike; the async ORM's threads
+and the work the async views offload (``api.concurrency``) run in copies of
+the request's context and so report to the same timings.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import request_metrics
+
+PHASE_PARSE = 'parse'
+PHASE_AGGREGATE = 'aggregate'
+PHASE_STORE = 'store'
+PHASE_INSERT = 'insert'
+PHASE_DB = 'db'
+PHASE_SERIALIZE = 'serialize'
+PHASE_PDF = 'pdf'
+PHASE_COMPRESS = 'compress'
+
+# Server-Timing descriptions
+PHASE_DESCRIPTIONS = {
+    PHASE_PARSE: 'CSV parsing',
+    PHASE_AGGREGATE: 'Aggregation',
+    PHASE_STORE: 'Payload writes',
+    PHASE_INSERT: 'Dataset save',
+    PHASE_DB: 'SQL queries',
+    PHASE_SERIALIZE: 'JSON rendering',
+    PHASE_PDF: 'PDF layout',
+    PHASE_COMPRESS: 'Response compression',
+}
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Seconds spent and spans entered per phase during one request"""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds):
+        total, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + seconds, count + 1)
+
+    def time_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(PHASE_DB, time.perf_counter() - start)
+
+    def header(self, total):
+        entries = [
+            f'{name};dur={seconds * 1000:.1f};desc="{PHASE_DESCRIPTIONS.get(name, name)}"'
+            for name, (seconds, _) in self.phases.items()
+        ]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.time_query(execute, sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """``connection_created`` receiver: time the connection's queries as ``db``"""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+@contextmanager
+def span(name):
+    """Add the time spent in the block to phase ``name`` of the current request"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def timed_chunks(chunks, name=PHASE_PARSE):
+    """Iterate ``chunks``, timing the production of each as phase ``name``"""
+    chunks = iter(chunks)
+    while True:
+        with span(name):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """DRF's JSON renderer, timed as the ``serialize`` phase"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span(PHASE_SERIALIZE):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def _response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length else None
+    return len(response.content)
+
+
+class ServerTimingMiddleware:
+    """Time each request's phases, add a Server-Timing header and record the metrics"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        response['Server-Timing'] = timings.header(total)
+        match = request.resolver_match
+        request_metrics.observe(
+            endpoint=match.url_name or match.route if match is not None else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+            seconds=total,
+            request_bytes=int(request.META.get('CONTENT_LENGTH') or 0),
+            response_bytes=_response_size(response),
+            phases=timings.phases,
+        )
+        return response
@@ -0,0 +1,195 @@
+"""
+Trends across a user's uploads.
+
+Every saved dataset also gets a ``DatasetRollup``: its row count and the
+stored count, mean, std, min, max and percentiles of each parameter, per
+Type and overall. Rollups are kept when their dataset is pruned, so trend
+queries reach back past the retained uploads, and they are answered from
+the rollup tables alone; no payload is read.
+
+A trend point combines the rollups uploaded in one period: counts add up,
+means are weighted by count, standard deviations are pooled and min/max are
+the extremes. Percentiles cannot be combined from summaries and are only
+given per upload (``bucket=upload``).
+"""
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, FloatField, Max, Min, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .ingest import NUMERIC_COLUMNS
+from .models import DatasetRollup, RollupStatistic
+from .stats import ALL_TYPES, PERCENTILES, STAT_FIELDS
+
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+BUCKET_UPLOAD = 'upload'
+BUCKET_ALL = 'all'
+
+DEFAULT_DAYS = 90
+MAX_DAYS = 3660
+
+
+class TrendQueryError(ValueError):
+    pass
+
+
+def save_rollup(dataset, statistics, type_distribution):
+    """
+    Create or replace the rollup of ``dataset`` from its statistic rows (as
+    produced by ``api.stats``) and its ``{type: rows}`` distribution.
+    """
+    DatasetRollup.objects.filter(dataset=dataset).delete()
+    rollup = DatasetRollup.objects.create(
+        user_id=dataset.user_id,
+        dataset=dataset,
+        filename=dataset.filename,
+        upload_date=dataset.upload_date,
+        total_count=dataset.total_count,
+    )
+    rows = {str(equip_type): count for equip_type, count in type_distribution.items()}
+    rows[ALL_TYPES] = dataset.total_count
+    RollupStatistic.objects.bulk_create([
+        RollupStatistic(
+            rollup=rollup,
+            equipment_type=row['equipment_type'],
+            parameter=row['parameter'],
+            rows=rows.get(row['equipment_type'], row['count']),
+            **{field: row[field] for field in STAT_FIELDS},
+        )
+        for row in statistics
+    ])
+    return rollup
+
+
+def _parse_moment(value, name, end_of_day=False):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise TrendQueryError(f'{name} must be an ISO date or datetime')
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_trend_query(params):
+    """
+    Validate ``parameter`` and ``type`` (comma separated), ``bucket``, and
+    the range: ``since``/``until`` (ISO dates or datetimes) or ``days``
+    back from now. Returns a dict for ``trend_series``.
+    """
+    parameters = [name.strip() for name in params.get('parameter', '').split(',') if name.strip()]
+    unknown = [name for name in parameters if name not in NUMERIC_COLUMNS]
+    if unknown:
+        raise TrendQueryError(f"Unknown parameter(s): {', '.join(unknown)}")
+    types = [name.strip() for name in params.get('type', '').split(',') if name.strip()]
+
+    bucket = params.get('bucket', 'day')
+    if bucket not in BUCKETS and bucket not in (BUCKET_UPLOAD, BUCKET_ALL):
+        raise TrendQueryError(f"bucket must be one of {', '.join([*BUCKETS, BUCKET_UPLOAD, BUCKET_ALL])}")
+
+    until = _parse_moment(params['until'], 'until', end_of_day=True) if params.get('until') else timezone.now()
+    if params.get('since'):
+        since = _parse_moment(params['since'], 'since')
+    else:
+        try:
+            days = int(params.get('days', DEFAULT_DAYS))
+        except ValueError:
+            raise TrendQueryError('days must be a whole number')
+        if not 1 <= days <= MAX_DAYS:
+            raise TrendQueryError(f'days must be between 1 and {MAX_DAYS}')
+        since = until - timedelta(days=days)
+    if since >= until:
+        raise TrendQueryError('since must be before until')
+
+    return {
+        'parameters': parameters or list(NUMERIC_COLUMNS),
+        'types': types,
+        'bucket': bucket,
+        'since': since,
+        'until': until,
+    }
+
+
+def _point(row):
+    count = row['total_count'] or 0
+    mean = row['weighted'] / count if count and row['weighted'] is not None else None
+    std = None
+    if count > 1 and mean is not None:
+        variance = (row['squares'] - count * mean * mean) / (count - 1)
+        std = max(variance, 0.0) ** 0.5
+    point = {
+        'period': row['period'].isoformat(),
+        'datasets': row['datasets'],
+        'rows': row['total_rows'],
+        'count': count,
+        'mean': mean,
+        'std': std,
+        'minimum': row['lowest'],
+        'maximum': row['highest'],
+    }
+    for field in ('dataset_id', 'filename', *(f'p{q}' for q in PERCENTILES)):
+        if field in row:
+            point[field] = row[field]
+    return point
+
+
+def trend_series(user, query):
+    """
+    ``{'overall': {parameter: [points]}, 'by_type': {type: {parameter: [points]}}}``
+    for the user's rollups uploaded in ``[since, until)``, oldest period first.
+    """
+    statistics = RollupStatistic.objects.filter(
+        rollup__user=user,
+        rollup__upload_date__gte=query['since'],
+        rollup__upload_date__lt=query['until'],
+        parameter__in=query['parameters'],
+    )
+    if query['types']:
+        statistics = statistics.filter(equipment_type__in=[ALL_TYPES, *query['types']])
+
+    bucket = query['bucket']
+    if bucket == BUCKET_UPLOAD:
+        statistics = statistics.annotate(
+            period=F('rollup__upload_date'), dataset_id=F('rollup__dataset_id'), filename=F('rollup__filename')
+        )
+        group = ['period', 'rollup_id', 'dataset_id', 'filename', 'equipment_type', 'parameter']
+        extra = {f'p{q}': Max(f'p{q}') for q in PERCENTILES}
+    elif bucket == BUCKET_ALL:
+        group = ['equipment_type', 'parameter']
+        extra = {}
+    else:
+        statistics = statistics.annotate(period=BUCKETS[bucket]('rollup__upload_date'))
+        group = ['period', 'equipment_type', 'parameter']
+        extra = {}
+
+    weighted = F('mean') * F('count')
+    squares = (Coalesce('std', 0.0) * Coalesce('std', 0.0)) * (F('count') - 1) + F('mean') * F('mean') * F('count')
+    # Aggregates are named apart from the fields the expressions refer to
+    rows = statistics.values(*group).annotate(
+        datasets=Count('rollup_id'),
+        total_rows=Sum('rows'),
+        total_count=Sum('count'),
+        weighted=Sum(weighted, output_field=FloatField()),
+        squares=Sum(squares, output_field=FloatField()),
+        lowest=Min('minimum'),
+        highest=Max('maximum'),
+        **extra,
+    ).order_by(*group)
+
+    series = {'overall': {}, 'by_type': {}}
+    for row in rows:
+        row.setdefault('period', query['since'])
+        if row['equipment_type'] == ALL_TYPES:
+            target = series['overall']
+        else:
+            target = series['by_type'].setdefault(row['equipment_type'], {})
+        target.setdefault(row['parameter'], []).append(_point(row))
+    return series
@@ -1,9 +1,37 @@
+from django.conf import settings
 from django.urls import path
-from .views import UploadCSVView, HistoryView, GeneratePDFView, CustomAuthToken
+from .views import (
+    UploadCSVView, BulkUploadView, DatasetAppendView, HistoryView, GeneratePDFView, DatasetRowsView,
+    DatasetRecordsView, DatasetStatisticsView, DatasetAnomaliesView, DatasetRejectionsView, DatasetCompareView,
+    DatasetExportView, TrendView, ReportJobStatusView, ReportJobDownloadView, ReportCacheStatsView, HistoryCacheStatsView,
+    MetricsView, AsyncUploadCSVView, AsyncHistoryView, AsyncGeneratePDFView, CustomAuthToken,
+)
 
+# The async views are always served under async/; in the async serving mode
+# they also take over the upload, history and report URLs
 urlpatterns = [
-    path('upload/', UploadCSVView.as_view(), name='upload-csv'),
-    path('history/', HistoryView.as_view(), name='history'),
-    path('report/<int:dataset_id>/', GeneratePDFView.as_view(), name='generate-pdf'),
+    path('upload/', (AsyncUploadCSVView if settings.ASYNC_VIEWS else UploadCSVView).as_view(), name='upload-csv'),
+    path('upload/bulk/', BulkUploadView.as_view(), name='upload-bulk'),
+    path('history/', (AsyncHistoryView if settings.ASYNC_VIEWS else HistoryView).as_view(), name='history'),
+    path('history/cache/', HistoryCacheStatsView.as_view(), name='history-cache-stats'),
+    path('report/<int:dataset_id>/', (AsyncGeneratePDFView if settings.ASYNC_VIEWS else GeneratePDFView).as_view(),
+         name='generate-pdf'),
+    path('report-jobs/<uuid:job_id>/', ReportJobStatusView.as_view(), name='report-job-status'),
+    path('report-jobs/<uuid:job_id>/download/', ReportJobDownloadView.as_view(), name='report-job-download'),
+    path('datasets/compare/', DatasetCompareView.as_view(), name='dataset-compare'),
+    path('datasets/<int:dataset_id>/append/', DatasetAppendView.as_view(), name='dataset-append'),
+    path('datasets/<int:dataset_id>/rows/', DatasetRowsView.as_view(), name='dataset-rows'),
+    path('datasets/<int:dataset_id>/records/', DatasetRecordsView.as_view(), name='dataset-records'),
+    path('datasets/<int:dataset_id>/stats/', DatasetStatisticsView.as_view(), name='dataset-stats'),
+    path('datasets/<int:dataset_id>/anomalies/', DatasetAnomaliesView.as_view(), name='dataset-anomalies'),
+    path('datasets/<int:dataset_id>/rejections/', DatasetRejectionsView.as_view(), name='dataset-rejections'),
+    path('datasets/<int:dataset_id>/export/<str:export_format>/', DatasetExportView.as_view(),
+         name='dataset-export'),
+    path('trends/', TrendView.as_view(), name='trends'),
+    path('reports/cache/', ReportCacheStatsView.as_view(), name='report-cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('async/upload/', AsyncUploadCSVView.as_view(), name='async-upload-csv'),
+    path('async/history/', AsyncHistoryView.as_view(), name='async-history'),
+    path('async/report/<int:dataset_id>/', AsyncGeneratePDFView.as_view(), name='async-generate-pdf'),
     path('login/', CustomAuthToken.as_view(), name='login'),
 ]
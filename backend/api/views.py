@@ -1,79 +1,154 @@
-from io import StringIO
-import pandas as pd
+from pathlib import Path
 
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from django.contrib.auth.models import User
-from django.http import HttpResponse
-from .models import EquipmentDataset
-from .serializers import EquipmentDatasetSerializer
-import pandas as pd
-import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header, quote_etag
+from .models import EquipmentDataset, ReportJob
+from .serializers import ReportJobSerializer
+from .ingest import hash_uploads
+from .storage import (
+    FORMAT_COLUMNAR, PayloadLocked, delete_payload, open_columnar, convert_to_columnar,
+)
+from .rows import parse_row_query, fetch_rows
+from .records import load_records, parse_record_query, query_records
+from .stats import nest_statistics, stored_statistics
+from .anomalies import parse_anomaly_query, query_anomalies
+from .compare import DEFAULT_LIST_LIMIT, MAX_LIST_LIMIT, compare_datasets
+from .trends import TrendQueryError, parse_trend_query, trend_series
+from .history import history_cache
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, IsAllowedAddressOrAdminUser, request_metrics
+from .profiling import ProfiledViewMixin
+from .renderers import TabularViewMixin
+from .conditional import dataset_etag, make_etag, not_modified, query_fingerprint, set_validators
+from .datasets import (
+    afind_duplicate, append_to_dataset, create_dataset, find_duplicate, ingest_upload, prune_datasets,
+    share_dataset, upload_summary,
+)
+from .concurrency import AsyncAPIView, offload
+from .bulk import bulk_ingest
+from .reports import report_cache, report_digest, parse_detail_rows
+from .exports import EXPORT_FORMATS, export_cache, export_digest
+from .streaming import file_response
+from .jobs import enqueue_report, requeue as requeue_report_job, resume_if_lost
 
 #View 1: CSV Upload
-class UploadCSVView(APIView):
+class UploadCSVView(ProfiledViewMixin, APIView):
     parser_classes = [MultiPartParser] 
     permission_classes = [IsAuthenticated]  
     
     def post(self, request):
         try:
-           
+            hasher = hash_uploads(request)
             file_obj = request.FILES['file']
             
-          
-            df = pd.read_csv(file_obj)
-            
-          
-            total_count = len(df) 
-            avg_flowrate = df['Flowrate'].mean() 
-            avg_pressure = df['Pressure'].mean()
-            avg_temperature = df['Temperature'].mean()
-            
+            # A re-upload of a stored file shares its payload and analytics
+            dataset = None
+            source = find_duplicate(request.user, hasher.digest('file'))
+            if source is not None:
+                dataset = share_dataset(request.user, file_obj.name, source)
             
-            type_distribution = df['Type'].value_counts().to_dict()
+            deduplicated = dataset is not None
+            if deduplicated:
+                type_distribution = dict(dataset.type_counts.values_list('equipment_type', 'count'))
+            else:
+                # Stream the upload chunk by chunk into the payload store
+                payload_key, result = ingest_upload(file_obj)
+                
+                type_distribution = result.aggregates.type_distribution
+                
+                # Step 5:Save to database WITH USER
+                try:
+                    dataset = create_dataset(request.user, file_obj.name, payload_key, result)
+                except Exception:
+                    delete_payload(payload_key)
+                    raise
             
-            # Step 5:Save to database WITH USER
-            dataset = EquipmentDataset.objects.create(
-                user=request.user, 
-                filename=file_obj.name,
-                total_count=total_count,
-                avg_flowrate=avg_flowrate,
-                avg_pressure=avg_pressure,
-                avg_temperature=avg_temperature,
-                csv_data=df.to_csv(index=False)  
-            )
+            prune_datasets(request.user)
             
-        
-            old_datasets = EquipmentDataset.objects.filter(user=request.user).order_by('-upload_date')[5:]
-            for old in old_datasets:
-                old.delete()
-            
-          
-            return Response({
-                'id': dataset.id,
-                'total_count': total_count,
-                'averages': {
-                    'flowrate': round(avg_flowrate, 2),
-                    'pressure': round(avg_pressure, 2),
-                    'temperature': round(avg_temperature, 2)
-                },
-                'type_distribution': type_distribution,
-                'data': df.to_dict('records')  
-            }, status=status.HTTP_201_CREATED)
+            response = upload_summary(dataset, type_distribution)
+            response['deduplicated'] = deduplicated
+            response['rejections'] = dataset.rejections
+            response['rows_url'] = reverse('dataset-rows', args=[dataset.id])
+            response['records_url'] = reverse('dataset-records', args=[dataset.id])
+            return Response(response, status=status.HTTP_201_CREATED)
             
         except Exception as e:
           
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-#View 2: History
-class HistoryView(APIView):
+#View 2: Bulk upload
+class BulkUploadView(APIView):
+    """
+    Upload several CSV files and/or ZIP archives of CSVs in one request
+    (multipart field 'files'). Returns one manifest entry per CSV.
+    """
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        hasher = hash_uploads(request)
+        field = 'files' if 'files' in request.FILES else 'file'
+        files = request.FILES.getlist(field)
+        if not files:
+            return Response({'error': 'No files uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            manifest = bulk_ingest(request.user, files, hasher.digests.get(field))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        created = sum(1 for entry in manifest if entry['status'] != 'failed')
+        return Response({
+            'created': created,
+            'failed': len(manifest) - created,
+            'files': manifest
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST)
+
+#View 3: Append rows
+class DatasetAppendView(APIView):
+    """
+    Add the rows of an uploaded CSV (multipart field 'file') to an existing
+    dataset; the summary, type counts and statistics are updated from the
+    new rows only
+    """
+    parser_classes = [MultiPartParser]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        if 'file' not in request.FILES:
+            return Response({'error': 'No file uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            appended, rejections = append_to_dataset(dataset, request.FILES['file'])
+        except PayloadLocked as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        response = upload_summary(dataset, dict(dataset.type_counts.values_list('equipment_type', 'count')))
+        response['appended_rows'] = appended
+        response['rejections'] = rejections.as_dict()
+        return Response(response, status=status.HTTP_200_OK)
+
+#View 4: History
+class HistoryView(ProfiledViewMixin, APIView):
     """
     History View - Returns last 5 uploaded datasets WITH full summaries
     Including total count, averages, AND equipment type distribution
@@ -82,191 +157,507 @@ class HistoryView(APIView):
     
     def get(self, request):
         try:
-           
-            datasets = EquipmentDataset.objects.filter(user=request.user).order_by('-upload_date')[:5]
-            
-            history_data = []
-            for dataset in datasets:
-                df = pd.read_csv(StringIO(dataset.csv_data))
-                type_distribution = df['Type'].value_counts().to_dict()
-                
-                history_data.append({
-                    'id': dataset.id,
-                    'filename': dataset.filename,
-                    'upload_date': dataset.upload_date.isoformat(),
-                    'summary': {
-                        'total_count': dataset.total_count,
-                        'avg_flowrate': round(dataset.avg_flowrate, 2),
-                        'avg_pressure': round(dataset.avg_pressure, 2),
-                        'avg_temperature': round(dataset.avg_temperature, 2),
-                        'type_distribution': type_distribution  # ADD THIS
-                    }
-                })
+            # Cached per user until their next upload, append or prune
+            entry = history_cache.get_or_build(request.user)
             
-            return Response(history_data, status=status.HTTP_200_OK)
+            unchanged = not_modified(request, entry['etag'], entry['last_modified'])
+            if unchanged is not None:
+                return unchanged
+            response = Response(entry['history'], status=status.HTTP_200_OK)
+            return set_validators(response, entry['etag'], entry['last_modified'])
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
-from reportlab.lib.units import inch
-from datetime import datetime
-from io import BytesIO
-from django.http import HttpResponse
-from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
-from .models import EquipmentDataset
-import pandas as pd
-from io import StringIO
-
-#View 3: PDF Generation
-class GeneratePDFView(APIView):
+#View 5: PDF Generation
+class GeneratePDFView(ProfiledViewMixin, APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, dataset_id):
         try:
-            dataset = EquipmentDataset.objects.get(id=dataset_id)
-            
-            buffer = BytesIO()
-            
-            # Create PDF document
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            story = []
-            
-            
-            styles = getSampleStyleSheet()
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Heading1'],
-                fontSize=24,
-                textColor=colors.HexColor('#007bff'),
-                spaceAfter=30,
-                alignment=1 
-            )
-            
-            heading_style = ParagraphStyle(
-                'CustomHeading',
-                parent=styles['Heading2'],
-                fontSize=14,
-                textColor=colors.HexColor('#007bff'),
-                spaceAfter=12,
-                spaceBefore=12
-            )
-            
-            #Title
-            story.append(Paragraph("Equipment Analysis Report", title_style))
-            story.append(Spacer(1, 0.3*inch))
+            detail_rows = parse_detail_rows(request.query_params.get('rows'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = EquipmentDataset.objects.get(id=dataset_id, user=request.user)
             
-            #Report Info
-            report_info = f"<b>Report Generated:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br/>"
-            report_info += f"<b>File:</b> {dataset.filename}<br/>"
-            report_info += f"<b>Upload Date:</b> {dataset.upload_date.strftime('%Y-%m-%d %H:%M:%S')}"
-            story.append(Paragraph(report_info, styles['Normal']))
-            story.append(Spacer(1, 0.3*inch))
+            # The report digest already covers everything the PDF depends on
+            etag = quote_etag(report_digest(dataset, detail_rows))
+            unchanged = not_modified(request, etag, dataset.updated_at)
+            if unchanged is not None:
+                return unchanged
             
-            #Summary Statistics Section
-            story.append(Paragraph("Summary Statistics", heading_style))
-            summary_data = [
-                ['Metric', 'Value'],
-                ['Total Equipment Count', str(dataset.total_count)],
-                ['Average Flowrate', f"{dataset.avg_flowrate:.2f}"],
-                ['Average Pressure', f"{dataset.avg_pressure:.2f}"],
-                ['Average Temperature', f"{dataset.avg_temperature:.2f}"]
-            ]
-            summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
-            summary_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(summary_table)
-            story.append(Spacer(1, 0.3*inch))
+            # Served from the report cache, rendered on a miss
+            path = report_cache.get_or_build(dataset, detail_rows)
             
-            #Equipment Type Distribution
-            story.append(Paragraph("Equipment Type Distribution", heading_style))
-            df = pd.read_csv(StringIO(dataset.csv_data))
-            type_dist = df['Type'].value_counts().to_dict()
+            # Streamed from disk, resumable with Range
+            return file_response(request, path, 'application/pdf', f'{dataset.filename}_report.pdf',
+                                 etag, dataset.updated_at)
             
-            type_data = [['Equipment Type', 'Count']]
-            for equip_type, count in type_dist.items():
-                type_data.append([equip_type, str(count)])
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+    def post(self, request, dataset_id):
+        """Queue the report for background rendering and return the job"""
+        try:
+            detail_rows = parse_detail_rows(request.data.get('rows', request.query_params.get('rows')))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = EquipmentDataset.objects.get(id=dataset_id, user=request.user)
+            job = enqueue_report(dataset, request.user, detail_rows)
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ReportJobStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, job_id):
+        try:
+            job = ReportJob.objects.get(id=job_id, user=request.user)
+        except ReportJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        job = resume_if_lost(job)
+        return Response(ReportJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class ReportJobDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, job_id):
+        try:
+            job = ReportJob.objects.select_related('dataset').get(id=job_id, user=request.user)
+        except ReportJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        job = resume_if_lost(job)
+        if job.status != ReportJob.DONE:
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_409_CONFLICT)
+        
+        etag = quote_etag(report_digest(job.dataset, job.detail_rows))
+        unchanged = not_modified(request, etag, job.dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        path = report_cache.get(job.dataset, job.detail_rows)
+        if path is None:
+            # Evicted since the job finished: render it again in the background,
+            # unless a concurrent request already queued it
+            job = requeue_report_job(job, Q(status=ReportJob.DONE))
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        
+        return file_response(request, path, 'application/pdf', f'{job.dataset.filename}_report.pdf',
+                             etag, job.dataset.updated_at)
+
+
+#View 6: Paginated rows
+class DatasetRowsView(TabularViewMixin, APIView):
+    """
+    Keyset-paginated rows of a stored dataset.
+    Query params: limit, after (cursor from the previous page's 'next'),
+    columns (comma separated), sort (column name, '-' prefix for descending)
+    """
+    permission_classes = [IsAuthenticated]
+    table_field = 'rows'
+    
+    def get(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = dataset_etag(dataset, 'rows', query_fingerprint(request))
+        unchanged = not_modified(request, etag, dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            if dataset.storage_format != FORMAT_COLUMNAR:
+                dataset = EquipmentDataset.objects.get(id=dataset_id, user=request.user)
+                convert_to_columnar(dataset)
+            payload = open_columnar(dataset)
+            limit, columns, sort, descending, cursor = parse_row_query(request.query_params, payload.columns)
+            page = fetch_rows(payload, limit, columns, sort, descending, cursor)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        page['total_count'] = payload.rows
+        return set_validators(Response(page, status=status.HTTP_200_OK), etag, dataset.updated_at)
+
+
+#View 7: Record query
+class DatasetRecordsView(TabularViewMixin, APIView):
+    """
+    Filter a dataset's records and aggregate them in SQL.
+    Query params: type (comma separated), flowrate_min, flowrate_max,
+    pressure_min, pressure_max, temperature_min, temperature_max,
+    limit (records listed, 0 for aggregates only), after (cursor)
+    """
+    permission_classes = [IsAuthenticated]
+    table_field = 'records'
+    
+    def get(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = dataset_etag(dataset, 'records', query_fingerprint(request))
+        unchanged = not_modified(request, etag, dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            filters, limit, cursor = parse_record_query(request.query_params)
+            if not dataset.records.exists():
+                # Uploaded before records were stored
+                with transaction.atomic():
+                    load_records(EquipmentDataset.objects.get(id=dataset_id, user=request.user))
+            result = query_records(dataset, filters, limit, cursor)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return set_validators(Response(result, status=status.HTTP_200_OK), etag, dataset.updated_at)
+
+
+#View 8: Per-type statistics
+class DatasetStatisticsView(APIView):
+    """
+    Count, mean, std, min, max and p50/p95/p99 of every parameter, for the
+    whole dataset and per equipment type. Computed at upload, read as stored.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = dataset_etag(dataset, 'stats')
+        unchanged = not_modified(request, etag, dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            statistics = nest_statistics(stored_statistics(dataset))
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        statistics['id'] = dataset.id
+        return set_validators(Response(statistics, status=status.HTTP_200_OK), etag, dataset.updated_at)
+
+
+#View 9: Anomalies
+class DatasetAnomaliesView(TabularViewMixin, APIView):
+    """
+    Values flagged at upload as anomalous within their Type (z-score or IQR
+    rule), with counts per parameter and rule.
+    Query params: parameter, type (comma separated), rule (zscore or iqr),
+    limit (flags listed, 0 for counts only), after (cursor)
+    """
+    permission_classes = [IsAuthenticated]
+    table_field = 'anomalies'
+    
+    def get(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = dataset_etag(dataset, 'anomalies', query_fingerprint(request))
+        unchanged = not_modified(request, etag, dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            filters, limit, cursor = parse_anomaly_query(request.query_params)
+            result = query_anomalies(dataset, filters, limit, cursor)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        result['id'] = dataset.id
+        return set_validators(Response(result, status=status.HTTP_200_OK), etag, dataset.updated_at)
+
+
+#View 10: Dataset comparison
+class DatasetCompareView(APIView):
+    """
+    Compare two of the user's datasets (?a=<id>&b=<id>), matched on
+    Equipment Name: added and removed equipment, per-parameter deltas and
+    per-type statistic shifts from a to b. ``limit`` caps the name lists.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        try:
+            ids = [int(request.query_params[key]) for key in ('a', 'b')]
+            limit = int(request.query_params.get('limit', DEFAULT_LIST_LIMIT))
+        except (KeyError, ValueError):
+            return Response({'error': 'a and b must be dataset ids and limit a number'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= limit <= MAX_LIST_LIMIT:
+            return Response({'error': f'limit must be between 0 and {MAX_LIST_LIMIT}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        datasets = EquipmentDataset.objects.defer('csv_data').filter(id__in=ids, user=request.user).in_bulk()
+        if any(dataset_id not in datasets for dataset_id in ids):
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        dataset_a, dataset_b = (datasets[dataset_id] for dataset_id in ids)
+        
+        etag = make_etag(dataset_etag(dataset_a), dataset_etag(dataset_b), query_fingerprint(request))
+        last_modified = max(dataset_a.updated_at, dataset_b.updated_at)
+        unchanged = not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            comparison = compare_datasets(dataset_a, dataset_b, limit)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return set_validators(Response(comparison, status=status.HTTP_200_OK), etag, last_modified)
+
+
+#View 11: Rejected rows
+class DatasetRejectionsView(APIView):
+    """Rows left out of a dataset by schema validation: the count and the first of them with reasons"""
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, dataset_id):
+        try:
+            dataset = EquipmentDataset.objects.only(
+                'id', 'upload_date', 'updated_at', 'content_hash', 'rejected_rows', 'rejections'
+            ).get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        etag = dataset_etag(dataset, 'rejections')
+        unchanged = not_modified(request, etag, dataset.updated_at)
+        if unchanged is not None:
+            return unchanged
+        
+        return set_validators(Response({
+            'id': dataset.id,
+            'rejected_rows': dataset.rejected_rows,
+            'rejections': dataset.rejections,
+        }, status=status.HTTP_200_OK), etag, dataset.updated_at)
+
+
+#View 12: Trends
+class TrendView(APIView):
+    """
+    Parameter trends over the user's uploads, pruned ones included, from the
+    stored rollups: ?parameter=Pressure&type=Pump&bucket=week&days=90 (or
+    since/until). Points per period, overall and per Type.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        try:
+            query = parse_trend_query(request.query_params)
+        except TrendQueryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            series = trend_series(request.user, query)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response({
+            'since': query['since'].isoformat(),
+            'until': query['until'].isoformat(),
+            'bucket': query['bucket'],
+            'parameters': query['parameters'],
+            **series,
+        }, status=status.HTTP_200_OK)
+
+
+#View 13: Dataset export
+class DatasetExportView(APIView):
+    """
+    The dataset as a CSV or NDJSON download (export_format 'csv' or 'ndjson').
+    Cached exports honour Range, so an interrupted download can be resumed.
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, dataset_id, export_format):
+        if export_format not in EXPORT_FORMATS:
+            return Response({'error': f'Unknown export format {export_format!r}, expected one of '
+                                      f'{", ".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = EquipmentDataset.objects.defer('csv_data').get(id=dataset_id, user=request.user)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        try:
+            etag = quote_etag(export_digest(dataset, export_format))
+            unchanged = not_modified(request, etag, dataset.updated_at)
+            if unchanged is not None:
+                return unchanged
             
-            type_table = Table(type_data, colWidths=[3*inch, 2*inch])
-            type_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            story.append(type_table)
-            story.append(Spacer(1, 0.3*inch))
+            content_type = EXPORT_FORMATS[export_format]
+            filename = f'{Path(dataset.filename).stem}.{export_format}'
+            path = export_cache.get(dataset, export_format)
+            if path is None and 'HTTP_RANGE' not in request.META:
+                # First download: stream while it is written to the cache
+                response = StreamingHttpResponse(export_cache.stream(dataset, export_format),
+                                                 content_type=content_type)
+                response['Content-Disposition'] = content_disposition_header(True, filename)
+                return set_validators(response, etag, dataset.updated_at)
+            if path is None:
+                path = export_cache.put(dataset, export_format)
+            return file_response(request, path, content_type, filename, etag, dataset.updated_at)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+#View 14: Report cache statistics
+class ReportCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(report_cache.stats(), status=status.HTTP_200_OK)
+
+
+#View 15: History cache statistics
+class HistoryCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(history_cache.stats(), status=status.HTTP_200_OK)
+
+
+#View 16: Metrics
+class MetricsView(APIView):
+    """Request counts, latency and size histograms and phase timings, in the Prometheus text format"""
+    permission_classes = [IsAllowedAddressOrAdminUser]
+    
+    def get(self, request):
+        return HttpResponse(request_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+#View 17: Async CSV upload
+class AsyncUploadCSVView(ProfiledViewMixin, AsyncAPIView):
+    """
+    UploadCSVView for ASGI serving: parsing and aggregation run on the CPU
+    pool (see api.concurrency), so the worker keeps serving other requests
+    """
+    parser_classes = [MultiPartParser]
+    
+    async def post(self, request):
+        try:
+            hasher = hash_uploads(request)
+            files = await offload(getattr, request, 'FILES')
+            file_obj = files['file']
             
-            # Equipment Data Table
-            story.append(PageBreak())
-            story.append(Paragraph("Equipment Details", heading_style))
+            dataset = None
+            source = await afind_duplicate(request.user, hasher.digest('file'))
+            if source is not None:
+                dataset = await sync_to_async(share_dataset)(request.user, file_obj.name, source)
             
-            # Prepare table data
-            equipment_data = df.to_dict('records')
-            table_data = [['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']]
+            deduplicated = dataset is not None
+            if deduplicated:
+                type_distribution = {
+                    equipment_type: count
+                    async for equipment_type, count in dataset.type_counts.values_list('equipment_type', 'count')
+                }
+            else:
+                payload_key, result = await offload(ingest_upload, file_obj)
+                type_distribution = result.aggregates.type_distribution
+                try:
+                    dataset = await offload(create_dataset, request.user, file_obj.name, payload_key, result)
+                except Exception:
+                    await offload(delete_payload, payload_key)
+                    raise
             
-            for item in equipment_data:
-                table_data.append([
-                    str(item.get('Equipment Name', '')),
-                    str(item.get('Type', '')),
-                    str(item.get('Flowrate', '')),
-                    str(item.get('Pressure', '')),
-                    str(item.get('Temperature', ''))
-                ])
+            await sync_to_async(prune_datasets)(request.user)
             
-            data_table = Table(table_data, colWidths=[1.5*inch, 1.2*inch, 1*inch, 1*inch, 1*inch])
-            data_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-            ]))
-            story.append(data_table)
-            story.append(Spacer(1, 0.3*inch))
+            response = upload_summary(dataset, type_distribution)
+            response['deduplicated'] = deduplicated
+            response['rejections'] = dataset.rejections
+            response['rows_url'] = reverse('dataset-rows', args=[dataset.id])
+            response['records_url'] = reverse('dataset-records', args=[dataset.id])
+            return Response(response, status=status.HTTP_201_CREATED)
+        
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+#View 18: Async history
+class AsyncHistoryView(ProfiledViewMixin, AsyncAPIView):
+    """HistoryView for ASGI serving, read through the async ORM and cache API"""
+    
+    async def get(self, request):
+        try:
+            entry = await history_cache.aget_or_build(request.user)
             
-            # Footer
-            story.append(Spacer(1, 0.2*inch))
-            footer_text = "<i>This report was automatically generated by the Chemical Equipment Parameter Visualizer system.</i>"
-            story.append(Paragraph(footer_text, styles['Normal']))
+            unchanged = not_modified(request, entry['etag'], entry['last_modified'])
+            if unchanged is not None:
+                return unchanged
+            response = Response(entry['history'], status=status.HTTP_200_OK)
+            return set_validators(response, entry['etag'], entry['last_modified'])
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+#View 19: Async PDF generation
+class AsyncGeneratePDFView(ProfiledViewMixin, AsyncAPIView):
+    """GeneratePDFView for ASGI serving: reports are laid out in render processes"""
+    
+    async def get(self, request, dataset_id):
+        try:
+            detail_rows = parse_detail_rows(request.query_params.get('rows'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = await EquipmentDataset.objects.defer('csv_data').aget(id=dataset_id, user=request.user)
             
-            # Build PDF
-            doc.build(story)
+            etag = quote_etag(await sync_to_async(report_digest)(dataset, detail_rows))
+            unchanged = not_modified(request, etag, dataset.updated_at)
+            if unchanged is not None:
+                return unchanged
             
-           
-            buffer.seek(0)
-            response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{dataset.filename}_report.pdf"'
+            # Laid out in a render process on a miss
+            path = await report_cache.aget_or_build(dataset, detail_rows)
             
-            return response
+            return file_response(request, path, 'application/pdf', f'{dataset.filename}_report.pdf',
+                                 etag, dataset.updated_at, asynchronous=True)
             
         except EquipmentDataset.DoesNotExist:
             return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    async def post(self, request, dataset_id):
+        """Queue the report for background rendering and return the job"""
+        try:
+            detail_rows = parse_detail_rows(request.data.get('rows', request.query_params.get('rows')))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            dataset = await EquipmentDataset.objects.defer('csv_data').aget(id=dataset_id, user=request.user)
+            job = await sync_to_async(enqueue_report)(dataset, request.user, detail_rows)
+            return Response(ReportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        except EquipmentDataset.DoesNotExist:
+            return Response({'error': 'Dataset not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-#View 4: Authentication
+#View 20: Authentication
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
         
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.timing.ServerTimingMiddleware",  # outermost, so its total covers the other middleware
+    "api.compression.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -115,6 +117,87 @@ USE_TZ = True
 STATIC_URL = "static/"
 
 
+# Uploaded dataset payloads live on disk, outside SQLite
+DATASET_STORAGE_DIR = BASE_DIR / "dataset_store"
+
+# Rendered PDF reports, evicted least recently used past the size budget
+REPORT_CACHE_DIR = BASE_DIR / "report_cache"
+REPORT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# API payloads smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = 1024
+
+# CSV/NDJSON dataset exports, evicted least recently used past the size budget
+EXPORT_CACHE_DIR = BASE_DIR / "export_cache"
+EXPORT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Rows listed in a report's Equipment Details section when the request does
+# not pass ?rows= (None lists all, 0 is summary only)
+REPORT_DETAIL_ROWS = None
+
+# Background report rendering: pool size (0 renders inline) and how long a
+# running job may go without finishing before it is considered lost
+REPORT_WORKERS = 2
+REPORT_JOB_STALE_SECONDS = 600
+
+# Re-flagging the anomalies of a dataset after an append moved its bounds:
+# pool size (0 re-flags inline after commit)
+ANOMALY_WORKERS = 1
+
+# /api/history/ responses are cached per user and invalidated on every
+# upload, append and prune. The file backend is shared by all worker
+# processes on a host; LocMemCache also works with a single process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "history": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "history_cache",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
+# Rows parsed per chunk while streaming an upload
+CSV_CHUNK_ROWS = 50_000
+
+# Rejected rows listed (with their reason) in an upload's rejection report;
+# all of them are counted
+REJECTION_REPORT_ROWS = 100
+
+# Equipment records inserted per bulk INSERT
+RECORD_BATCH_SIZE = 2_000
+
+# Bulk uploads: parser pool size (0 parses inline), CSV files accepted per
+# request and datasets saved per transaction
+INGEST_WORKERS = 4
+BULK_UPLOAD_MAX_FILES = 100
+BULK_COMMIT_BATCH = 10
+
+# /api/metrics/: staff users only, plus the client addresses listed here
+# (a Prometheus scraper), and the requests per endpoint whose latency
+# quantiles are reported. Behind a reverse proxy every request comes from
+# the proxy's address, so only list addresses the proxy cannot forward
+# from, e.g. ['127.0.0.1', '::1'] when the scraper reaches the app server
+# directly.
+METRICS_ALLOWED_ADDRESSES = []
+METRICS_WINDOW = 1024
+
+# Request profiles captured with ?profile=1 by staff users (see
+# api.profiling), and how many of the newest are kept
+PROFILE_DIR = BASE_DIR / "profiles"
+PROFILE_RETAINED = 100
+
+# Async views (see api.concurrency): threads for their pandas, numpy and
+# database work, processes for ReportLab layout (0 lays out on the threads),
+# and whether they also serve the plain upload, history and report URLs
+# (deploy with an ASGI server, backend.asgi:application)
+ASYNC_CPU_WORKERS = 4
+ASYNC_RENDER_WORKERS = 2
+ASYNC_VIEWS = False
+
+
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
@@ -130,4 +213,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.timing.TimedJSONRenderer',  # JSON rendering shows up in Server-Timing
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
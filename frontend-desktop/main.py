@@ -6,14 +6,21 @@ analyze equipment data, and generate PDF reports.
 
 import sys
 import os
+import io
+import json
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QLineEdit, QFileDialog, QTableWidget,
     QTableWidgetItem, QMessageBox, QTabWidget, QListWidget,
-    QScrollArea, QFrame, QSplitter, QListWidgetItem
+    QScrollArea, QFrame, QSplitter, QListWidgetItem, QProgressBar
 )
-from PyQt5.QtCore import Qt, QEvent
+from PyQt5.QtCore import Qt, QEvent, QObject, QRunnable, QThreadPool, pyqtSignal
 import matplotlib
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt
@@ -21,9 +28,316 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 import pandas as pd
 
+from table_formats import read_table, table_media_type
+
 
 API_BASE_URL = 'http://localhost:8000/api'
 TOKEN = None
+ROWS_PAGE_SIZE = 500
+TABLE_COLUMNS = ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
+
+# ============================================================================
+# NETWORK LAYER
+# ============================================================================
+# Requests run on a thread pool, never on the GUI thread, over one shared
+# session so that connections are pooled and reused. Each request reports
+# its progress and can be cancelled between blocks; results come back to
+# the GUI thread as Qt signals.
+
+NETWORK_WORKERS = 4
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+# Uploads are answered once the whole file is analyzed, reports once they
+# are rendered: minutes for the largest datasets
+PROCESSING_READ_TIMEOUT = 600
+TRANSFER_BLOCK_SIZE = 64 * 1024
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=NETWORK_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+SESSION = create_session()
+
+
+def set_token(token):
+    global TOKEN
+    TOKEN = token
+    SESSION.headers['Authorization'] = f'Token {token}'
+
+
+class Transfer:
+    """Cancellation flag and progress callback of one request, shared with the worker thread"""
+
+    def __init__(self, on_progress=None):
+        self._cancelled = threading.Event()
+        self._on_progress = on_progress
+        self._reported = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise RequestCancelled()
+
+    def progress(self, done, total):
+        """Report ``done`` of ``total`` bytes (0 if unknown), at most once per block"""
+        if self._on_progress is None:
+            return
+        if done < self._reported or done - self._reported >= TRANSFER_BLOCK_SIZE or done == total:
+            self._reported = done
+            self._on_progress(done, total)
+
+
+class Reply:
+    """Status, headers and body of a response read by ``read_reply``"""
+
+    def __init__(self, response, content):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def iter_reply(response, transfer):
+    """Yield a streamed response's body block by block, with progress over the bytes on the wire"""
+    total = int(response.headers.get('Content-Length') or 0)
+    for block in response.iter_content(TRANSFER_BLOCK_SIZE):
+        transfer.check()
+        yield block
+        transfer.progress(response.raw.tell(), total)
+
+
+def read_reply(response, transfer):
+    with response:
+        return Reply(response, b''.join(iter_reply(response, transfer)))
+
+
+def send_request(method, path, timeout=READ_TIMEOUT, **kwargs):
+    """The response with its body still unread"""
+    return SESSION.request(method, f'{API_BASE_URL}{path}', stream=True,
+                           timeout=(CONNECT_TIMEOUT, timeout), **kwargs)
+
+
+def api_request(transfer, method, path, timeout=READ_TIMEOUT, **kwargs):
+    return read_reply(send_request(method, path, timeout, **kwargs), transfer)
+
+
+class MultipartUpload:
+    """
+    A file as a multipart/form-data body. requests sends it with a
+    Content-Length, reading it in blocks, so the file is never loaded
+    whole and every block reports progress and can be cancelled.
+    """
+
+    def __init__(self, path, field, transfer):
+        boundary = uuid.uuid4().hex
+        filename = os.path.basename(path).replace('"', '')
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            'Content-Type: text/csv\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self._file = open(path, 'rb')
+        self._parts = [io.BytesIO(head), self._file, io.BytesIO(tail)]
+        self._size = len(head) + os.fstat(self._file.fileno()).st_size + len(tail)
+        self._sent = 0
+        self._transfer = transfer
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        self._transfer.check()
+        data = b''
+        while self._parts and (size < 0 or len(data) < size):
+            block = self._parts[0].read(-1 if size < 0 else size - len(data))
+            if not block:
+                self._parts.pop(0)
+                continue
+            data += block
+        self._sent += len(data)
+        self._transfer.progress(self._sent, self._size)
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def post_csv(transfer, path):
+    with MultipartUpload(path, 'file', transfer) as body:
+        return api_request(transfer, 'POST', '/upload/', timeout=PROCESSING_READ_TIMEOUT, data=body,
+                           headers={'Content-Type': body.content_type})
+
+
+# Last body and ETag per URL of small JSON responses (history), revalidated
+# with If-None-Match so unchanged ones come back as an empty 304. Shared by
+# the workers.
+RESPONSE_CACHE_SIZE = 32
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# ETag and saved file per URL of downloads (reports): the body is streamed
+# to disk and only the file's location is kept
+_download_cache = OrderedDict()
+_download_cache_lock = threading.Lock()
+
+
+def _file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def download_file(transfer, path, file_path, timeout=READ_TIMEOUT):
+    """
+    GET ``path`` into ``file_path``, streamed block by block through a
+    temporary file. When the last download of ``path`` is still on disk
+    unchanged, it is revalidated and copied on 304. Returns the status code
+    (200 once the file is saved).
+    """
+    with _download_cache_lock:
+        cached = _download_cache.get(path)
+    if cached and _file_signature(cached[1]) != cached[2]:
+        cached = None
+    headers = {'If-None-Match': cached[0]} if cached else {}
+
+    with send_request('GET', path, timeout, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            if os.path.abspath(cached[1]) != os.path.abspath(file_path):
+                shutil.copyfile(cached[1], file_path)
+            etag = cached[0]
+        elif response.status_code == 200:
+            tmp_path = f'{file_path}.{uuid.uuid4().hex}.part'
+            try:
+                with open(tmp_path, 'wb') as output:
+                    for block in iter_reply(response, transfer):
+                        output.write(block)
+                os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            etag = response.headers.get('ETag')
+        else:
+            return response.status_code
+
+    with _download_cache_lock:
+        if etag:
+            _download_cache[path] = (etag, file_path, _file_signature(file_path))
+            _download_cache.move_to_end(path)
+            while len(_download_cache) > RESPONSE_CACHE_SIZE:
+                _download_cache.popitem(last=False)
+    return 200
+
+
+def conditional_get(transfer, path, timeout=READ_TIMEOUT):
+    """GET ``path``, reusing the cached body on 304. Returns (status_code, content)"""
+    with _response_cache_lock:
+        cached = _response_cache.get(path)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    reply = api_request(transfer, 'GET', path, timeout=timeout, headers=headers)
+    with _response_cache_lock:
+        if reply.status_code == 304 and cached:
+            if path in _response_cache:
+                _response_cache.move_to_end(path)
+            return 200, cached[1]
+        if reply.status_code == 200 and reply.headers.get('ETag'):
+            _response_cache[path] = (reply.headers['ETag'], reply.content)
+            _response_cache.move_to_end(path)
+            while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+    return reply.status_code, reply.content
+
+
+class TaskSignals(QObject):
+    progress = pyqtSignal(int, int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class NetworkTask(QRunnable):
+    """
+    Runs ``work(transfer)`` on the network pool. Its result, error or
+    cancellation arrives as one of ``signals``, on the GUI thread.
+    """
+    running = set()
+    _pool = None
+
+    def __init__(self, work):
+        super().__init__()
+        self.work = work
+        self.signals = TaskSignals()
+        self.transfer = Transfer(self.signals.progress.emit)
+
+    @classmethod
+    def pool(cls):
+        if cls._pool is None:
+            cls._pool = QThreadPool()
+            cls._pool.setMaxThreadCount(NETWORK_WORKERS)
+        return cls._pool
+
+    def start(self):
+        NetworkTask.running.add(self)
+        for signal in (self.signals.succeeded, self.signals.failed, self.signals.cancelled):
+            signal.connect(lambda *_: NetworkTask.running.discard(self))
+        self.pool().start(self)
+
+    def cancel(self):
+        self.transfer.cancel()
+
+    def run(self):
+        try:
+            result = self.work(self.transfer)
+            # A result that arrives after the user cancelled is dropped
+            self.transfer.check()
+        except RequestCancelled:
+            self.signals.cancelled.emit()
+        except requests.Timeout:
+            self.signals.failed.emit('The server did not respond in time')
+        except requests.ConnectionError:
+            self.signals.failed.emit(f'Cannot connect to {API_BASE_URL}')
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.succeeded.emit(result)
+
+    @classmethod
+    def shutdown(cls, timeout_ms=3000):
+        """Cancel the running tasks and wait for the workers, on exit"""
+        for task in list(cls.running):
+            task.cancel()
+        if cls._pool is not None:
+            cls._pool.waitForDone(timeout_ms)
 
 # ============================================================================
 # LOGIN WINDOW CLASS
@@ -57,32 +371,38 @@ class LoginWindow(QWidget):
         layout.addWidget(QLabel('Password:'))
         layout.addWidget(self.password_input)
         
-        login_btn = QPushButton('Login')
-        login_btn.clicked.connect(self.handle_login)
-        layout.addWidget(login_btn)
+        self.login_btn = QPushButton('Login')
+        self.login_btn.clicked.connect(self.handle_login)
+        layout.addWidget(self.login_btn)
         
         self.setLayout(layout)
     
     def handle_login(self):
-        global TOKEN
-        username = self.username_input.text()
-        password = self.password_input.text()
-        
-        try:
-            response = requests.post(
-                f'{API_BASE_URL}/login/',
-                json={'username': username, 'password': password}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                TOKEN = data['token']
-                QMessageBox.information(self, 'Success', f'Welcome, {data["username"]}!')
-                self.open_main_window()
-            else:
-                QMessageBox.warning(self, 'Error', 'Invalid credentials')
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Login failed: {str(e)}')
+        credentials = {'username': self.username_input.text(), 'password': self.password_input.text()}
+        self.login_btn.setEnabled(False)
+        self.login_btn.setText('Logging in...')
+        self.task = NetworkTask(lambda transfer: api_request(transfer, 'POST', '/login/', json=credentials))
+        self.task.signals.succeeded.connect(self.login_finished)
+        self.task.signals.failed.connect(self.login_failed)
+        self.task.start()
+    
+    def login_finished(self, reply):
+        self.reset_login_button()
+        if reply.status_code == 200:
+            data = reply.json()
+            set_token(data['token'])
+            QMessageBox.information(self, 'Success', f'Welcome, {data["username"]}!')
+            self.open_main_window()
+        else:
+            QMessageBox.warning(self, 'Error', 'Invalid credentials')
+    
+    def login_failed(self, message):
+        self.reset_login_button()
+        QMessageBox.critical(self, 'Error', f'Login failed: {message}')
+    
+    def reset_login_button(self):
+        self.login_btn.setEnabled(True)
+        self.login_btn.setText('Login')
     
     def open_main_window(self):
         self.main_window = MainWindow()
@@ -133,8 +453,10 @@ class MainWindow(QMainWindow):
         self.setWindowTitle('Chemical Equipment Parameter Visualizer')
         self.setGeometry(100, 100, 1200, 800)
         self.current_data = None
+        self.next_rows_cursor = None
         self.zoom_start_width = 800
         self.zoom_start_height = 600
+        self.tasks = []
         self.init_ui()
     
     def init_ui(self):
@@ -158,6 +480,15 @@ class MainWindow(QMainWindow):
         
         main_layout.addWidget(tabs)
         central_widget.setLayout(main_layout)
+        
+        self.transfer_label = QLabel()
+        self.transfer_progress = QProgressBar()
+        self.transfer_progress.setMaximumWidth(250)
+        self.cancel_btn = QPushButton('Cancel')
+        self.cancel_btn.clicked.connect(self.cancel_tasks)
+        for status_widget in (self.transfer_label, self.transfer_progress, self.cancel_btn):
+            self.statusBar().addPermanentWidget(status_widget)
+            status_widget.hide()
     
     def create_upload_tab(self):
         widget = QWidget()
@@ -171,9 +502,9 @@ class MainWindow(QMainWindow):
         browse_btn.clicked.connect(self.browse_file)
         upload_layout.addWidget(browse_btn)
         
-        upload_btn = QPushButton('Upload & Analyze')
-        upload_btn.clicked.connect(self.upload_file)
-        upload_layout.addWidget(upload_btn)
+        self.upload_btn = QPushButton('Upload & Analyze')
+        self.upload_btn.clicked.connect(self.upload_file)
+        upload_layout.addWidget(self.upload_btn)
         
         layout.addLayout(upload_layout)
         
@@ -229,6 +560,10 @@ class MainWindow(QMainWindow):
         self.data_table = QTableWidget()
         self.data_table.setStyleSheet("background-color: #2F4F4F; color: white;")
         table_layout.addWidget(self.data_table)
+        self.more_rows_btn = QPushButton('Load More Rows')
+        self.more_rows_btn.clicked.connect(self.load_more_rows)
+        self.more_rows_btn.setEnabled(False)
+        table_layout.addWidget(self.more_rows_btn)
         table_widget.setLayout(table_layout)
         splitter.addWidget(table_widget)
         
@@ -290,21 +625,74 @@ class MainWindow(QMainWindow):
             self.selected_file = file_path
             self.file_label.setText(os.path.basename(file_path))
     
+    def run_task(self, label, work, on_success, on_finished=None):
+        """
+        Run ``work(transfer)`` on the network pool with its progress in the
+        status bar. ``on_success`` gets the result, ``on_finished`` is called
+        in any case.
+        """
+        task = NetworkTask(work)
+        task.label = label
+        task.signals.progress.connect(lambda done, total: self.show_progress(task, done, total))
+        task.signals.succeeded.connect(on_success)
+        task.signals.failed.connect(lambda message: QMessageBox.critical(self, 'Error', f'{label} failed: {message}'))
+        task.signals.cancelled.connect(lambda: self.statusBar().showMessage(f'{label} cancelled', 3000))
+        for signal in (task.signals.succeeded, task.signals.failed, task.signals.cancelled):
+            signal.connect(lambda *_: self.task_finished(task))
+            if on_finished is not None:
+                signal.connect(lambda *_: on_finished())
+        self.tasks.append(task)
+        self.show_progress(task, 0, 0)
+        task.start()
+        return task
+    
+    def show_progress(self, task, done, total):
+        """Progress of the latest task; a busy indicator while the size is unknown"""
+        if not self.tasks or task is not self.tasks[-1]:
+            return
+        self.transfer_label.setText(task.label)
+        if total:
+            self.transfer_progress.setRange(0, 1000)
+            self.transfer_progress.setValue(min(int(done * 1000 / total), 1000))
+        else:
+            self.transfer_progress.setRange(0, 0)
+        for status_widget in (self.transfer_label, self.transfer_progress, self.cancel_btn):
+            status_widget.show()
+    
+    def task_finished(self, task):
+        if task not in self.tasks:
+            return
+        self.tasks.remove(task)
+        if self.tasks:
+            self.show_progress(self.tasks[-1], 0, 0)
+        else:
+            for status_widget in (self.transfer_label, self.transfer_progress, self.cancel_btn):
+                status_widget.hide()
+    
+    def cancel_tasks(self):
+        """Cancel the running requests; the window stops waiting for them at once"""
+        for task in list(self.tasks):
+            task.cancel()
+            self.task_finished(task)
+        self.statusBar().showMessage('Cancelling...', 3000)
+    
     def upload_file(self):
         if not hasattr(self, 'selected_file'):
             QMessageBox.warning(self, 'Error', 'Please select a CSV file first')
             return
+        path = self.selected_file
+        self.upload_btn.setEnabled(False)
+        self.run_task(f'Uploading {os.path.basename(path)}', lambda transfer: post_csv(transfer, path),
+                      self.upload_finished, on_finished=lambda: self.upload_btn.setEnabled(True))
+    
+    def upload_finished(self, reply):
         try:
-            with open(self.selected_file, 'rb') as f:
-                files = {'file': f}
-                headers = {'Authorization': f'Token {TOKEN}'}
-                response = requests.post(f'{API_BASE_URL}/upload/', files=files, headers=headers)
-            if response.status_code == 201:
-                self.current_data = response.json()
+            if reply.status_code == 201:
+                self.current_data = reply.json()
                 self.display_results()
                 QMessageBox.information(self, 'Success', 'CSV uploaded and analyzed successfully!')
             else:
-                QMessageBox.warning(self, 'Error', f'Upload failed: {response.text}')
+                QMessageBox.warning(self, 'Error', f'Upload failed: {reply.text}')
         except Exception as e:
             QMessageBox.critical(self, 'Error', f'Upload error: {str(e)}')
     
@@ -332,49 +720,96 @@ class MainWindow(QMainWindow):
             'Equipment Type Distribution'
         )
         
-        equipment_data = data['data']
-        self.data_table.setRowCount(len(equipment_data))
-        self.data_table.setColumnCount(5)
-        self.data_table.setHorizontalHeaderLabels(
-            ['Equipment Name', 'Type', 'Flowrate', 'Pressure', 'Temperature']
-        )
-        
-        for i, item in enumerate(equipment_data):
-            self.data_table.setItem(i, 0, QTableWidgetItem(str(item['Equipment Name'])))
-            self.data_table.setItem(i, 1, QTableWidgetItem(str(item['Type'])))
-            self.data_table.setItem(i, 2, QTableWidgetItem(str(item['Flowrate'])))
-            self.data_table.setItem(i, 3, QTableWidgetItem(str(item['Pressure'])))
-            self.data_table.setItem(i, 4, QTableWidgetItem(str(item['Temperature'])))
+        self.data_table.setRowCount(0)
+        self.data_table.setColumnCount(len(TABLE_COLUMNS))
+        self.data_table.setHorizontalHeaderLabels(TABLE_COLUMNS)
+        self.next_rows_cursor = None
+        self.load_more_rows()
         
         self.data_table.resizeColumnsToContents()
         self.pdf_btn.setEnabled(True)
     
-    def download_pdf(self):
+    def load_more_rows(self):
+        """Fetch the next page of rows for the current dataset and append it to the table"""
         if not self.current_data:
             return
+        dataset_id = self.current_data['id']
+        params = {'limit': ROWS_PAGE_SIZE}
+        if self.next_rows_cursor:
+            params['after'] = self.next_rows_cursor
+        headers = {'Accept': table_media_type()}
+        self.more_rows_btn.setEnabled(False)
+        self.run_task(
+            'Loading rows',
+            lambda transfer: api_request(transfer, 'GET', f'/datasets/{dataset_id}/rows/', params=params,
+                                         headers=headers),
+            lambda reply: self.rows_loaded(dataset_id, reply),
+            on_finished=lambda: self.more_rows_btn.setEnabled(
+                bool(self.next_rows_cursor) or self.data_table.rowCount() == 0
+            ),
+        )
+    
+    def rows_loaded(self, dataset_id, reply):
+        if not self.current_data or self.current_data['id'] != dataset_id:
+            # Another dataset was uploaded meanwhile
+            return
         try:
-            dataset_id = self.current_data['id']
-            headers = {'Authorization': f'Token {TOKEN}'}
-            response = requests.get(f'{API_BASE_URL}/report/{dataset_id}/', headers=headers)
-            if response.status_code == 200:
-                file_path, _ = QFileDialog.getSaveFileName(
-                    self, 'Save PDF Report', f'report_{dataset_id}.pdf', 'PDF Files (*.pdf)'
-                )
-                if file_path:
-                    with open(file_path, 'wb') as f:
-                        f.write(response.content)
-                    QMessageBox.information(self, 'Success', f'PDF saved to {file_path}')
-            else:
-                QMessageBox.warning(self, 'Error', 'Failed to generate PDF')
+            if reply.status_code != 200:
+                _, error = read_table(reply, 'rows')
+                QMessageBox.warning(self, 'Error', f"Failed to load rows: {error.get('error', reply.status_code)}")
+                return
+            rows, page = read_table(reply, 'rows')
+            rows = rows.reindex(columns=TABLE_COLUMNS)
+            start = self.data_table.rowCount()
+            self.data_table.setRowCount(start + len(rows))
+            for i, values in enumerate(rows.itertuples(index=False), start=start):
+                for column, value in enumerate(values):
+                    self.data_table.setItem(i, column, QTableWidgetItem('' if pd.isna(value) else str(value)))
+            self.data_table.resizeColumnsToContents()
+            self.next_rows_cursor = page['next']
         except Exception as e:
-            QMessageBox.critical(self, 'Error', f'PDF download error: {str(e)}')
+            QMessageBox.critical(self, 'Error', f'Rows error: {str(e)}')
+    
+    def download_pdf(self):
+        if not self.current_data:
+            return
+        self.download_report(self.current_data['id'])
+    
+    def download_history_pdf(self, item):
+        dataset_id = item.data(Qt.UserRole)
+        if dataset_id is None:
+            return
+        self.download_report(dataset_id)
+    
+    def download_report(self, dataset_id):
+        # Asked first, so the PDF is streamed straight into the chosen file
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, 'Save PDF Report', f'report_{dataset_id}.pdf', 'PDF Files (*.pdf)'
+        )
+        if not file_path:
+            return
+        self.run_task(
+            f'Downloading report {dataset_id}',
+            lambda transfer: download_file(transfer, f'/report/{dataset_id}/', file_path,
+                                           timeout=PROCESSING_READ_TIMEOUT),
+            lambda status_code: self.report_saved(file_path, status_code),
+        )
+    
+    def report_saved(self, file_path, status_code):
+        if status_code == 200:
+            QMessageBox.information(self, 'Success', f'PDF saved to {file_path}')
+        else:
+            QMessageBox.warning(self, 'Error', 'Failed to generate PDF')
     
     def load_history(self):
+        self.run_task('Loading history', lambda transfer: conditional_get(transfer, '/history/'),
+                      self.history_loaded)
+    
+    def history_loaded(self, result):
+        status_code, content = result
         try:
-            headers = {'Authorization': f'Token {TOKEN}'}
-            response = requests.get(f'{API_BASE_URL}/history/', headers=headers)
-            if response.status_code == 200:
-                history = response.json()
+            if status_code == 200:
+                history = json.loads(content)
                 self.history_list.clear()
                 self.history_data = history
                 if not history:
@@ -400,25 +835,10 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, 'Error', f'History error: {str(e)}')
     
-    def download_history_pdf(self, item):
-        try:
-            dataset_id = item.data(Qt.UserRole)
-            if dataset_id is None:
-                return
-            headers = {'Authorization': f'Token {TOKEN}'}
-            response = requests.get(f'{API_BASE_URL}/report/{dataset_id}/', headers=headers)
-            if response.status_code == 200:
-                file_path, _ = QFileDialog.getSaveFileName(
-                    self, 'Save PDF Report', f'report_{dataset_id}.pdf', 'PDF Files (*.pdf)'
-                )
-                if file_path:
-                    with open(file_path, 'wb') as f:
-                        f.write(response.content)
-                    QMessageBox.information(self, 'Success', 'PDF downloaded successfully')
-            else:
-                QMessageBox.warning(self, 'Error', 'Failed to generate PDF')
-        except Exception as e:
-            QMessageBox.critical(self, 'Error', f'Download error: {str(e)}')
+    def closeEvent(self, event):
+        for task in list(self.tasks):
+            task.cancel()
+        super().closeEvent(event)
 
 # ============================================================================
 # MAIN FUNCTION
@@ -427,6 +847,7 @@ class MainWindow(QMainWindow):
 def main():
     app = QApplication(sys.argv)
     app.setStyle('Fusion')
+    app.aboutToQuit.connect(NetworkTask.shutdown)
     login_window = LoginWindow()
     login_window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,52 @@
+"""
+Decoding the table formats of the backend's row, record and anomaly
+responses (see the backend's api/renderers.py) into pandas, column by
+column. requests asks for gzip (and brotli when the brotli package is
+installed) and decompresses on its own.
+
+Kept apart from main.py so that it imports without Qt: the backend's tests
+load this module and check that ``read_table`` decodes the same responses
+as ``api.renderers.read_table``. The two must stay in sync; change both
+when a format changes.
+"""
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+COLUMNAR_MEDIA_TYPE = 'application/vnd.equipment.columnar+json'
+ARROW_METADATA_KEY = b'response'
+
+
+def table_media_type():
+    """The most compact table format this client can decode"""
+    if pa is not None:
+        return ARROW_MEDIA_TYPE
+    if msgpack is not None:
+        return MSGPACK_MEDIA_TYPE
+    return COLUMNAR_MEDIA_TYPE
+
+
+def read_table(response, field):
+    """(DataFrame of the response's ``field``, the other fields)"""
+    media_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+    if media_type == ARROW_MEDIA_TYPE:
+        reader = pa.ipc.open_stream(response.content)
+        return reader.read_pandas(), json.loads(reader.schema.metadata[ARROW_METADATA_KEY])
+    data = msgpack.unpackb(response.content) if media_type == MSGPACK_MEDIA_TYPE else response.json()
+    table = data.pop(field, [])
+    if isinstance(table, dict):
+        return pd.DataFrame(table), data
+    return pd.DataFrame.from_records(table), data
@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { uploadCSV, getHistory, downloadPDF } from './api';
+import { uploadCSV, getHistory, downloadPDF, getRows } from './api';
 import { Bar } from 'react-chartjs-2';
 import {
   Chart as ChartJS,
@@ -24,6 +24,8 @@ ChartJS.register(
 function Dashboard({ onLogout }) {
   const [file, setFile] = useState(null);
   const [data, setData] = useState(null);
+  const [rows, setRows] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [history, setHistory] = useState([]);
   const [loading, setLoading] = useState(false);
 
@@ -41,6 +43,9 @@ function Dashboard({ onLogout }) {
     try {
       const result = await uploadCSV(file);
       setData(result);
+      const page = await getRows(result.id, { limit: 100 });
+      setRows(page.rows);
+      setNextCursor(page.next);
       alert('CSV uploaded successfully!');
     } catch (err) {
       alert('Error uploading file: ' + err.message);
@@ -48,6 +53,16 @@ function Dashboard({ onLogout }) {
     setLoading(false);
   };
 
+  const handleLoadMoreRows = async () => {
+    try {
+      const page = await getRows(data.id, { limit: 100, after: nextCursor });
+      setRows([...rows, ...page.rows]);
+      setNextCursor(page.next);
+    } catch (err) {
+      alert('Error loading rows: ' + err.message);
+    }
+  };
+
   const handleGetHistory = async () => {
     setLoading(true);
     try {
@@ -145,8 +160,8 @@ function Dashboard({ onLogout }) {
                 </tr>
               </thead>
               <tbody>
-                {data.data.map((item, index) => (
-                  <tr key={index}>
+                {rows.map((item) => (
+                  <tr key={item._row}>
                     <td>{item['Equipment Name']}</td>
                     <td>{item.Type}</td>
                     <td>{item.Flowrate}</td>
@@ -156,6 +171,11 @@ function Dashboard({ onLogout }) {
                 ))}
               </tbody>
             </table>
+            {nextCursor && (
+              <button onClick={handleLoadMoreRows}>
+                Load more rows ({rows.length} of {data.total_count})
+              </button>
+            )}
           </div>
 
           <button onClick={() => handleDownloadPDF(data.id)}>
@@ -33,6 +33,18 @@ export const uploadCSV = async (file) => {
   return response.data;
 };
 
+// Get a page of dataset rows API
+export const getRows = async (datasetId, params = {}) => {
+  const response = await axios.get(
+    `${API_BASE_URL}/datasets/${datasetId}/rows/`,
+    {
+      ...getAuthHeaders(),
+      params
+    }
+  );
+  return response.data;
+};
+
 // Get History API
 export const getHistory = async () => {
   const response = await axios.get(